@@ -3,7 +3,15 @@
 import re
 from backend.v1 import v1_router
 from backend.v2 import v2_router
+from backend.admin import admin_router
 from backend.database import create_tables
+from backend.cache import purge_expired_cache
+from backend.dataset import start_dataset_watcher
+from backend.tracing import TracingMiddleware
+from backend.profiling import ProfilingMiddleware
+from backend.static import IndexPage, PrecompressedStaticFiles, precompress
+from backend.upstream import redirect_upstream
+from backend.config import config, logger
 from pathlib import Path
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
@@ -47,11 +55,32 @@ app = FastAPI(
     openapi_url="/api/openapi.json",
 )
 
+if config.upstream_base_url:
+    redirect_upstream(config.upstream_base_url)
+
+app.add_middleware(ProfilingMiddleware)
+"""Sampled cProfile dumps of requests"""
+
+app.add_middleware(TracingMiddleware)
+"""Trace id and spans of every request"""
+
+
+build_path = (
+    project_path / config.frontend_build_directory
+    if config.frontend_build_directory
+    else None
+)
+
+index_page = IndexPage(build_path / "index.html") if build_path else None
+"""index.html of the frontend build kept in memory"""
+
 
 @app.get("/", name="index", response_class=HTMLResponse, include_in_schema=False)
 async def index(request: Request):
     """Serve index.html"""
     # return templates.TemplateResponse(request, name="index.html")
+    if index_page is not None:
+        return index_page.response(request.headers)
     return RedirectResponse("/api/docs")
 
 
@@ -64,4 +93,23 @@ app.include_router(v1_router, prefix="/api/v1", tags=["V1"])
 app.include_router(v2_router, prefix="/api/v2", tags=["V2"])
 """Route to v2 of the API"""
 
+app.include_router(admin_router, prefix="/api/admin", tags=["Admin"])
+"""Route to admin endpoints"""
+
 app.add_event_handler("startup", create_tables)
+
+app.add_event_handler("startup", purge_expired_cache)
+
+app.add_event_handler("startup", start_dataset_watcher)
+
+if build_path is not None:
+    app.mount("/", PrecompressedStaticFiles(directory=build_path), name="frontend")
+    """Route to frontend build files, fingerprinted ones cached for good"""
+
+    def precompress_frontend():
+        written = precompress(build_path)
+        if written:
+            logger.info(f"Precompressed {written} frontend files in {build_path}")
+
+    if config.frontend_precompress_on_startup:
+        app.add_event_handler("startup", precompress_frontend)
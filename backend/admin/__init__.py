@@ -0,0 +1,11 @@
+"""Admin endpoints for operating the API
+All of them require the `X-Admin-Token` header matching `admin_token` config.
+"""
+
+from fastapi import APIRouter, Depends
+from backend.admin.routes import router
+from backend.utils import verify_admin_token
+
+admin_router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+admin_router.include_router(router)
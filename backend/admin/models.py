@@ -0,0 +1,145 @@
+"""Pydantic models"""
+
+import typing as t
+from datetime import datetime
+from pydantic import BaseModel, Field, PositiveInt, model_validator
+
+
+class StatementShape(BaseModel):
+    """Execution stats of statements sharing the same shape"""
+
+    shape: str = Field(description="Statement with literals replaced by `?`")
+    count: int = Field(description="Number of executions")
+    slow_count: int = Field(description="Executions exceeding the slow threshold")
+    total_ms: float = Field(description="Total execution time in milliseconds")
+    mean_ms: float = Field(description="Mean execution time in milliseconds")
+    max_ms: float = Field(description="Longest execution time in milliseconds")
+    query_plan: t.Optional[list[str]] = Field(
+        None, description="EXPLAIN QUERY PLAN captured on first slow execution"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "shape": "SELECT movie.id, movie.title FROM movie WHERE movie.title LIKE ? LIMIT ? OFFSET ?",
+                "count": 42,
+                "slow_count": 3,
+                "total_ms": 512.4,
+                "mean_ms": 12.2,
+                "max_ms": 140.6,
+                "query_plan": ["SCAN movie"],
+            }
+        }
+    }
+
+
+class Metrics(BaseModel):
+    """Metrics of the worker process handling the request"""
+
+    values: dict[str, float] = Field(description="Counters and gauges by name")
+    ratios: dict[str, t.Optional[float]] = Field(
+        description="Ratios derived from counters. Null when nothing was counted"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "values": {
+                    "download_link.cache_hits": 30,
+                    "download_link.requests": 40,
+                    "prefetch.completed": 20,
+                    "prefetch.hits": 15,
+                    "prefetch.scheduled": 22,
+                },
+                "ratios": {
+                    "download_link.cache_hit_ratio": 0.75,
+                    "prefetch.hit_ratio": 0.75,
+                },
+            }
+        }
+    }
+
+
+class DatasetReload(BaseModel):
+    database_engine: t.Optional[str] = Field(
+        None, description="Url of the database to serve. Defaults to the one served"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {"database_engine": "sqlite:///assets/db.sqlite3"},
+        }
+    }
+
+
+class Dataset(BaseModel):
+    """Database being served"""
+
+    database_engine: str = Field(description="Url of the database")
+    version: str = Field(description="Digest identifying the dataset contents")
+    loaded_on: datetime = Field(description="When the dataset was loaded")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "database_engine": "sqlite:///assets/db.sqlite3",
+                "version": "3f1c2a9b0d4e",
+                "loaded_on": "2024-11-20T09:30:00Z",
+            }
+        }
+    }
+
+
+class WarmCache(BaseModel):
+    ids: t.Optional[list[PositiveInt]] = Field(
+        None, description="Particular movies to warm"
+    )
+    top: t.Optional[PositiveInt] = Field(
+        None, description="Number of top movies to warm when `ids` is not given"
+    )
+    by: t.Literal["year", "popularity"] = Field(
+        "year", description="Ranking of top movies"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {"ids": None, "top": 200, "by": "popularity"},
+        }
+    }
+
+    @model_validator(mode="after")
+    def validate_target(self):
+        if not self.ids and not self.top:
+            raise ValueError("Either ids or top has to be given")
+        return self
+
+
+class WarmProgress(BaseModel):
+    """Progress of warming download links cache"""
+
+    running: bool = Field(description="Whether warming is still in progress")
+    movies: int = Field(description="Movies to warm")
+    done: int = Field(description="Movies completed")
+    links: int = Field(description="Download links resolved")
+    saved: int = Field(description="Download links saved to cache")
+    fresh: int = Field(description="Download links already cached")
+    missing: int = Field(description="Qualities not available upstream")
+    failed: int = Field(description="Movies whose resolution failed")
+    started_on: datetime = Field(description="When warming started")
+    elapsed: float = Field(description="Seconds spent warming")
+    movies_per_second: float = Field(description="Throughput in movies")
+    links_per_second: float = Field(description="Throughput in download links")
+
+
+class Profile(BaseModel):
+    """Profile of a request saved by the profiling middleware"""
+
+    name: str = Field(description="Name of the profile, `.prof` and `.json` files")
+    method: str = Field(description="Request method")
+    path: str = Field(description="Request path")
+    route: str = Field(description="Path template of the route matched")
+    status_code: t.Optional[int] = Field(description="Response status code")
+    duration_ms: float = Field(description="Response time in milliseconds")
+    trace_id: t.Optional[str] = Field(None, description="Trace id of the request")
+    created_on: datetime = Field(description="When the request started")
+    size: int = Field(description="Size of the `.prof` file in bytes")
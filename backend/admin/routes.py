@@ -0,0 +1,113 @@
+"""Admin Routes"""
+
+import re
+import typing as t
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import FileResponse
+import backend.admin.models as models
+import backend.utils as utils
+from backend.database import query_stats, dataset
+from backend.dataset import reload_dataset
+import backend.warmer as warmer
+import backend.profiling as profiling
+from backend.metrics import metrics
+
+router = APIRouter()
+
+
+@router.get("/slow-queries", name="Slowest statements")
+async def slow_queries(
+    limit: int = Query(10, description="Total statement shapes not to exceed", gt=0)
+) -> list[models.StatementShape]:
+    """Statement shapes taking the most total execution time"""
+    return query_stats.top(limit)
+
+
+@router.get("/metrics", name="Worker metrics")
+async def worker_metrics() -> models.Metrics:
+    """Counters and gauges of the worker handling this request"""
+    return models.Metrics(
+        values=metrics.snapshot(),
+        ratios={
+            "download_link.cache_hit_ratio": metrics.ratio(
+                "download_link.cache_hits", "download_link.requests"
+            ),
+            "prefetch.hit_ratio": metrics.ratio("prefetch.hits", "prefetch.completed"),
+            "hybrid.upstream_fraction": metrics.ratio(
+                "hybrid.upstream_searches", "hybrid.searches"
+            ),
+        },
+    )
+
+
+@router.get("/dataset", name="Dataset served")
+async def dataset_served() -> models.Dataset:
+    """Database served by the worker handling this request"""
+    return dataset.model_dump()
+
+
+@router.post("/dataset/reload", name="Reload dataset")
+@utils.router_exception_handler
+async def reload_dataset_served(
+    target: t.Optional[models.DatasetReload] = None,
+) -> models.Dataset:
+    """Load a dataset, rebuild indexes and swap them in without downtime.
+
+    Applies to the worker handling this request right away and to the others
+    within `dataset_watch_interval_in_seconds`.
+    """
+    reloaded = await reload_dataset(
+        target.database_engine if target else None, announce=True
+    )
+    return reloaded.model_dump()
+
+
+@router.post(
+    "/warm-cache",
+    name="Warm download links cache",
+    status_code=status.HTTP_202_ACCEPTED,
+)
+@utils.router_exception_handler
+async def warm_cache(target: models.WarmCache) -> models.WarmProgress:
+    """Resolve and cache download links of many movies in the background"""
+    try:
+        job = warmer.start_warm_job(target.ids, target.top, target.by)
+    except warmer.WarmingInProgress as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return job.progress.model_dump()
+
+
+@router.get("/warm-cache", name="Cache warming progress")
+async def warm_cache_progress() -> models.WarmProgress:
+    """Progress of the latest cache warming in this worker"""
+    if warmer.warm_job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cache has not been warmed by this worker.",
+        )
+    return warmer.warm_job.progress.model_dump()
+
+
+@router.get("/profiles", name="Recent profiles")
+async def recent_profiles(
+    limit: int = Query(20, description="Total profiles not to exceed", gt=0)
+) -> list[models.Profile]:
+    """Profiles of requests saved by this host, newest first"""
+    return profiling.recent_profiles(limit)
+
+
+@router.get("/profiles/{name}", name="Download profile")
+async def download_profile(name: str) -> FileResponse:
+    """Download a profile in pstats format.
+
+    View it with `snakeviz` or `python -m pstats`.
+    """
+    path = profiling.profiles_directory() / f"{name}.prof"
+    if not re.fullmatch(r"[\w-]+", name) or not path.exists():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile does not exist.",
+        )
+    return FileResponse(
+        path, media_type="application/octet-stream", filename=f"{name}.prof"
+    )
@@ -0,0 +1,225 @@
+"""Cache shared by all workers serving the API
+
+Backends are selected through `cache_backend` config using a url:
+- `disk:///assets/cache.sqlite3` : On-disk store safe for concurrent processes.
+- `memory://` : Per-process store, mostly for tests.
+- `redis://localhost:6379/0` : Redis-compatible server (requires `redis`).
+- `none://` : Disables caching.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import hashlib
+import typing as t
+from abc import ABC, abstractmethod
+from pathlib import Path
+from urllib.parse import urlparse
+from backend.config import config, logger
+
+
+class CacheBackend(ABC):
+    """Interface for key-value stores holding JSON-serializable values"""
+
+    @abstractmethod
+    def get(self, key: str) -> t.Any | None:
+        """Get value of a key or None if missing or expired"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: t.Any, ttl: int) -> None:
+        """Save value of a key for `ttl` seconds"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove a key"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove all keys"""
+        raise NotImplementedError
+
+    def purge_expired(self) -> None:
+        """Remove expired keys. Backends with native expiry do nothing"""
+
+
+class NullCache(CacheBackend):
+    """Cache that stores nothing"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """Cache local to the current process"""
+
+    def __init__(self):
+        self._store: dict[str, tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._store.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._store[key]
+                return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._store[key] = (time.time() + ttl, json.dumps(value))
+
+    def delete(self, key):
+        with self._lock:
+            self._store.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (exp, _) in self._store.items() if exp < now]:
+                del self._store[key]
+
+
+class DiskCache(CacheBackend):
+    """Cache persisted in an sqlite3 file.
+
+    SQLite's file locking makes it safe to share among several worker
+    processes while WAL mode lets readers proceed during writes.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=config.sqlite_busy_timeout / 1000)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def purge_expired(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+
+class RedisCache(CacheBackend):
+    """Cache kept in a Redis-compatible server"""
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis cache backend requires the `redis` package - "
+                "pip install redis"
+            ) from e
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def clear(self):
+        self.client.flushdb()
+
+
+def get_cache_backend(url: str) -> CacheBackend:
+    """Initialize cache backend from url
+
+    Args:
+        url (str): Cache url e.g `disk:///assets/cache.sqlite3`
+
+    Returns:
+        CacheBackend: Initialized backend.
+    """
+    parsed = urlparse(url)
+    match parsed.scheme:
+        case "disk":
+            return DiskCache(parsed.path[1:] or "assets/cache.sqlite3")
+        case "memory":
+            return MemoryCache()
+        case "redis" | "rediss" | "unix":
+            return RedisCache(url)
+        case "none":
+            return NullCache()
+    raise ValueError(f"Unsupported cache backend - {url}")
+
+
+def make_key(namespace: str, *parts: t.Any) -> str:
+    """Builds cache key from namespace and JSON-serializable parts"""
+    digest = hashlib.sha1(
+        json.dumps(parts, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+cache = get_cache_backend(config.cache_backend)
+"""Initialized cache backend"""
+
+
+def purge_expired_cache():
+    logger.info("Purging expired entries from cache")
+    try:
+        cache.purge_expired()
+    except Exception as e:
+        logger.warning(f"Failed to purge expired cache entries - {e}")
@@ -1,6 +1,6 @@
 """Contains configuration"""
 
-from pydantic import BaseModel, field_validator, PositiveInt
+from pydantic import BaseModel, field_validator, PositiveInt, NonNegativeInt, confloat
 from dotenv import dotenv_values
 from pathlib import Path
 import typing as t
@@ -17,6 +17,100 @@ class Config(BaseModel):
     search_limit_per_query: t.Optional[PositiveInt] = 100
     search_stream_limit_per_query: t.Optional[PositiveInt] = 500
     download_link_cache_duration_in_hours: t.Optional[PositiveInt] = 24
+    suggest_limit_per_query: t.Optional[PositiveInt] = 20
+    similar_movies_per_movie: t.Optional[PositiveInt] = 20
+    export_chunk_size: t.Optional[PositiveInt] = 1_000
+    index_refresh_interval_in_seconds: t.Optional[PositiveInt] = 300
+    # Reload dataset once its sqlite file is replaced or another worker
+    # reloaded it. 0 disables watching, leaving workers on their own datasets
+    dataset_watch_interval_in_seconds: t.Optional[NonNegativeInt] = 5
+    # Dataset last reloaded through the admin API, followed by every worker
+    dataset_pointer_path: t.Optional[str] = "assets/dataset.json"
+    # Serve catalog rows validated at ingest without validating them per request
+    trust_validated_catalog: t.Optional[bool] = True
+
+    # SQLite performance profile applied on every new connection
+    sqlite_journal_mode: t.Optional[
+        t.Literal["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"]
+    ] = "WAL"
+    sqlite_synchronous: t.Optional[t.Literal["OFF", "NORMAL", "FULL", "EXTRA"]] = (
+        "NORMAL"
+    )
+    sqlite_mmap_size: t.Optional[NonNegativeInt] = 268_435_456
+    sqlite_cache_size: t.Optional[int] = -65_536
+    sqlite_busy_timeout: t.Optional[NonNegativeInt] = 5_000
+    sqlite_read_only_readers: t.Optional[bool] = True
+    slow_query_threshold_in_ms: t.Optional[confloat(ge=0)] = 100
+
+    # Cache shared among workers for upstream results
+    cache_backend: t.Optional[str] = "disk:///assets/cache.sqlite3"
+    cache_search_ttl_in_seconds: t.Optional[NonNegativeInt] = 600
+    cache_metadata_ttl_in_seconds: t.Optional[NonNegativeInt] = 3_600
+    # Empty search results and deterministic upstream failures
+    cache_negative_ttl_in_seconds: t.Optional[NonNegativeInt] = 60
+
+    # Time allowed for all upstream calls made by a request
+    search_deadline_in_seconds: t.Optional[confloat(gt=0)] = 30
+    search_stream_deadline_in_seconds: t.Optional[confloat(gt=0)] = 120
+    metadata_deadline_in_seconds: t.Optional[confloat(gt=0)] = 20
+    download_link_deadline_in_seconds: t.Optional[confloat(gt=0)] = 30
+
+    # Upstream results pages a hybrid search may go through for its shortfall
+    hybrid_upstream_max_pages: t.Optional[PositiveInt] = 3
+
+    # Write-behind of resolved download links to the cache
+    link_writer_queue_size: t.Optional[PositiveInt] = 1_000
+    link_writer_batch_size: t.Optional[PositiveInt] = 100
+    link_writer_max_delay_in_ms: t.Optional[NonNegativeInt] = 200
+
+    # Background prefetching of download links after metadata views
+    prefetch_download_links: t.Optional[bool] = False
+    prefetch_workers: t.Optional[PositiveInt] = 1
+    prefetch_queue_size: t.Optional[PositiveInt] = 100
+    prefetch_budget_per_minute: t.Optional[NonNegativeInt] = 30
+
+    # Seconds between flushes of in-memory movie view counters
+    popularity_flush_interval_in_seconds: t.Optional[PositiveInt] = 30
+
+    # Bulk warming of download links cache
+    warm_workers: t.Optional[PositiveInt] = 4
+    warm_requests_per_second: t.Optional[confloat(gt=0)] = 5
+    warm_batch_size: t.Optional[PositiveInt] = 50
+
+    # Caching proxy of cover photos. v2 responses point cover photos to the
+    # proxy when `cover_proxy_url`, the public url of this API, is set.
+    cover_cache_directory: t.Optional[str] = "assets/covers"
+    cover_cache_max_bytes: t.Optional[PositiveInt] = 200_000_000
+    cover_deadline_in_seconds: t.Optional[confloat(gt=0)] = 10
+    cover_max_age_in_seconds: t.Optional[NonNegativeInt] = 604_800
+    cover_proxy_url: t.Optional[str] = None
+    cover_proxy_size: t.Optional[t.Literal["small", "medium", "original"]] = "medium"
+    # Comma-separated hosts covers are fetched from, subdomains included.
+    cover_allowed_hosts: t.Optional[str] = "fzmovies.net"
+
+    # Built frontend, e.g. frontend/dist, served with precompressed files.
+    # Frontend sources are served as they are when not set.
+    frontend_build_directory: t.Optional[str] = None
+    frontend_precompress_on_startup: t.Optional[bool] = True
+
+    # Request tracing
+    tracing_exporter: t.Optional[str] = "none://"
+    tracing_sample_rate: t.Optional[confloat(ge=0, le=1)] = 1.0
+
+    # Sampled cProfile dumps of requests. Comma-separated path prefixes in
+    # `profiling_routes` are always profiled while enabled.
+    profiling_enabled: t.Optional[bool] = False
+    profiling_sample_rate: t.Optional[confloat(ge=0, le=1)] = 0.01
+    profiling_routes: t.Optional[str] = ""
+    profiling_directory: t.Optional[str] = "assets/profiles"
+    profiling_max_files: t.Optional[PositiveInt] = 100
+
+    # Server receiving upstream requests instead of the real site, e.g. the
+    # fake upstream of `benchmarks.fake_upstream` for load tests.
+    upstream_base_url: t.Optional[str] = None
+
+    # Token required by admin endpoints. They are disabled when not set.
+    admin_token: t.Optional[str] = None
 
     @field_validator("database_engine")
     def validate_database_engine(value):
@@ -1,5 +1,15 @@
+import re
+import os
+import json
+import time
+import hashlib
+import threading
+import typing as t
+from datetime import datetime
 from sqlalchemy import (
     create_engine,
+    event,
+    text,
     Column,
     Integer,
     String,
@@ -7,13 +17,199 @@ from sqlalchemy import (
     ForeignKey,
     DateTime,
 )
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from backend.config import config
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import (
+    declarative_base,
+    sessionmaker,
+    relationship,
+    configure_mappers,
+)
+from backend.config import config, logger
 from backend.utils import utcnow
+from backend.tracing import instrument_engine
+
+
+def sqlite_pragmas(read_only: bool = False) -> list[str]:
+    """PRAGMA statements making up the configured SQLite profile
+
+    Args:
+        read_only (bool, optional): Exclude statements requiring write access.
+            Defaults to False.
+
+    Returns:
+        list[str]: PRAGMA statements.
+    """
+    pragmas = [
+        f"PRAGMA busy_timeout = {config.sqlite_busy_timeout}",
+        f"PRAGMA cache_size = {config.sqlite_cache_size}",
+        f"PRAGMA mmap_size = {config.sqlite_mmap_size}",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        pragmas.extend(
+            [
+                f"PRAGMA journal_mode = {config.sqlite_journal_mode}",
+                f"PRAGMA synchronous = {config.sqlite_synchronous}",
+            ]
+        )
+    return pragmas
+
+
+def apply_sqlite_profile(engine: Engine, read_only: bool = False) -> Engine:
+    """Runs the SQLite profile on every connection opened by the engine
+
+    Args:
+        engine (Engine): Db engine.
+        read_only (bool, optional): Engine connections are read-only.
+            Defaults to False.
+
+    Returns:
+        Engine: Same engine.
+    """
+    if engine.dialect.name != "sqlite":
+        return engine
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in sqlite_pragmas(read_only):
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+class QueryStats:
+    """Execution time of statements aggregated by their shape"""
+
+    literals_pattern = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    placeholders_pattern = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+    def __init__(self):
+        self.shapes: dict[str, dict[str, t.Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shape_of(cls, statement: str) -> str:
+        """Statement with literals and placeholder lists collapsed"""
+        shape = cls.literals_pattern.sub("?", " ".join(statement.split()))
+        return cls.placeholders_pattern.sub("(?)", shape)
+
+    def record(self, statement: str, duration_ms: float, slow: bool) -> dict:
+        shape = self.shape_of(statement)
+        with self._lock:
+            stats = self.shapes.setdefault(
+                shape,
+                dict(
+                    shape=shape,
+                    count=0,
+                    slow_count=0,
+                    total_ms=0.0,
+                    max_ms=0.0,
+                    query_plan=None,
+                ),
+            )
+            stats["count"] += 1
+            stats["slow_count"] += slow
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        return stats
+
+    def top(self, limit: int = 10) -> list[dict[str, t.Any]]:
+        """Statement shapes taking most total time"""
+        with self._lock:
+            shapes = sorted(
+                self.shapes.values(), key=lambda stats: stats["total_ms"], reverse=True
+            )[:limit]
+            return [
+                dict(stats, mean_ms=stats["total_ms"] / stats["count"])
+                for stats in shapes
+            ]
 
-engine = create_engine(config.database_engine)
+    def clear(self):
+        with self._lock:
+            self.shapes.clear()
+
+
+query_stats = QueryStats()
+"""Execution time of statements run by the engines"""
+
+
+def log_slow_queries(engine: Engine) -> Engine:
+    """Log statements slower than `slow_query_threshold_in_ms`
+
+    The query plan of sqlite statements is captured the first
+    time each statement shape turns out slow.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_duration(conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - context._query_start) * 1000
+        slow = duration_ms >= config.slow_query_threshold_in_ms
+        stats = query_stats.record(statement, duration_ms, slow)
+        if not slow:
+            return
+        logger.warning(
+            f"Slow query ({duration_ms:.2f}ms) - {' '.join(statement.split())} "
+            f"- parameters {parameters}"
+        )
+        if (
+            stats["query_plan"] is None
+            and engine.dialect.name == "sqlite"
+            and not executemany
+            and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))
+        ):
+            explain_cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                explain_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                stats["query_plan"] = [row[-1] for row in explain_cursor.fetchall()]
+                logger.warning(f"Query plan - {stats['query_plan']}")
+            except Exception as e:
+                stats["query_plan"] = [f"Unavailable - {e}"]
+            finally:
+                explain_cursor.close()
+
+    return engine
+
+
+def prepare_engine(engine: Engine, read_only: bool = False) -> Engine:
+    """Applies sqlite profile, tracing and slow query log to the engine"""
+    return log_slow_queries(
+        instrument_engine(apply_sqlite_profile(engine, read_only=read_only))
+    )
+
+
+def create_reader_engine(engine: Engine) -> Engine:
+    """Creates an engine whose connections can only read the database.
+
+    Falls back to the given engine for non-file and non-sqlite databases.
+    """
+    url = engine.url
+    if (
+        not config.sqlite_read_only_readers
+        or engine.dialect.name != "sqlite"
+        or url.database in (None, "", ":memory:")
+    ):
+        return engine
+    reader_url = url.set(
+        database=f"file:{url.database}",
+        query={**url.query, "mode": "ro", "uri": "true"},
+    )
+    return prepare_engine(create_engine(reader_url), read_only=True)
+
+
+engine = prepare_engine(create_engine(config.database_engine))
 """Initialized db engine"""
 
+reader_engine = create_reader_engine(engine)
+"""Initialized read-only db engine for catalog queries"""
+
 Base = declarative_base()
 
 Session = sessionmaker(bind=engine)
@@ -22,6 +218,94 @@ Session = sessionmaker(bind=engine)
 session = Session()
 """Initialized db session"""
 
+ReaderSession = sessionmaker(bind=reader_engine)
+"""Un-initialized read-only db session"""
+
+reader_session = ReaderSession()
+"""Initialized read-only db session"""
+
+
+def create_engines(database_engine: str) -> tuple[Engine, Engine]:
+    """Creates db engine and its read-only counterpart for a database url"""
+    new_engine = prepare_engine(create_engine(database_engine))
+    return new_engine, create_reader_engine(new_engine)
+
+
+def dataset_version(db_engine: Engine) -> str:
+    """Short digest identifying the dataset served by an engine.
+
+    Covers the database file identity, which changes when a new file is moved
+    into place, and a summary of the catalog contents.
+    """
+    parts: list[t.Any] = [str(db_engine.url)]
+    database = db_engine.url.database
+    if db_engine.dialect.name == "sqlite" and database and os.path.exists(database):
+        stat = os.stat(database)
+        parts.extend([stat.st_dev, stat.st_ino])
+    try:
+        with db_engine.connect() as conn:
+            parts.extend(
+                conn.execute(
+                    text(
+                        "SELECT (SELECT COUNT(id) FROM movie),"
+                        " (SELECT MAX(id) FROM movie),"
+                        " (SELECT COUNT(id) FROM movie_genre)"
+                    )
+                ).first()
+            )
+    except OperationalError:
+        # Catalog tables are missing
+        pass
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:12]
+
+
+class Dataset:
+    """Database being served. Updated in place whenever it is swapped"""
+
+    def __init__(self, database_engine: str, version: str):
+        self.database_engine = database_engine
+        self.version = version
+        self.loaded_on = utcnow()
+
+    def model_dump(self) -> dict[str, str | datetime]:
+        return dict(
+            database_engine=self.database_engine,
+            version=self.version,
+            loaded_on=self.loaded_on,
+        )
+
+
+dataset = Dataset(config.database_engine, dataset_version(engine))
+"""Database currently served"""
+
+
+def swap_engines(
+    new_engine: Engine, new_reader_engine: Engine, database_engine: str, version: str
+) -> tuple[Engine, Engine]:
+    """Point all sessions at other engines.
+
+    Has to be called from the event loop thread, the only user of the global
+    sessions, so requests never see a half swapped state.
+
+    Returns:
+        tuple[Engine, Engine]: Replaced engine and read-only engine.
+    """
+    global engine, reader_engine
+    replaced = engine, reader_engine
+    Session.configure(bind=new_engine)
+    ReaderSession.configure(bind=new_reader_engine)
+    for db_session, bind in (
+        (session, new_engine),
+        (reader_session, new_reader_engine),
+    ):
+        db_session.close()
+        db_session.bind = bind
+    engine, reader_engine = new_engine, new_reader_engine
+    dataset.database_engine = database_engine
+    dataset.version = version
+    dataset.loaded_on = utcnow()
+    return replaced
+
 
 class Category(Base):
     __tablename__ = "category"
@@ -44,6 +328,7 @@ class MovieGenre(Base):
     movie_id = Column(
         Integer,
         ForeignKey("movie.id", onupdate="CASCADE", ondelete="CASCADE"),
+        index=True,
     )
     genre_id = Column(
         Integer,
@@ -127,10 +412,48 @@ class BestDownloadLink(Base):
         return dict(filename=self.filename, url=self.url)
 
 
+class MovieStats(Base):
+    __tablename__ = "movie_stats"
+    id = Column(
+        Integer,
+        ForeignKey(
+            "movie.id",
+            ondelete="CASCADE",
+            onupdate="CASCADE",
+        ),
+        primary_key=True,
+    )
+    movie_views = Column(Integer, nullable=False, default=0)
+    metadata_views = Column(Integer, nullable=False, default=0)
+    download_link_views = Column(Integer, nullable=False, default=0)
+    hits = Column(Integer, nullable=False, default=0, index=True)
+    updated_on = Column(
+        DateTime,
+        default=utcnow,
+        onupdate=utcnow,
+    )
+
+
+configure_mappers()
+"""Sets up backrefs such as `Movie.category` for use in loader options"""
+
+
+def create_schema(db_engine: Engine):
+    """Creates missing tables and indexes.
+
+    `create_all` only indexes the tables it creates, so indexes added since a
+    dataset was built are created on its existing tables too.
+    """
+    Base.metadata.create_all(db_engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db_engine, checkfirst=True)
+
+
 def create_tables(drop_all: bool = False):
     if drop_all:
         Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
+    create_schema(engine)
 
 
 if __name__ == "__main__":
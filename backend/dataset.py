@@ -0,0 +1,176 @@
+"""Hot reload of the movies dataset
+
+A new dataset is opened and every catalog index is built from it in the
+background while the current one keeps being served. Sessions and indexes
+are then swapped in a single step on the event loop and the dataset version,
+part of catalog-dependent cache keys, changes so that stale entries are
+never read again.
+
+Reloads are triggered through the admin API or by replacing the sqlite file
+served when `dataset_watch_interval_in_seconds` is set, for instance:
+
+    mv assets/db.sqlite3.part assets/db.sqlite3
+
+Admin reloads reach a single worker. That worker announces the dataset in the
+file at `dataset_pointer_path`, which the other workers poll along with the
+sqlite file and follow.
+"""
+
+import asyncio
+import json
+import os
+import re
+import uuid
+import typing as t
+from pathlib import Path
+from sqlalchemy.orm import sessionmaker
+import backend.database as database
+from backend.config import config, logger
+from backend.metrics import metrics
+from backend.v2 import indexes
+from backend.v2.popularity import popularity
+
+_reload_lock = asyncio.Lock()
+
+_served: dict[str, t.Any] = {}
+"""Identity of the sqlite file last loaded and the announcement last followed"""
+
+
+def sqlite_path(database_engine: str) -> Path | None:
+    """Path to the file of an sqlite database url"""
+    match = re.match(r"sqlite:///(.+)", database_engine)
+    return Path(match.group(1)) if match else None
+
+
+def file_identity(database_engine: str) -> tuple[int, int] | None:
+    """Device and inode of an sqlite database file"""
+    path = sqlite_path(database_engine)
+    if path is None or not path.exists():
+        return None
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+
+def read_announcement() -> dict[str, str] | None:
+    """Dataset last announced to every worker"""
+    if not config.dataset_pointer_path:
+        return None
+    try:
+        return json.loads(Path(config.dataset_pointer_path).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def announce_dataset(database_engine: str) -> str | None:
+    """Point every worker at a dataset
+
+    Returns:
+        str | None: Id of the announcement, None when announcing is disabled.
+    """
+    if not config.dataset_pointer_path:
+        return None
+    path = Path(config.dataset_pointer_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    announcement = uuid.uuid4().hex
+    part = path.with_name(f"{path.name}.{os.getpid()}.part")
+    part.write_text(
+        json.dumps(dict(database_engine=database_engine, announcement=announcement))
+    )
+    # Workers never read a half written announcement
+    os.replace(part, path)
+    return announcement
+
+
+def _open(database_engine: str):
+    path = sqlite_path(database_engine)
+    if path is not None and not path.exists():
+        raise AssertionError(f"Database engine does not exists - {database_engine}")
+    engine, reader_engine = database.create_engines(database_engine)
+    # Tables and indexes added since the dataset was built may be missing
+    database.create_schema(engine)
+    with sessionmaker(bind=reader_engine)() as session:
+        staged = indexes.stage(session)
+    return engine, reader_engine, staged, database.dataset_version(engine)
+
+
+async def reload_dataset(
+    database_engine: str | None = None, announce: bool = False
+) -> database.Dataset:
+    """Serve another database, or the current one afresh, without downtime
+
+    Args:
+        database_engine (str | None, optional): Url of the database to serve. Defaults to the one served.
+        announce (bool, optional): Have the other workers follow. Defaults to False.
+
+    Returns:
+        database.Dataset: Dataset served after the reload.
+    """
+    database_engine = database_engine or database.dataset.database_engine
+    async with _reload_lock:
+        logger.info(f"Loading dataset from {database_engine}")
+        engine, reader_engine, staged, version = await asyncio.to_thread(
+            _open, database_engine
+        )
+        # Views so far belong to the dataset being replaced
+        await asyncio.to_thread(popularity.flush_quietly)
+        # Nothing below awaits so requests never see a mix of both datasets
+        replaced = database.swap_engines(
+            engine, reader_engine, database_engine, version
+        )
+        for index, replacement in staged:
+            index.take_over(replacement)
+        config.database_engine = database_engine
+        _served["identity"] = file_identity(database_engine)
+        metrics.increment("dataset.reloads")
+        logger.info(f"Serving dataset {version} from {database_engine}")
+        if announce:
+            _served["announcement"] = await asyncio.to_thread(
+                announce_dataset, database_engine
+            )
+    for old_engine in set(replaced):
+        # Connections still checked out are closed once returned
+        old_engine.dispose()
+    return database.dataset
+
+
+async def follow_dataset() -> bool:
+    """Reload the dataset if it was announced anew or its sqlite file replaced
+
+    Returns:
+        bool: Whether a reload was attempted.
+    """
+    announced = read_announcement()
+    if announced and announced["announcement"] != _served.get("announcement"):
+        # Recorded first so that a failing reload is not retried every poll
+        _served["announcement"] = announced["announcement"]
+        await reload_dataset(announced["database_engine"])
+        return True
+    current = file_identity(config.database_engine)
+    if current is None or current == _served.get("identity", current):
+        return False
+    await reload_dataset()
+    return True
+
+
+async def watch_dataset():
+    """Reload the dataset whenever it is announced or its sqlite file replaced"""
+    _served.setdefault("identity", file_identity(config.database_engine))
+    announced = read_announcement()
+    if announced and announced["database_engine"] == config.database_engine:
+        # Already served, workers started since then follow the other ones
+        _served.setdefault("announcement", announced["announcement"])
+    while True:
+        await asyncio.sleep(config.dataset_watch_interval_in_seconds)
+        try:
+            await follow_dataset()
+        except Exception as e:
+            logger.exception(e)
+
+
+_watcher: asyncio.Task | None = None
+
+
+async def start_dataset_watcher():
+    global _watcher
+    if config.dataset_watch_interval_in_seconds:
+        _watcher = asyncio.create_task(watch_dataset())
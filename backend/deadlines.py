@@ -0,0 +1,90 @@
+"""Deadlines and cancellation of upstream work
+
+Every route scraping fzmovies gets a time budget shared by all its upstream
+calls. The calls run in worker threads one step at a time, such as a search
+results page or a link resolution, so the event loop is never blocked. The
+client connection and remaining budget are checked before each step, so
+abandoned and late requests stop making upstream requests.
+
+A step that overruns the deadline cannot be interrupted. Its thread runs to
+completion in the background but its result is discarded.
+"""
+
+import asyncio
+import time
+import typing as t
+from fastapi import Request
+from backend.metrics import metrics
+
+
+class DeadlineExceeded(Exception):
+    """Upstream work ran out of its time budget"""
+
+
+class ClientDisconnected(Exception):
+    """Client went away before upstream work was complete"""
+
+
+class UpstreamBudget:
+    """Time budget and cancellation of upstream work of a single request
+
+    Args:
+        route (str): Route name used in metrics.
+        seconds (float): Time allowed for all upstream calls.
+        request (Request | None, optional): Request whose client is watched for disconnection. Defaults to None.
+    """
+
+    def __init__(self, route: str, seconds: float, request: Request | None = None):
+        self.route = route
+        self.deadline = time.monotonic() + seconds
+        self.request = request
+
+    @property
+    def remaining(self) -> float:
+        """Seconds left for upstream calls"""
+        return self.deadline - time.monotonic()
+
+    def cancel(self, reason: t.Literal["disconnected", "deadline"], pending: int):
+        """Record upstream work abandoned
+
+        Args:
+            reason (t.Literal["disconnected", "deadline"]): Why work was abandoned.
+            pending (int): Upstream steps that will not run or whose results are discarded.
+        """
+        metrics.increment(f"upstream.cancelled.{reason}")
+        metrics.increment(f"upstream.{self.route}.cancelled.{reason}")
+        metrics.increment(f"upstream.steps_cancelled.{reason}", pending)
+
+    async def check(self, pending: int = 1) -> None:
+        """Raise when the remaining upstream work should be abandoned
+
+        Args:
+            pending (int, optional): Upstream steps left including the next. Defaults to 1.
+        """
+        if self.request is not None and await self.request.is_disconnected():
+            self.cancel("disconnected", pending)
+            raise ClientDisconnected(f"Client disconnected from {self.route}")
+        if self.remaining <= 0:
+            self.cancel("deadline", pending)
+            raise DeadlineExceeded(f"Upstream deadline of {self.route} exceeded")
+
+    async def run(self, func: t.Callable, *args, pending: int = 1) -> t.Any:
+        """Run one blocking upstream step in a worker thread within the budget
+
+        Args:
+            func (t.Callable): Upstream step.
+            pending (int, optional): Upstream steps left including this one. Defaults to 1.
+
+        Returns:
+            t.Any: Value returned by `func`.
+        """
+        await self.check(pending)
+        try:
+            result = await asyncio.wait_for(
+                asyncio.to_thread(func, *args), self.remaining
+            )
+        except TimeoutError:
+            self.cancel("deadline", pending)
+            raise DeadlineExceeded(f"Upstream deadline of {self.route} exceeded")
+        metrics.increment("upstream.steps_completed")
+        return result
@@ -0,0 +1,128 @@
+"""Resolves and caches links to downloadable movie files"""
+
+import typing as t
+from datetime import timedelta
+from sqlalchemy.orm import Session as DBSession
+import fzmovies_api.models as fz_models
+from fzmovies_api import Navigate, DownloadLinks, Download
+from backend.config import config
+from backend.database import NormalDownloadLink, BestDownloadLink
+from backend.tracing import span
+from backend.utils import utcnow
+
+quality_model_map = {
+    "normal": NormalDownloadLink,
+    "best": BestDownloadLink,
+}
+
+quality_file_index = {
+    "normal": 0,
+    "best": 1,
+}
+"""Position of each quality in a movie page's files"""
+
+
+class MissingFile(LookupError):
+    """Movie page lists no file of the requested quality"""
+
+
+class MissingDownloadLink(LookupError):
+    """Movie file page lists no download links"""
+
+
+def navigate(movie_url: str) -> fz_models.MovieFiles:
+    """Scrape files listed in a movie page"""
+    with span("fzmovies.Navigate", url=movie_url):
+        nav = Navigate(
+            fz_models.MovieInSearch(
+                url=movie_url,
+                title="",
+                year=1,
+                distribution="",
+                about="",
+                cover_photo="https://somelink-here",
+            )
+        )
+        return nav.results
+
+
+def download_links(file_url: str) -> tuple[str, str]:
+    """Scrape filename and first download link of a movie file's page"""
+    with span("fzmovies.DownloadLinks", url=str(file_url)):
+        download_movie = DownloadLinks(
+            fz_models.FileMetadata(
+                title="some-movie-title",
+                url=file_url,
+                size="",
+                hits=0,
+                mediainfo="https://yet-another-link",
+            )
+        ).results
+    if not download_movie.links:
+        raise MissingDownloadLink(f"No download links listed in {file_url}")
+    return download_movie.filename, download_movie.links[0]
+
+
+def final_url(link: str) -> str:
+    """Follow a download link to the downloadable file"""
+    with span("fzmovies.Download", url=str(link)):
+        return str(Download(link).last_url)
+
+
+def quality_file(
+    files: fz_models.MovieFiles, quality: t.Literal["normal", "best"]
+) -> fz_models.FileMetadata:
+    """File of the given quality among those listed in a movie page"""
+    index = quality_file_index[quality]
+    if len(files.files) <= index:
+        raise MissingFile(f"Movie has no file of {quality} quality")
+    return files.files[index]
+
+
+def resolve_download_link(
+    files: fz_models.MovieFiles, quality: t.Literal["normal", "best"]
+) -> tuple[str, str]:
+    """Follow a movie page's file of the given quality to its downloadable link
+
+    Args:
+        files (fz_models.MovieFiles): Files listed in the movie page.
+        quality (t.Literal["normal", "best"]): Movie file quality.
+
+    Returns:
+        tuple[str, str]: Filename and link to downloadable file.
+    """
+    filename, link = download_links(quality_file(files, quality).url)
+    return filename, final_url(link)
+
+
+def is_fresh(cached_results: BestDownloadLink | None) -> bool:
+    """Checks whether a cached download link has not expired"""
+    return bool(cached_results) and (
+        utcnow().replace(tzinfo=None) - cached_results.updated_on
+    ) < timedelta(hours=config.download_link_cache_duration_in_hours)
+
+
+def save_download_links(
+    db_session: DBSession,
+    links: t.Iterable[tuple[int, t.Literal["normal", "best"], str, str]],
+) -> int:
+    """Insert or update many cached download links in a single transaction
+
+    Args:
+        db_session (DBSession): Db session.
+        links (t.Iterable[tuple[int, t.Literal["normal", "best"], str, str]]): Movie id, quality, filename and url of each link.
+
+    Returns:
+        int: Number of links saved.
+    """
+    saved = 0
+    for id, quality, filename, url in links:
+        db_session.merge(
+            quality_model_map[quality](
+                id=id, filename=filename, url=url, updated_on=utcnow()
+            )
+        )
+        saved += 1
+    with span("db.commit", rows=saved):
+        db_session.commit()
+    return saved
@@ -0,0 +1,262 @@
+"""Exports the whole movies catalog in chunks
+
+Movies are read in fixed-size chunks ordered by id, so memory use does not
+grow with the catalog and an export can be resumed from the last id written.
+
+Usage:
+    python -m backend.export --format csv --gzip --output catalog.csv.gz
+"""
+
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import sys
+import zlib
+import typing as t
+from sqlalchemy import text
+from sqlalchemy.orm import Session as DBSession
+from backend.config import config
+from backend.database import ReaderSession
+
+columns = (
+    "id",
+    "title",
+    "year",
+    "distribution",
+    "description",
+    "url",
+    "cover_photo",
+    "category",
+    "genres",
+)
+"""Fields of every exported movie"""
+
+formats = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+"""Media type and file extension of export formats"""
+
+
+def catalog_chunks(
+    session: DBSession,
+    after_id: int = 0,
+    until_id: int | None = None,
+    chunk_size: int | None = None,
+) -> t.Generator[list[dict[str, t.Any]], None, None]:
+    """Movies with category and genres joined, in chunks ordered by id
+
+    Args:
+        session (DBSession): Db session.
+        after_id (int, optional): Export movies with ids greater than this. Defaults to 0.
+        until_id (int | None, optional): Export movies with ids up to this. Defaults to None.
+        chunk_size (int | None, optional): Movies per chunk. Defaults to `export_chunk_size`.
+
+    Yields:
+        list[dict[str, t.Any]]: Chunk of movies.
+    """
+    chunk_size = chunk_size or config.export_chunk_size
+    last_id = after_id
+    while True:
+        movies = [
+            dict(row._mapping, genres=[])
+            for row in session.execute(
+                text(
+                    "SELECT movie.id, movie.title, movie.year, movie.distribution,"
+                    " movie.description, movie.url, movie.cover_photo,"
+                    " category.name AS category FROM movie"
+                    " LEFT JOIN category ON category.id = movie.category_id"
+                    " WHERE movie.id > :last_id AND movie.id <= :until_id"
+                    " ORDER BY movie.id LIMIT :chunk_size"
+                ),
+                dict(
+                    last_id=last_id,
+                    until_id=until_id if until_id is not None else 2**63 - 1,
+                    chunk_size=chunk_size,
+                ),
+            )
+        ]
+        if not movies:
+            return
+        by_id = {movie["id"]: movie for movie in movies}
+        for movie_id, genre in session.execute(
+            text(
+                "SELECT movie_genre.movie_id, genre.name FROM movie_genre"
+                " JOIN genre ON genre.id = movie_genre.genre_id"
+                " WHERE movie_genre.movie_id BETWEEN :first_id AND :last_id"
+                " ORDER BY movie_genre.id"
+            ),
+            dict(first_id=movies[0]["id"], last_id=movies[-1]["id"]),
+        ):
+            if movie_id in by_id:
+                by_id[movie_id]["genres"].append(genre)
+        yield movies
+        last_id = movies[-1]["id"]
+
+
+def encode_ndjson(chunks: t.Iterable[list[dict]]) -> t.Generator[bytes, None, None]:
+    for movies in chunks:
+        yield "".join(json.dumps(movie) + "\n" for movie in movies).encode()
+
+
+def encode_csv(chunks: t.Iterable[list[dict]]) -> t.Generator[bytes, None, None]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for movies in chunks:
+        writer.writerows(
+            dict(movie, genres="|".join(movie["genres"])) for movie in movies
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting bytes until drained, tracking total position"""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def encode_parquet(chunks: t.Iterable[list[dict]]) -> t.Generator[bytes, None, None]:
+    """One parquet row group per chunk"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Exporting parquet requires the `pyarrow` package - pip install pyarrow"
+        ) from e
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("title", pa.string()),
+            ("year", pa.int32()),
+            ("distribution", pa.string()),
+            ("description", pa.string()),
+            ("url", pa.string()),
+            ("cover_photo", pa.string()),
+            ("category", pa.string()),
+            ("genres", pa.list_(pa.string())),
+        ]
+    )
+    sink = _ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema) as writer:
+        for movies in chunks:
+            writer.write_table(pa.Table.from_pylist(movies, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def is_available(format: str) -> bool:
+    """Checks whether dependencies of an export format are installed"""
+    if format == "parquet":
+        return importlib.util.find_spec("pyarrow") is not None
+    return format in formats
+
+
+encoders: dict[str, t.Callable[[t.Iterable[list[dict]]], t.Iterator[bytes]]] = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "parquet": encode_parquet,
+}
+
+
+def gzip_stream(stream: t.Iterable[bytes]) -> t.Generator[bytes, None, None]:
+    """Gzip compress a stream of bytes on the fly"""
+    compressor = zlib.compressobj(wbits=31)
+    for data in stream:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_catalog(
+    format: t.Literal["ndjson", "csv", "parquet"] = "ndjson",
+    gzip: bool = False,
+    after_id: int = 0,
+    until_id: int | None = None,
+) -> t.Generator[bytes, None, None]:
+    """Encoded catalog contents using own db session
+
+    Args:
+        format (t.Literal["ndjson", "csv", "parquet"], optional): Export format. Defaults to "ndjson".
+        gzip (bool, optional): Gzip compress output. Defaults to False.
+        after_id (int, optional): Export movies with ids greater than this. Defaults to 0.
+        until_id (int | None, optional): Export movies with ids up to this. Defaults to None.
+
+    Yields:
+        bytes: Encoded catalog contents.
+    """
+    with ReaderSession() as session:
+        stream = encoders[format](catalog_chunks(session, after_id, until_id))
+        yield from gzip_stream(stream) if gzip else stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the movies catalog")
+    parser.add_argument("--format", choices=list(formats), default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="Gzip compress output")
+    parser.add_argument(
+        "--after-id", type=int, default=0, help="Resume after this movie id"
+    )
+    parser.add_argument("--until-id", type=int, help="Stop at this movie id")
+    parser.add_argument(
+        "-o", "--output", help="Path to save export to. Defaults to stdout"
+    )
+    args = parser.parse_args()
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    progress = dict(movies=0, last_id=args.after_id)
+
+    def track(chunks: t.Iterable[list[dict]]) -> t.Generator[list[dict], None, None]:
+        for movies in chunks:
+            yield movies
+            progress["movies"] += len(movies)
+            progress["last_id"] = movies[-1]["id"]
+
+    try:
+        with ReaderSession() as session:
+            stream = encoders[args.format](
+                track(catalog_chunks(session, args.after_id, args.until_id))
+            )
+            for data in gzip_stream(stream) if args.gzip else stream:
+                output.write(data)
+    except KeyboardInterrupt:
+        print(
+            f"Interrupted. Resume with --after-id {progress['last_id']}",
+            file=sys.stderr,
+        )
+    finally:
+        if args.output:
+            output.close()
+    print(
+        f"Exported {progress['movies']} movies up to id {progress['last_id']}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
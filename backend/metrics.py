@@ -0,0 +1,48 @@
+"""In-process counters and gauges describing how the API performs
+
+Values are local to each worker process.
+"""
+
+import threading
+import typing as t
+
+
+class Metrics:
+    """Thread-safe registry of named numeric values"""
+
+    def __init__(self):
+        self._values: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add value to a counter"""
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def set(self, name: str, value: float) -> None:
+        """Set value of a gauge"""
+        with self._lock:
+            self._values[name] = value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def ratio(self, numerator: str, denominator: str) -> float | None:
+        """Ratio of two counters or None when the denominator is zero"""
+        with self._lock:
+            total = self._values.get(denominator, 0)
+            return self._values.get(numerator, 0) / total if total else None
+
+    def snapshot(self, prefix: str = "") -> dict[str, t.Any]:
+        """Current values, optionally those whose names start with prefix"""
+        with self._lock:
+            return {
+                name: value
+                for name, value in sorted(self._values.items())
+                if name.startswith(prefix)
+            }
+
+
+metrics = Metrics()
+"""Metrics of this worker process"""
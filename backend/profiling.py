@@ -0,0 +1,138 @@
+"""Opt-in profiling of sampled requests
+
+Requests are profiled with `cProfile` when profiling is enabled and either
+the request is sampled, its path starts with one of `profiling_routes`, or it
+carries `X-Profile: 1` along with a valid `X-Admin-Token`. The latter works
+even when profiling is disabled.
+
+Profiles are saved in pstats format, which `python -m pstats`, snakeviz and
+flameprof read, next to a JSON summary of the request. Only the newest
+`profiling_max_files` are kept.
+
+cProfile follows the event loop thread only, so a profile also includes other
+requests interleaved with the profiled one and excludes upstream calls run in
+worker threads. Only one request is profiled at a time.
+"""
+
+import cProfile
+import json
+import random
+import re
+import threading
+import time
+import typing as t
+from pathlib import Path
+from backend.config import config, logger
+from backend.metrics import metrics
+from backend.tracing import current_trace_id
+from backend.utils import admin_token_matches, utcnow
+
+_active = threading.Lock()
+
+
+def profiles_directory() -> Path:
+    return Path(config.profiling_directory)
+
+
+def _slug(value: str) -> str:
+    return re.sub(r"[^\w-]+", "_", value).strip("_")[:60] or "root"
+
+
+def should_profile(path: str, headers: dict[bytes, bytes]) -> bool:
+    """Checks whether a request is to be profiled"""
+    if headers.get(b"x-profile") == b"1" and admin_token_matches(
+        headers.get(b"x-admin-token", b"").decode("latin-1")
+    ):
+        return True
+    if not config.profiling_enabled:
+        return False
+    routes = [route.strip() for route in config.profiling_routes.split(",")]
+    if any(route and path.startswith(route) for route in routes):
+        return True
+    return random.random() < config.profiling_sample_rate
+
+
+def save_profile(profile: cProfile.Profile, summary: dict[str, t.Any]) -> Path:
+    """Save profile and its summary then rotate old profiles"""
+    directory = profiles_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = (
+        f"{time.time_ns()}-{summary['method']}-{_slug(summary['route'])}"
+        f"-{round(summary['duration_ms'])}ms"
+    )
+    profile.dump_stats(directory / f"{name}.prof")
+    (directory / f"{name}.json").write_text(json.dumps(dict(summary, name=name)))
+    for old in sorted(directory.glob("*.prof"))[: -config.profiling_max_files]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".json").unlink(missing_ok=True)
+    return directory / f"{name}.prof"
+
+
+def recent_profiles(limit: int = 20) -> list[dict[str, t.Any]]:
+    """Summaries of the newest profiles, newest first"""
+    directory = profiles_directory()
+    if not directory.exists():
+        return []
+    summaries = []
+    for path in sorted(directory.glob("*.json"), reverse=True)[:limit]:
+        try:
+            summary = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Rotated away or still being written
+            continue
+        prof = path.with_suffix(".prof")
+        summary["size"] = prof.stat().st_size if prof.exists() else 0
+        summaries.append(summary)
+    return summaries
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling selected http requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_profile(
+            scope["path"], dict(scope["headers"])
+        ):
+            return await self.app(scope, receive, send)
+        if not _active.acquire(blocking=False):
+            metrics.increment("profiling.skipped_busy")
+            return await self.app(scope, receive, send)
+
+        status_code = [None]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        profile = cProfile.Profile()
+        started_on = utcnow()
+        start = time.perf_counter()
+        trace_id = current_trace_id()
+        try:
+            profile.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profile.disable()
+        finally:
+            _active.release()
+            duration_ms = (time.perf_counter() - start) * 1000
+            route = scope.get("route")
+            summary = dict(
+                method=scope["method"],
+                path=scope["path"],
+                route=getattr(route, "path", scope["path"]),
+                status_code=status_code[0],
+                duration_ms=round(duration_ms, 3),
+                trace_id=trace_id,
+                created_on=started_on.isoformat(),
+            )
+            try:
+                save_profile(profile, summary)
+                metrics.increment("profiling.saved")
+            except Exception as e:
+                logger.warning(f"Failed to save profile of {scope['path']} - {e}")
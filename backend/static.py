@@ -0,0 +1,230 @@
+"""Serving of the built frontend
+
+Files of the frontend build, `frontend/dist` by default, are precompressed
+once with gzip, and brotli when the `brotli` package is installed, so each
+request is answered with the smallest encoding the client accepts without
+compressing on the fly. Fingerprinted files such as `assets/index-B3xk9a2Q.js`
+never change and are cached by clients for a year, while `index.html` is
+kept in memory and revalidated through its ETag.
+
+Usage:
+    python -m backend.static frontend/dist
+"""
+
+import argparse
+import functools
+import gzip
+import hashlib
+import importlib.util
+import mimetypes
+import os
+import re
+import sys
+import typing as t
+from pathlib import Path
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+from backend.config import config, logger
+from backend.utils import etag_matches
+
+compressible_suffixes = frozenset(
+    (".html", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".txt", ".xml", ".wasm")
+)
+
+min_compressible_bytes = 1024
+"""Files smaller than this gain too little from compression"""
+
+fingerprint_pattern = re.compile(
+    r"assets/(?:[^/]+/)*[^/]+-(?=[\w-]{0,7}[0-9A-Z])[\w-]{8}\.\w+$"
+)
+"""Build paths with a content hash as produced by vite, e.g. assets/index-B3xk9a2Q.js
+
+Hashes hold a digit or an uppercase letter, unlike names such as site-manifest.json
+"""
+
+immutable = "public, max-age=31536000, immutable"
+
+
+@functools.cache
+def encoders() -> dict[str, tuple[str, t.Callable[[bytes], bytes]]]:
+    """Content encodings available with their file suffix and compressor"""
+    available = {"gzip": (".gz", lambda data: gzip.compress(data, 9, mtime=0))}
+    if importlib.util.find_spec("brotli") is not None:
+        import brotli
+
+        available["br"] = (".br", lambda data: brotli.compress(data, quality=11))
+    return available
+
+
+def precompress(directory: Path | str) -> int:
+    """Write compressed variants next to compressible files missing them
+
+    Returns:
+        int: Number of variants written.
+    """
+    written = 0
+    available = encoders()
+    for path in Path(directory).rglob("*"):
+        if (
+            not path.is_file()
+            or path.suffix not in compressible_suffixes
+            or path.stat().st_size < min_compressible_bytes
+        ):
+            continue
+        data = None
+        for suffix, compress in available.values():
+            variant = path.with_name(path.name + suffix)
+            if variant.exists() and variant.stat().st_mtime >= path.stat().st_mtime:
+                continue
+            data = data if data is not None else path.read_bytes()
+            compressed = compress(data)
+            if len(compressed) < len(data) * 0.9:
+                variant.write_bytes(compressed)
+                written += 1
+    return written
+
+
+def accepted_encodings(headers: Headers) -> list[str]:
+    """Encodings accepted by the client, best first
+
+    A quality of zero refuses an encoding, and `*` stands for encodings the
+    client does not list, so `*;q=0` refuses all of those. Entries with a
+    malformed quality are ignored.
+    """
+    qualities: dict[str, float] = {}
+    for value in headers.get("accept-encoding", "").split(","):
+        encoding, *params = value.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    break
+        else:
+            qualities[encoding.strip().lower()] = quality
+    unlisted = qualities.get("*", 0.0)
+    return [
+        encoding for encoding in ("br", "gzip") if qualities.get(encoding, unlisted) > 0
+    ]
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Static files served in their precompressed variant where accepted"""
+
+    def fingerprinted(self, full_path: str | os.PathLike) -> bool:
+        """Whether a file of the build is named after its content hash"""
+        path = Path(full_path)
+        if self.directory is not None:
+            directory = os.path.realpath(self.directory)
+            if path.is_relative_to(directory):
+                path = path.relative_to(directory)
+        return fingerprint_pattern.match(path.as_posix()) is not None
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        response = None
+        available = encoders()
+        for encoding in accepted_encodings(request_headers):
+            if encoding not in available:
+                continue
+            variant = f"{full_path}{available[encoding][0]}"
+            try:
+                variant_stat = os.stat(variant)
+            except FileNotFoundError:
+                continue
+            response = FileResponse(
+                variant,
+                status_code=status_code,
+                stat_result=variant_stat,
+                media_type=mimetypes.guess_type(str(full_path))[0] or "text/plain",
+            )
+            response.headers["content-encoding"] = encoding
+            break
+        if response is None:
+            response = FileResponse(
+                full_path, status_code=status_code, stat_result=stat_result
+            )
+        response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = (
+            immutable if self.fingerprinted(full_path) else "no-cache"
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class IndexPage:
+    """`index.html` of the frontend build served from memory
+
+    The file is read again only when it changes on disk.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._mtime: float | None = None
+        self._variants: dict[str, bytes] = {}
+        self._etag = ""
+
+    def _load(self):
+        mtime = self.path.stat().st_mtime
+        if mtime == self._mtime:
+            return
+        content = self.path.read_bytes()
+        self._variants = {"identity": content}
+        for encoding, (_, compress) in encoders().items():
+            self._variants[encoding] = compress(content)
+        self._etag = '"' + hashlib.blake2b(content, digest_size=12).hexdigest() + '"'
+        self._mtime = mtime
+        logger.info(f"Loaded {self.path} in memory")
+
+    def response(self, headers: Headers) -> Response:
+        self._load()
+        encoding = next(
+            (
+                encoding
+                for encoding in accepted_encodings(headers)
+                if encoding in self._variants
+            ),
+            "identity",
+        )
+        response_headers = {
+            "etag": self._etag,
+            "cache-control": "no-cache",
+            "vary": "Accept-Encoding",
+        }
+        if etag_matches(headers.get("if-none-match"), self._etag):
+            return Response(status_code=304, headers=response_headers)
+        if encoding != "identity":
+            response_headers["content-encoding"] = encoding
+        return Response(
+            self._variants[encoding], media_type="text/html", headers=response_headers
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompress files of the frontend build"
+    )
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        default=config.frontend_build_directory or "frontend/dist",
+        help="Frontend build directory",
+    )
+    args = parser.parse_args()
+    written = precompress(args.directory)
+    print(f"Wrote {written} compressed files in {args.directory}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""Lightweight request tracing
+
+Every request gets a trace id, read from the `traceparent` or `X-Trace-Id`
+request headers when present, which is sent back in the `X-Trace-Id` header.
+Sampled requests record nested timed spans for the route, db statements
+and upstream calls which are exported once the response is sent.
+
+Exporters are selected through `tracing_exporter` config using a url:
+- `jsonl:///assets/traces.jsonl` : Appends one span per line to a local file.
+- `otlp://localhost:4318` : Posts OTLP/JSON to a collector's `/v1/traces`.
+- `none://` : Disables tracing.
+"""
+
+import json
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+import typing as t
+import urllib.request
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from urllib.parse import urlparse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from backend.config import config, logger
+
+TRACEPARENT_PATTERN = re.compile(
+    r"^[\da-f]{2}-(?P<trace_id>[\da-f]{32})-(?P<parent_id>[\da-f]{16})-(?P<flags>[\da-f]{2})$"
+)
+
+
+class Span:
+    """Timed unit of work within a trace"""
+
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "start_time",
+        "end_time",
+        "_start",
+    )
+
+    def __init__(
+        self, trace: "Trace", name: str, parent_id: str | None, attributes: dict
+    ):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time_ns()
+        self.end_time: int | None = None
+        self._start = time.perf_counter_ns()
+
+    def end(self):
+        self.end_time = self.start_time + time.perf_counter_ns() - self._start
+        self.trace.spans.append(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_time or time.time_ns()) - self.start_time) / 1e6
+
+    def model_dump(self) -> dict[str, t.Any]:
+        return dict(
+            trace_id=self.trace.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            name=self.name,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            duration_ms=round(self.duration_ms, 3),
+            attributes=self.attributes,
+        )
+
+
+class Trace:
+    """Spans recorded for a single request"""
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: list[Span] = []
+
+
+class Exporter(ABC):
+    """Ships finished traces somewhere"""
+
+    @abstractmethod
+    def export(self, spans: list[Span]) -> None:
+        """Ship spans of a finished trace"""
+        raise NotImplementedError
+
+
+class JsonlExporter(Exporter):
+    """Appends spans to a local JSON-lines file"""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps(span.model_dump()) + "\n" for span in spans)
+        with self._lock, self.path.open("a") as fh:
+            fh.write(lines)
+
+
+class OtlpExporter(Exporter):
+    """Posts spans as OTLP/JSON to a collector from a background thread"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint.rstrip("/") + "/v1/traces"
+        self._queue: queue.Queue[list[Span]] = queue.Queue(maxsize=1_000)
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def export(self, spans):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logger.warning("Tracing export queue is full, dropping trace")
+
+    @staticmethod
+    def _attributes(attributes: dict) -> list[dict]:
+        return [
+            dict(key=key, value=dict(stringValue=str(value)))
+            for key, value in attributes.items()
+        ]
+
+    def _payload(self, spans: list[Span]) -> dict:
+        return dict(
+            resourceSpans=[
+                dict(
+                    resource=dict(
+                        attributes=self._attributes({"service.name": "fcs-movies"})
+                    ),
+                    scopeSpans=[
+                        dict(
+                            scope=dict(name=__name__),
+                            spans=[
+                                dict(
+                                    traceId=span.trace.trace_id,
+                                    spanId=span.span_id,
+                                    parentSpanId=span.parent_id or "",
+                                    name=span.name,
+                                    kind=2 if span.parent_id is None else 1,
+                                    startTimeUnixNano=str(span.start_time),
+                                    endTimeUnixNano=str(span.end_time),
+                                    attributes=self._attributes(span.attributes),
+                                )
+                                for span in spans
+                            ],
+                        )
+                    ],
+                )
+            ]
+        )
+
+    def _worker(self):
+        while True:
+            spans = self._queue.get()
+            request = urllib.request.Request(
+                self.endpoint,
+                data=json.dumps(self._payload(spans)).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.warning(f"Failed to export trace to {self.endpoint} - {e}")
+
+
+def get_exporter(url: str) -> Exporter | None:
+    """Initialize exporter from url
+
+    Args:
+        url (str): Exporter url e.g `jsonl:///assets/traces.jsonl`
+
+    Returns:
+        Exporter | None: Initialized exporter or None when tracing is disabled.
+    """
+    parsed = urlparse(url)
+    match parsed.scheme:
+        case "jsonl":
+            return JsonlExporter(parsed.path[1:] or "assets/traces.jsonl")
+        case "otlp":
+            return OtlpExporter(f"http://{parsed.netloc}{parsed.path}")
+        case "http" | "https":
+            return OtlpExporter(url)
+        case "none":
+            return None
+    raise ValueError(f"Unsupported tracing exporter - {url}")
+
+
+exporter = get_exporter(config.tracing_exporter)
+"""Initialized traces exporter"""
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+"""Span active in the current context"""
+
+
+@contextmanager
+def span(name: str, **attributes) -> t.Generator[Span | None, None, None]:
+    """Time the enclosed block as a child of the active span.
+
+    Does nothing when the current request is not being traced.
+    """
+    parent = current_span.get()
+    if parent is None or not parent.trace.sampled:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = repr(e)
+        raise
+    finally:
+        current_span.reset(token)
+        child.end()
+
+
+def current_trace_id() -> str | None:
+    """Trace id of the request being handled"""
+    active = current_span.get()
+    return active.trace.trace_id if active else None
+
+
+def _trace_from_headers(headers: dict[bytes, bytes]) -> tuple[Trace, str | None]:
+    traceparent = headers.get(b"traceparent", b"").decode("latin-1").strip()
+    match = TRACEPARENT_PATTERN.match(traceparent)
+    if match:
+        forced = int(match["flags"], 16) & 1
+        sampled = exporter is not None and (
+            bool(forced) or random.random() < config.tracing_sample_rate
+        )
+        return Trace(match["trace_id"], sampled), match["parent_id"]
+    trace_id = headers.get(b"x-trace-id", b"").decode("latin-1").strip()
+    if not re.fullmatch(r"[\da-f]{32}", trace_id):
+        trace_id = secrets.token_hex(16)
+    sampled = exporter is not None and random.random() < config.tracing_sample_rate
+    return Trace(trace_id, sampled), None
+
+
+class TracingMiddleware:
+    """ASGI middleware starting the root span of every http request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace, parent_id = _trace_from_headers(dict(scope["headers"]))
+        root = Span(
+            trace,
+            f"{scope['method']} {scope['path']}",
+            parent_id,
+            {"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        token = current_span.set(root)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-trace-id", trace.trace_id.encode())
+                ]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                finish()
+
+        def finish():
+            if root.end_time is not None:
+                return
+            root.end()
+            if trace.sampled:
+                try:
+                    exporter.export(trace.spans)
+                except Exception as e:
+                    logger.warning(f"Failed to export trace {trace.trace_id} - {e}")
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_span.reset(token)
+            finish()
+
+
+def instrument_engine(engine: Engine) -> Engine:
+    """Record a span for every statement executed by the engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement_span(conn, cursor, statement, parameters, context, executemany):
+        parent = current_span.get()
+        if parent is not None and parent.trace.sampled:
+            context._trace_span = Span(
+                parent.trace,
+                "db.statement",
+                parent.span_id,
+                {"db.statement": statement[:500], "db.url": str(engine.url)},
+            )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_statement_span(conn, cursor, statement, parameters, context, executemany):
+        statement_span = getattr(context, "_trace_span", None)
+        if statement_span is not None:
+            statement_span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def end_failed_statement_span(exception_context):
+        # Statements that raise never reach after_cursor_execute
+        context = exception_context.execution_context
+        statement_span = getattr(context, "_trace_span", None)
+        if statement_span is not None:
+            statement_span.attributes["error"] = repr(
+                exception_context.original_exception
+            )
+            statement_span.end()
+            context._trace_span = None
+
+    return engine
@@ -0,0 +1,66 @@
+"""Redirection of upstream requests to another server
+
+`fzmovies_api` fetches pages through `requests`. When `upstream_base_url` is
+set, every request sent by any `requests` session, including those created
+before this is applied, goes to that server instead. The original scheme and
+host travel in the `X-Upstream-Scheme` and `X-Upstream-Host` headers. This
+lets the app run against the fake upstream of `benchmarks.fake_upstream`.
+
+Cookies and redirects are still handled against the original urls, so
+sessions behave as they would with the real site.
+"""
+
+import typing as t
+from urllib.parse import urlsplit, urlunsplit
+from backend.config import logger
+
+_original_send: t.Callable | None = None
+
+
+def rewrite(url: str, base_url: str) -> tuple[str, dict[str, str]]:
+    """Url on the base server with headers naming the original host"""
+    original = urlsplit(url)
+    base = urlsplit(base_url)
+    rewritten = urlunsplit(
+        (
+            base.scheme,
+            base.netloc,
+            base.path.rstrip("/") + original.path,
+            original.query,
+            "",
+        )
+    )
+    return rewritten, {
+        "X-Upstream-Scheme": original.scheme,
+        "X-Upstream-Host": original.netloc,
+    }
+
+
+def redirect_upstream(base_url: str) -> None:
+    """Send requests of every `requests` session to `base_url`"""
+    global _original_send
+    from requests.adapters import HTTPAdapter
+
+    restore_upstream()
+    _original_send = original_send = HTTPAdapter.send
+
+    def send(self, request, *args, **kwargs):
+        redirected = request.copy()
+        redirected.url, headers = rewrite(request.url, base_url)
+        redirected.headers.update(headers)
+        response = original_send(self, redirected, *args, **kwargs)
+        response.request, response.url = request, request.url
+        return response
+
+    HTTPAdapter.send = send
+    logger.warning(f"Upstream requests are redirected to {base_url}")
+
+
+def restore_upstream() -> None:
+    """Send requests to their original hosts again"""
+    global _original_send
+    if _original_send is not None:
+        from requests.adapters import HTTPAdapter
+
+        HTTPAdapter.send = _original_send
+        _original_send = None
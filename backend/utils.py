@@ -1,13 +1,17 @@
 """Contains frequently required functions and variables
 """
 
+import hmac
 from functools import wraps
-from fastapi import status
+from fastapi import status, Header
 from fastapi.exceptions import HTTPException
 from fzmovies_api.errors import SessionExpired
 import typing as t
 from datetime import datetime, UTC
-from backend.config import logger
+from backend.cache import cache
+from backend.config import config, logger
+from backend.metrics import metrics
+from backend.deadlines import DeadlineExceeded, ClientDisconnected
 
 
 def router_exception_handler(func: t.Callable):
@@ -22,6 +26,8 @@ def router_exception_handler(func: t.Callable):
         try:
             resp = await func(*args, **kwargs)
             return resp
+        except HTTPException:
+            raise
         except AssertionError as e:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
         except SessionExpired as e:
@@ -32,6 +38,14 @@ def router_exception_handler(func: t.Callable):
                     "or from this server.!"
                 ),
             )
+        except DeadlineExceeded as e:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Upstream server took too long to respond. Try again later.",
+            )
+        except ClientDisconnected as e:
+            # Nobody is left to read this response
+            raise HTTPException(status_code=499, detail="Client closed request")
         except Exception as e:
             logger.exception(e)
             raise HTTPException(
@@ -45,6 +59,63 @@ def router_exception_handler(func: t.Callable):
     return decorator
 
 
+def admin_token_matches(token: t.Optional[str]) -> bool:
+    """Checks a token against the admin token in constant time"""
+    return bool(config.admin_token) and hmac.compare_digest(
+        (token or "").encode(), config.admin_token.encode()
+    )
+
+
+def verify_admin_token(x_admin_token: t.Annotated[t.Optional[str], Header()] = None):
+    """Dependency restricting routes to holders of the admin token"""
+    if not config.admin_token:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin endpoints are disabled. Set admin_token to enable them.",
+        )
+    if not admin_token_matches(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or missing X-Admin-Token header!",
+        )
+
+
+def raise_cached_failure(cache_key: str) -> None:
+    """Raise the deterministic upstream failure remembered under a cache key"""
+    failure = cache.get(cache_key)
+    if failure is not None:
+        metrics.increment("cache.negative_hits")
+        raise HTTPException(**failure)
+
+
+def cache_failure(cache_key: str, status_code: int, detail: str) -> HTTPException:
+    """Remember a deterministic upstream failure for a short while
+
+    Args:
+        cache_key (str): Key of the failed request.
+        status_code (int): Status code to respond with.
+        detail (str): Failure description.
+
+    Returns:
+        HTTPException: Failure to be raised.
+    """
+    cache.set(
+        cache_key,
+        dict(status_code=status_code, detail=detail),
+        config.cache_negative_ttl_in_seconds,
+    )
+    metrics.increment("cache.negative_stored")
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Checks whether an If-None-Match header matches an ETag"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
 def utcnow() -> datetime:
     """UTC time now"""
     return datetime.now(UTC)
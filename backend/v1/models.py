@@ -8,6 +8,9 @@ from fzmovies_api.models import MovieFiles as FzMovieFiles
 from fzmovies_api.models import SearchResults as FzSearchResults
 from fzmovies_api.models import MovieInSearch as FzMovieInSearch
 
+fan_out_categories = ("Bollywood", "Hollywood", "DHollywood")
+"""Categories searched concurrently when fanning out"""
+
 
 class Search(BaseModel):
     """Search movies by Name|Director|Startcast
@@ -16,6 +19,7 @@ class Search(BaseModel):
     - `category` : Search category
     - `limit` : Search results limit. Multiple of 20.
     - `offset` : Value to truncate search results from.
+    - `fan_out` : Search each category concurrently instead of `All`.
     """
 
     q: str
@@ -25,6 +29,7 @@ class Search(BaseModel):
     )
     limit: t.Optional[PositiveInt] = 20
     offset: t.Optional[int] = 0
+    fan_out: t.Optional[bool] = False
 
     model_config = {
         "json_schema_extra": {
@@ -54,6 +59,11 @@ class Search(BaseModel):
         }
     }
 
+    @property
+    def fans_out(self) -> bool:
+        """Whether categories are searched concurrently"""
+        return bool(self.fan_out) and self.category == "All"
+
     @field_validator("limit")
     def validate_limit(value):
         if value > config.search_limit_per_query:
@@ -77,6 +87,7 @@ class SearchStream(BaseModel):
     - `category` : Search category
     - `limit` : Search results limit. Multiple of 20.
     - `offset` : Value to truncate search results from.
+    - `fan_out` : Search each category concurrently instead of `All`.
     """
 
     q: str
@@ -85,6 +96,7 @@ class SearchStream(BaseModel):
         "All"
     )
     limit: t.Optional[PositiveInt] = 20
+    fan_out: t.Optional[bool] = False
 
     model_config = {
         "json_schema_extra": {
@@ -114,6 +126,11 @@ class SearchStream(BaseModel):
         }
     }
 
+    @property
+    def fans_out(self) -> bool:
+        """Whether categories are searched concurrently"""
+        return bool(self.fan_out) and self.category == "All"
+
     @field_validator("limit")
     def validate_limit(value):
         if value > config.search_stream_limit_per_query:
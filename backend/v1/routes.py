@@ -1,42 +1,292 @@
 """v1 Routes
 """
 
+import asyncio
+import math
+import re
 import typing as t
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request, status
 from fastapi.responses import StreamingResponse
 from fastapi.encoders import jsonable_encoder
 import backend.v1.models as models
 import backend.utils as utils
-from fzmovies_api import Search, Navigate, DownloadLinks, Download
-import fzmovies_api.models as fz_models
+from backend.cache import cache, make_key
+from backend.config import config, logger
+from backend.metrics import metrics
+from backend.deadlines import UpstreamBudget, DeadlineExceeded, ClientDisconnected
+from backend.tracing import span
+from backend.downloads import (
+    navigate,
+    download_links,
+    final_url,
+    MissingDownloadLink,
+)
+from fzmovies_api import Search
+from fzmovies_api.models import SearchResults as FzSearchResults
+from fzmovies_api.models import MovieInSearch as FzMovieInSearch
 from json import dumps
 
 router = APIRouter()
 
+movies_per_page = 20
+"""Movies listed in a single upstream search results page"""
+
+
+page_parameter = re.compile(r"([?&]pg=)(\d+)")
+"""Results page number carried by search results page links"""
+
+
+def pending_pages(movies: int) -> int:
+    """Search results pages needed for the given number of movies"""
+    return max(math.ceil(movies / movies_per_page), 1)
+
+
+def covering_pages(offset: int, limit: int) -> tuple[int, int]:
+    """First and last search results pages covering `[offset, offset+limit)`"""
+    return offset // movies_per_page + 1, (offset + limit - 1) // movies_per_page + 1
+
+
+def link_page(link: t.Any) -> int | None:
+    """Number of the results page a search results page link points at"""
+    match = page_parameter.search(str(link)) if link else None
+    return int(match.group(2)) if match else None
+
+
+def open_page(
+    search: models.Search, category: str, page: int
+) -> tuple[Search, FzSearchResults] | None:
+    """Search at the given results page along with the page's results
+
+    The first page is fetched for its `next_page` link, which is pointed at
+    the wanted page through its `pg` parameter and followed, so pages in
+    between are never fetched.
+
+    Returns:
+        tuple[Search, FzSearchResults] | None: None when results end before the page.
+    """
+    searchq = Search(query=search.q, searchby=search.searchby, category=category)
+    results = searchq.results
+    if page == 1:
+        return searchq, results
+    last = link_page(results.last_page)
+    if not results.next_page or (last is not None and page > last):
+        return None
+    results.next_page = page_parameter.sub(
+        lambda match: f"{match.group(1)}{page}", str(results.next_page), count=1
+    )
+    jumped = searchq.next()
+    landed = jumped.results
+    if link_page(landed.next_page) == page + 1 or (
+        not landed.next_page and link_page(landed.previous_page) == page - 1
+    ):
+        return jumped, landed
+    raise HTTPException(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        detail=f"Results page {page} could not be reached upstream.",
+    )
+
+
+def page_results(searchq: Search) -> FzSearchResults:
+    return searchq.results
+
+
+async def window_pages(
+    search: models.Search, category: str, budget: UpstreamBudget
+) -> t.AsyncGenerator[FzSearchResults, None]:
+    """Results pages covering the search window of a category
+
+    Movies before `offset` are left out of the first page. Whole pages are
+    yielded otherwise so that `next_page` follows the last movie.
+    """
+    first_page, last_page = covering_pages(search.offset, search.limit)
+    opened = await budget.run(
+        open_page, search, category, first_page, pending=last_page - first_page + 1
+    )
+    if opened is None:
+        return
+    searchq, results = opened
+    skip = search.offset - (first_page - 1) * movies_per_page
+    for page in range(first_page, last_page + 1):
+        if page > first_page:
+            results = await budget.run(
+                page_results, searchq, pending=last_page - page + 1
+            )
+        results.movies = results.movies[skip:]
+        skip = 0
+        yield results
+        if page == last_page or not results.next_page:
+            return
+        searchq = await budget.run(searchq.next, pending=last_page - page)
+
+
+async def stream_pages(
+    search: models.SearchStream, category: str, budget: UpstreamBudget
+) -> t.AsyncGenerator[FzSearchResults, None]:
+    """Results pages of a category up to `limit` movies"""
+    pages = Search(
+        query=search.q, searchby=search.searchby, category=category
+    ).get_all_results(stream=True, limit=search.limit)
+    movies = 0
+    while True:
+        results = await budget.run(
+            next, pages, None, pending=pending_pages(search.limit - movies)
+        )
+        if results is None:
+            return
+        movies += len(results.movies)
+        yield results
+
+
+async def merge_pages(
+    streams: list[t.AsyncIterator[FzSearchResults]],
+) -> t.AsyncGenerator[tuple[int, FzSearchResults], None]:
+    """Results pages of concurrent streams as they arrive
+
+    A stream exceeding the deadline just ends, keeping the pages it already
+    yielded. One failing otherwise ends just that stream unless every stream
+    fails. The deadline is raised only when no stream yielded anything.
+    Client disconnection ends them all.
+
+    Yields:
+        tuple[int, FzSearchResults]: Index of the stream and its results page.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def drain(index: int, stream: t.AsyncIterator[FzSearchResults]):
+        try:
+            async for results in stream:
+                await queue.put((index, results))
+        except Exception as e:
+            await queue.put((index, e))
+        finally:
+            await queue.put((index, None))
+
+    tasks = [
+        asyncio.create_task(drain(index, stream))
+        for index, stream in enumerate(streams)
+    ]
+    errors = []
+    deadline = None
+    yielded = False
+    try:
+        running = len(tasks)
+        while running:
+            index, item = await queue.get()
+            if item is None:
+                running -= 1
+            elif isinstance(item, ClientDisconnected):
+                raise item
+            elif isinstance(item, DeadlineExceeded):
+                logger.info(f"Search of stream {index} ran out of time - {item}")
+                deadline = item
+            elif isinstance(item, Exception):
+                logger.warning(f"Search of stream {index} stopped - {item}")
+                errors.append(item)
+            else:
+                yielded = True
+                yield index, item
+        if errors and len(errors) == len(tasks):
+            raise errors[0]
+        if deadline is not None and not yielded:
+            raise deadline
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def unique_movies(
+    movies: list[FzMovieInSearch], seen: set[str]
+) -> list[FzMovieInSearch]:
+    """Movies whose urls are not in `seen`, adding them to it"""
+    unique = []
+    for movie in movies:
+        if str(movie.url) not in seen:
+            seen.add(str(movie.url))
+            unique.append(movie)
+    return unique
+
 
 @router.post("/search", name="Search")
 @utils.router_exception_handler
-async def search(search: models.Search) -> models.SearchResults:
+async def search(search: models.Search, request: Request) -> models.SearchResults:
     """Search movies using filters"""
-    searchq = Search(query=search.q, searchby=search.searchby, category=search.category)
-    resp = searchq.get_all_results(limit=search.limit)
-    if resp.movies and len(resp.movies) > search.offset:
-        current_movies = resp.movies
-        resp.movies = current_movies[search.offset :]
+    cache_key = make_key("v1:search", search.model_dump())
+    cached_resp = cache.get(cache_key)
+    if cached_resp is not None:
+        if not cached_resp.get("movies"):
+            metrics.increment("cache.negative_hits")
+        return models.SearchResults(**cached_resp)
+
+    budget = UpstreamBudget("search", config.search_deadline_in_seconds, request)
+    with span(
+        "fzmovies.Search",
+        query=search.q,
+        limit=search.limit,
+        offset=search.offset,
+        fan_out=search.fan_out,
+    ):
+        if search.fans_out:
+            categories = models.fan_out_categories
+            pages: list[list[FzMovieInSearch]] = [[] for _ in categories]
+            async for index, results in merge_pages(
+                [window_pages(search, category, budget) for category in categories]
+            ):
+                pages[index].extend(results.movies)
+            seen = set()
+            # Page hints differ per category so none are given
+            resp = models.SearchResults(
+                movies=[
+                    movie for movies in pages for movie in unique_movies(movies, seen)
+                ][: search.limit]
+            )
+        else:
+            resp = None
+            movies = []
+            async for resp in window_pages(search, search.category, budget):
+                movies.extend(resp.movies)
+            if resp is None:
+                resp = models.SearchResults(movies=[])
+            resp.movies = movies
+    if search.fans_out and budget.remaining <= 0:
+        # Some categories ran out of time so results are left out of cache
+        metrics.increment("search.fan_out.partial")
+        return resp
+    # Empty results are kept briefly so that repeated bad queries stay cheap
+    # while newly added movies still show up soon
+    ttl = (
+        config.cache_search_ttl_in_seconds
+        if resp.movies
+        else config.cache_negative_ttl_in_seconds
+    )
+    cache.set(cache_key, jsonable_encoder(resp), ttl)
     return resp
 
 
 @router.post("/search/stream", name="Search stream")
 @utils.router_exception_handler
 async def search_stream(
-    search: models.SearchStream,
+    search: models.SearchStream, request: Request
 ) -> t.Annotated[t.Generator[models.SearchResults, None, None], StreamingResponse]:
     """Search movies using filters and stream results"""
-    searchq = Search(query=search.q, searchby=search.searchby, category=search.category)
+    budget = UpstreamBudget(
+        "search_stream", config.search_stream_deadline_in_seconds, request
+    )
 
-    def generate_streaming_response():
-        for results in searchq.get_all_results(stream=True, limit=search.limit):
-            yield dumps(jsonable_encoder(results)) + "\n"
+    async def generate_streaming_response():
+        categories = (
+            models.fan_out_categories if search.fans_out else (search.category,)
+        )
+        seen = set()
+        try:
+            async for _, results in merge_pages(
+                [stream_pages(search, category, budget) for category in categories]
+            ):
+                results.movies = unique_movies(results.movies, seen)
+                if results.movies or not search.fans_out:
+                    yield dumps(jsonable_encoder(results)) + "\n"
+        except (DeadlineExceeded, ClientDisconnected) as e:
+            # Headers are already sent so the stream just ends early
+            logger.info(f"Stopped streaming search results - {e}")
 
     return StreamingResponse(
         generate_streaming_response(), media_type="application/json"
@@ -45,35 +295,48 @@ async def search_stream(
 
 @router.post("/metadata", name="Movie metadata")
 @utils.router_exception_handler
-async def movie_metadata(target: models.TargetMovie) -> models.MovieFiles:
+async def movie_metadata(
+    target: models.TargetMovie, request: Request
+) -> models.MovieFiles:
     """Get metadata for a particular movie"""
-    nav = Navigate(
-        fz_models.MovieInSearch(
-            url=target.movie_page_url,
-            title="",
-            year=1,
-            distribution="",
-            about="",
-            cover_photo="https://somelink-here",
-        )
-    )
-    return nav.results
+    cache_key = make_key("v1:metadata", str(target.movie_page_url))
+    cached_resp = cache.get(cache_key)
+    if cached_resp is not None:
+        return models.MovieFiles(**cached_resp)
+
+    budget = UpstreamBudget("metadata", config.metadata_deadline_in_seconds, request)
+    resp = await budget.run(navigate, target.movie_page_url)
+    cache.set(cache_key, jsonable_encoder(resp), config.cache_metadata_ttl_in_seconds)
+    return resp
 
 
 @router.post("/download-link", name="Download link metadata")
 @utils.router_exception_handler
-async def download_link(target: models.TargetFilename) -> models.DownloadLink:
+async def download_link(
+    target: models.TargetFilename, request: Request
+) -> models.DownloadLink:
     """Get link to the desired movie-file"""
-    download_movie = DownloadLinks(
-        fz_models.FileMetadata(
-            title="some-movie-title",
-            url=target.filename_url,
-            size="",
-            hits=0,
-            mediainfo="https://yet-another-link",
+    cache_key = make_key("v1:download-link", str(target.filename_url))
+    cached_resp = cache.get(cache_key)
+    if cached_resp is not None:
+        return models.DownloadLink(**cached_resp)
+
+    failure_key = make_key("v1:download-link:failure", str(target.filename_url))
+    utils.raise_cached_failure(failure_key)
+    budget = UpstreamBudget(
+        "download_link", config.download_link_deadline_in_seconds, request
+    )
+    try:
+        filename, target_link = await budget.run(
+            download_links, target.filename_url, pending=2
         )
-    ).results
-    filename = download_movie.filename
-    target_link = download_movie.links[0]
-    movie_file = Download(target_link).last_url
-    return models.DownloadLink(filename=filename, url=movie_file)
+    except MissingDownloadLink as e:
+        raise utils.cache_failure(failure_key, status.HTTP_502_BAD_GATEWAY, str(e))
+    movie_file = await budget.run(final_url, target_link)
+    resp = models.DownloadLink(filename=filename, url=movie_file)
+    cache.set(
+        cache_key,
+        jsonable_encoder(resp),
+        config.download_link_cache_duration_in_hours * 3600,
+    )
+    return resp
@@ -0,0 +1,233 @@
+"""Caching proxy of movie cover photos
+
+Cover photos are fetched from the upstream host once and kept on disk under
+`cover_cache_directory`, along with resized variants generated on first
+request. Least recently served files are evicted once the directory exceeds
+`cover_cache_max_bytes`. Clients get ETags and long-lived caching headers.
+
+Covers are only fetched from `cover_allowed_hosts`, redirects included,
+since cover urls are scraped from upstream pages.
+
+Resizing requires the `Pillow` package. Originals are proxied without it.
+"""
+
+import asyncio
+import functools
+import hashlib
+import importlib.util
+import io
+import os
+import threading
+import typing as t
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlsplit
+from backend.config import config
+from backend.metrics import metrics
+
+sizes: dict[str, int | None] = {"small": 160, "medium": 320, "original": None}
+"""Widths of cover variants in pixels"""
+
+max_cover_bytes = 5 * 1024 * 1024
+"""Largest upstream cover accepted"""
+
+
+class InvalidCover(ValueError):
+    """Upstream did not return a usable image"""
+
+
+@functools.cache
+def resizing_available() -> bool:
+    """Checks whether thumbnails can be generated"""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def etag(content: bytes) -> str:
+    return '"' + hashlib.blake2b(content, digest_size=12).hexdigest() + '"'
+
+
+def media_type(content: bytes) -> str:
+    """Image type of a cover from its leading bytes"""
+    if content.startswith(b"\x89PNG"):
+        return "image/png"
+    if content.startswith(b"GIF8"):
+        return "image/gif"
+    if content.startswith(b"RIFF") and content[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+class CoverStore:
+    """Bounded directory of cover files evicted least recently served first"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._size: int | None = None
+
+    @property
+    def directory(self) -> Path:
+        return Path(config.cover_cache_directory)
+
+    def path(self, id: int, url: str, size: str) -> Path:
+        # Url is part of the name as ids may be reused by a reloaded dataset
+        digest = hashlib.blake2b(url.encode(), digest_size=6).hexdigest()
+        return self.directory / f"{id}-{digest}-{size}.cover"
+
+    def get(self, id: int, url: str, size: str) -> bytes | None:
+        """Content of a cached cover, marking it as recently served"""
+        path = self.path(id, url, size)
+        try:
+            content = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return content
+
+    def _total_size(self) -> int:
+        if self._size is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._size = sum(path.stat().st_size for path in self._files())
+        return self._size
+
+    def _files(self) -> list[Path]:
+        return [path for path in self.directory.glob("*.cover") if path.is_file()]
+
+    def put(self, id: int, url: str, size: str, content: bytes):
+        """Save a cover then evict covers served least recently if over bound"""
+        with self._lock:
+            total = self._total_size()
+            path = self.path(id, url, size)
+            previous = path.stat().st_size if path.exists() else 0
+            temporary = path.with_suffix(f".{threading.get_ident()}.part")
+            temporary.write_bytes(content)
+            temporary.replace(path)
+            self._size = total - previous + len(content)
+            if self._size > config.cover_cache_max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Down to 90% so that eviction does not run on every write
+        target = config.cover_cache_max_bytes * 0.9
+        files = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        self._size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if self._size <= target:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
+            metrics.increment("covers.evicted")
+
+
+store = CoverStore()
+"""On-disk covers of this host"""
+
+
+def allowed(url: str) -> bool:
+    """Checks whether a cover may be fetched from the host of `url`"""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    hosts = [
+        allowed.strip().lower()
+        for allowed in (config.cover_allowed_hosts or "").split(",")
+        if allowed.strip()
+    ]
+    return parts.scheme in ("http", "https") and any(
+        host == allowed or host.endswith("." + allowed) for allowed in hosts
+    )
+
+
+class AllowedRedirects(urllib.request.HTTPRedirectHandler):
+    """Follows redirects to allowed cover hosts only"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not allowed(newurl):
+            raise InvalidCover(f"Cover redirected to disallowed url '{newurl}'")
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+opener = urllib.request.build_opener(AllowedRedirects)
+
+
+def download(url: str) -> bytes:
+    """Fetch an upstream cover"""
+    if not allowed(url):
+        raise InvalidCover(f"Cover url '{url}' is not on an allowed host")
+    request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+    with opener.open(request, timeout=config.cover_deadline_in_seconds) as response:
+        content_type = response.headers.get("Content-Type", "")
+        if not content_type.startswith("image/"):
+            raise InvalidCover(f"Cover is of type '{content_type}'")
+        content = response.read(max_cover_bytes + 1)
+    if len(content) > max_cover_bytes:
+        raise InvalidCover("Cover exceeds size limit")
+    return content
+
+
+def resize(content: bytes, width: int) -> bytes:
+    """JPEG thumbnail of a cover no wider than `width`"""
+    from PIL import Image
+
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.load()
+    except Exception as e:
+        raise InvalidCover(f"Cover could not be decoded - {e}") from e
+    image = image.convert("RGB")
+    image.thumbnail((width, width * 2))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=80, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def load(id: int, url: str, size: str) -> bytes:
+    """Cover of the given size from disk, fetched and resized when missing"""
+    content = store.get(id, url, size)
+    if content is not None:
+        metrics.increment("covers.hits")
+        return content
+    metrics.increment("covers.misses")
+    original = store.get(id, url, "original")
+    if original is None:
+        original = download(url)
+        metrics.increment("covers.downloaded")
+        store.put(id, url, "original", original)
+    if sizes[size] is None:
+        return original
+    content = resize(original, sizes[size])
+    store.put(id, url, size, content)
+    return content
+
+
+_loading: dict[tuple[int, str], asyncio.Task] = {}
+
+
+async def cover(id: int, url: str, size: str) -> bytes:
+    """Cover of the given size, loading it once for concurrent requests"""
+    key = (id, size)
+    task = _loading.get(key)
+    if task is None:
+        task = asyncio.create_task(asyncio.to_thread(load, id, url, size))
+        _loading[key] = task
+        task.add_done_callback(lambda _: _loading.pop(key, None))
+    return await asyncio.shield(task)
+
+
+def proxied(movies: t.Iterable[dict[str, t.Any]]) -> t.Iterable[dict[str, t.Any]]:
+    """Point `cover_photo` of movie rows to this proxy when `cover_proxy_url` is set"""
+    if config.cover_proxy_url:
+        size = config.cover_proxy_size
+        if sizes[size] is not None and not resizing_available():
+            size = "original"
+        base = config.cover_proxy_url.rstrip("/")
+        for movie in movies:
+            if "cover_photo" not in movie:
+                # Left out of projected movies
+                continue
+            movie["cover_photo"] = f"{base}/api/v2/cover/{movie['id']}?size={size}"
+    return movies
@@ -0,0 +1,165 @@
+"""Hybrid search of the local catalog with an upstream fallback
+
+Searches are answered from the `movie` table and only go upstream for the
+shortfall when local matches fall below the limit. Movies discovered upstream
+are written to the catalog so that later searches for them stay local.
+
+Upstream search results carry no genres, so discovered movies are saved
+without `movie_genre` rows until the dataset is rebuilt. Catalog indexes
+leave them out until then (see `dataset_fingerprint`).
+
+Queries for which upstream has nothing beyond what was saved are remembered
+as exhausted for a while so that they stay local.
+"""
+
+import asyncio
+import math
+import typing as t
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, Session as DBSession
+from fzmovies_api import Search
+from fzmovies_api.models import MovieInSearch
+import backend.database as database
+from backend.database import Movie, Category
+from backend.config import config, logger
+from backend.deadlines import UpstreamBudget
+from backend.metrics import metrics
+from backend.v2.models import V2SearchResultsItem
+
+movies_per_page = 20
+"""Movies listed in a single upstream search results page"""
+
+distributions = frozenset(
+    t.get_args(V2SearchResultsItem.model_fields["distribution"].annotation)
+)
+"""Distribution formats known to the catalog"""
+
+
+def local_movies(
+    session: DBSession, query: str, category: str, limit: int
+) -> list[dict[str, t.Any]]:
+    """Catalog movies whose titles contain the query"""
+    statement = (
+        select(Movie)
+        .options(selectinload(Movie.category), selectinload(Movie.genres))
+        .join(Category, Category.id == Movie.category_id)
+        .where(Movie.title.like(f"%{query}%"), Category.name == category)
+        .order_by(Movie.year.desc(), Movie.id)
+        .limit(limit)
+    )
+    return [movie.model_dump() for movie in session.scalars(statement)]
+
+
+def save_movies(
+    db_session: DBSession, movies: list[MovieInSearch], category: str
+) -> list[dict[str, t.Any]]:
+    """Add movies missing from the catalog in a single transaction
+
+    Movies whose url or title is already in the catalog are left as they are.
+
+    Returns:
+        list[dict[str, t.Any]]: Catalog rows of all the movies given.
+    """
+    urls = list(dict.fromkeys(str(movie.url) for movie in movies))
+    known = db_session.execute(
+        select(Movie.url, Movie.title).where(
+            Movie.url.in_(urls) | Movie.title.in_([movie.title for movie in movies])
+        )
+    ).all()
+    known_urls = {url for url, _ in known}
+    known_titles = {title for _, title in known}
+    category_id = db_session.scalar(
+        select(Category.id).where(Category.name == category)
+    )
+    added = []
+    for movie in movies:
+        if str(movie.url) in known_urls or movie.title in known_titles:
+            continue
+        known_urls.add(str(movie.url))
+        known_titles.add(movie.title)
+        added.append(
+            Movie(
+                title=movie.title,
+                year=movie.year,
+                distribution=(
+                    movie.distribution
+                    if movie.distribution in distributions
+                    else "Unknown"
+                ),
+                description=movie.about,
+                url=str(movie.url),
+                cover_photo=str(movie.cover_photo),
+                category_id=category_id,
+            )
+        )
+    if added:
+        db_session.add_all(added)
+        try:
+            db_session.commit()
+        except IntegrityError as e:
+            # Another worker saved some of them first
+            db_session.rollback()
+            logger.warning(f"Failed to add {len(added)} movies to catalog - {e}")
+        else:
+            metrics.increment("hybrid.movies_added", len(added))
+    rows = db_session.scalars(
+        select(Movie)
+        .options(selectinload(Movie.category), selectinload(Movie.genres))
+        .where(Movie.url.in_(urls))
+    )
+    by_url = {row.url: row.model_dump() for row in rows}
+    return [by_url[url] for url in urls if url in by_url]
+
+
+def add_to_catalog(
+    movies: list[MovieInSearch], category: str
+) -> list[dict[str, t.Any]]:
+    with database.Session() as db_session:
+        return save_movies(db_session, movies, category)
+
+
+def next_page(pages: t.Iterator) -> t.Any:
+    return next(pages, None)
+
+
+async def upstream_movies(
+    query: str,
+    category: str,
+    shortfall: int,
+    exclude: set[int],
+    budget: UpstreamBudget,
+) -> tuple[list[dict[str, t.Any]], bool]:
+    """Movies found upstream and saved to the catalog, up to `shortfall`
+
+    Args:
+        query (str): Movie title.
+        category (str): Movie category.
+        shortfall (int): Movies wanted besides the local ones.
+        exclude (set[int]): Ids of local movies already found.
+        budget (UpstreamBudget): Time budget of the request.
+
+    Returns:
+        tuple[list[dict[str, t.Any]], bool]: Movies found and whether every
+            page searched upstream is now in the catalog.
+    """
+    pages = Search(query=query, category=category).get_all_results(
+        stream=True,
+        limit=config.hybrid_upstream_max_pages * movies_per_page,
+    )
+    found: list[dict[str, t.Any]] = []
+    for _ in range(config.hybrid_upstream_max_pages):
+        results = await budget.run(
+            next_page,
+            pages,
+            pending=max(math.ceil((shortfall - len(found)) / movies_per_page), 1),
+        )
+        if results is None or not results.movies:
+            break
+        saved = await asyncio.to_thread(add_to_catalog, results.movies, category)
+        found.extend(movie for movie in saved if movie["id"] not in exclude)
+        exclude.update(movie["id"] for movie in saved)
+        if len(found) >= shortfall and results.next_page:
+            # Later pages may still hold movies
+            return found[:shortfall], False
+    return found[:shortfall], True
@@ -0,0 +1,737 @@
+"""In-memory indexes over the movies catalog
+
+They are built from the database at startup and rebuilt in the background
+whenever the dataset changes, so serving them never touches the database.
+"""
+
+import asyncio
+import bisect
+import copy
+import functools
+import hashlib
+import heapq
+import itertools
+import math
+import re
+import threading
+import unicodedata
+import typing as t
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, defaultdict
+from operator import itemgetter
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.orm import Session as DBSession
+from backend.config import config, logger
+from backend.database import ReaderSession
+from backend.export import catalog_chunks
+from backend.v2.models import V2SearchResultsItem
+from backend.v2.popularity import popularity_scores, stats_fingerprint
+
+
+def normalize(value: str) -> str:
+    """Lowercase ascii words separated by single spaces"""
+    value = unicodedata.normalize("NFKD", value)
+    value = value.encode("ascii", "ignore").decode().lower()
+    return " ".join(re.findall(r"[a-z0-9]+", value))
+
+
+class CatalogIndex(ABC):
+    """Index whose contents are derived from the movies catalog"""
+
+    name: str = "index"
+
+    def __init__(self):
+        self.fingerprint: tuple | None = None
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+
+    @abstractmethod
+    def build(self, session: DBSession) -> None:
+        """Rebuild index contents and swap them in"""
+        raise NotImplementedError
+
+    def fingerprint_of(self, session: DBSession, dataset: tuple) -> tuple:
+        """Summary of everything the index is built from"""
+        return dataset
+
+    def update(self, session: DBSession, fingerprint: tuple) -> None:
+        """Bring contents in line with a fingerprint differing from the current"""
+        self.build(session)
+
+    async def ensure_built(self):
+        """Build the index in a thread if it has never been built"""
+        if self.fingerprint is None:
+            await asyncio.to_thread(refresh, self)
+
+    def take_over(self, staged: "CatalogIndex", generation: int | None = None) -> bool:
+        """Swap in contents of an index built aside
+
+        The build lock is not taken, so contents are swapped in even while a
+        build is under way. That build then finds `generation` outdated and
+        its contents are discarded.
+
+        Args:
+            staged (CatalogIndex): Index built aside.
+            generation (int | None, optional): Swap only if no other contents were swapped in since this generation. Defaults to None.
+
+        Returns:
+            bool: Whether the contents were swapped in.
+        """
+        state = {
+            name: value
+            for name, value in vars(staged).items()
+            if name not in ("generation", "_lock", "_swap_lock")
+        }
+        with self._swap_lock:
+            if generation is not None and generation != self.generation:
+                return False
+            vars(self).update(state)
+            self.generation += 1
+        return True
+
+
+class TitleIndex(CatalogIndex):
+    """Prefix index of movie titles for autocompletion.
+
+    Keys are the normalized title and every suffix of it starting at a word,
+    kept in a sorted array so that completions of a prefix are a contiguous
+    range found through binary search. Top completions of prefixes whose
+    ranges are too wide to rank per request are precomputed, so no request
+    ranks more than `max_ranked_range` keys.
+    """
+
+    name = "titles"
+    max_ranked_range = 256
+
+    def __init__(self):
+        super().__init__()
+        self._data: tuple = ([], [], [], [], {}, [], [], [])
+
+    @staticmethod
+    def weigh(year: int, popularity: float) -> float:
+        """Ranking weight of a movie. Popularity dominates recency"""
+        return popularity + min(max(year, 1900), 2100) / 10_000
+
+    def fingerprint_of(self, session, dataset):
+        # Titles are ranked by stored hits as well
+        return dataset + (stats_fingerprint(session),)
+
+    def update(self, session, fingerprint):
+        if self.fingerprint is not None and self.fingerprint[:-1] == fingerprint[:-1]:
+            # Only hits changed so titles need not be read again
+            self.rescore(popularity_scores(session))
+        else:
+            self.build(session)
+
+    def build(self, session, popularity: dict[int, float] | None = None):
+        if popularity is None:
+            popularity = popularity_scores(session)
+        rows = session.execute(text("SELECT id, title, year FROM movie")).all()
+        labels = [f"{title} ({year})" for _, title, year in rows]
+        ids = [id for id, _, _ in rows]
+        years = [year for _, _, year in rows]
+
+        entries: list[tuple[str, int, float]] = []
+        for position, (_, title, _) in enumerate(rows):
+            words = normalize(title).split(" ")
+            for start in range(len(words)):
+                # Matches at the start of the title rank above inner words
+                bonus = 1.0 if start == 0 else 0.0
+                entries.append((" ".join(words[start:]), position, bonus))
+        entries.sort()
+        keys = [key for key, _, _ in entries]
+        positions = [position for _, position, _ in entries]
+        bonuses = [bonus for _, _, bonus in entries]
+        self._data = (keys, positions, bonuses, [], {}, ids, labels, years)
+        self.rescore(popularity)
+
+    def rescore(self, popularity: dict[int, float]):
+        """Rank titles by the given hits without reading them again"""
+        keys, positions, bonuses, _, _, ids, labels, years = self._data
+        weights = [
+            self.weigh(year, popularity.get(id, 0)) for id, year in zip(ids, years)
+        ]
+        precomputed: dict[str, list[int]] = {}
+        # Prefixes of a wide range are all within wide ranges of shorter ones
+        wide = [(0, len(keys))]
+        length = 1
+        while wide:
+            ranges, wide = wide, []
+            for lo, hi in ranges:
+                for prefix, start, end in self._prefix_ranges(keys, lo, hi, length):
+                    if end - start > self.max_ranked_range:
+                        precomputed[prefix] = self._rank(
+                            self._candidates(weights, positions, bonuses, start, end),
+                            config.suggest_limit_per_query,
+                        )
+                        wide.append((start, end))
+            length += 1
+        self._data = (
+            keys,
+            positions,
+            bonuses,
+            weights,
+            precomputed,
+            ids,
+            labels,
+            years,
+        )
+
+    @staticmethod
+    def _prefix_ranges(
+        keys: list[str], lo: int, hi: int, length: int
+    ) -> t.Iterator[tuple[str, int, int]]:
+        """Ranges of keys within `lo:hi` sharing their first `length` characters"""
+        index = lo
+        while index < hi:
+            if len(keys[index]) < length:
+                index += 1
+                continue
+            prefix = keys[index][:length]
+            end = bisect.bisect_left(keys, prefix + "\x7f", index, hi)
+            yield prefix, index, end
+            index = end
+
+    @staticmethod
+    def _candidates(
+        weights: list[float],
+        positions: list[int],
+        bonuses: list[float],
+        lo: int,
+        hi: int,
+    ) -> t.Iterator[tuple[float, int]]:
+        for index in range(lo, hi):
+            yield weights[positions[index]] + bonuses[index], positions[index]
+
+    @staticmethod
+    def _rank(candidates: t.Iterable[tuple[float, int]], limit: int) -> list[int]:
+        best: dict[int, float] = {}
+        for score, position in candidates:
+            if score > best.get(position, -1.0):
+                best[position] = score
+        return heapq.nlargest(limit, best, key=best.__getitem__)
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[tuple[int, str]]:
+        """Top completions of a title prefix
+
+        Args:
+            prefix (str): Partial movie title.
+            limit (int, optional): Completions not to exceed. Defaults to 10.
+
+        Returns:
+            list[tuple[int, str]]: Movie id and label.
+        """
+        keys, positions, bonuses, weights, precomputed, ids, labels, _ = self._data
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if prefix in precomputed:
+            top = precomputed[prefix][:limit]
+        else:
+            lo = bisect.bisect_left(keys, prefix)
+            hi = bisect.bisect_left(keys, prefix + "\x7f", lo)
+            top = self._rank(
+                self._candidates(weights, positions, bonuses, lo, hi), limit
+            )
+        return [(ids[position], labels[position]) for position in top]
+
+
+def bitset(ids: t.Iterable[int]) -> int:
+    """Bitset of movie ids, built in one step rather than an OR per id"""
+    ids = ids if isinstance(ids, (list, array)) else list(ids)
+    if not len(ids):
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for id in ids:
+        buffer[id >> 3] |= 1 << (id & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def members(bits: int) -> t.Iterator[int]:
+    """Movie ids set in a bitset"""
+    buffer = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for match in re.finditer(rb"[^\x00]", buffer):
+        byte, base = match.group()[0], match.start() * 8
+        for offset in range(8):
+            if byte >> offset & 1:
+                yield base + offset
+
+
+class FacetIndex(CatalogIndex):
+    """Bitsets of movie ids per facet value.
+
+    Bit `n` of a bitset is set when the movie with id `n` has that value,
+    so combining filters is a bitwise AND and counting is a popcount.
+    Titles and descriptions are indexed by word so that matching them is
+    a union of word postings rather than a scan of every movie.
+    """
+
+    name = "facets"
+    facets = ("genres", "years", "distributions", "categories")
+    word_pattern = re.compile(r"\w+")
+    cached_words = 1_024
+
+    def __init__(self):
+        super().__init__()
+        self._data: tuple = ({facet: {} for facet in self.facets}, 0, {}, None)
+
+    def build(self, session):
+        ids: dict[str, dict[t.Any, array]] = {facet: {} for facet in self.facets}
+        texts: dict[str, dict[int, str]] = {"title": {}, "description": {}}
+        postings: dict[str, dict[str, array]] = {"title": {}, "description": {}}
+        movies = session.execute(
+            text(
+                "SELECT movie.id, movie.title, movie.description, movie.year,"
+                " movie.distribution, category.name FROM movie"
+                " LEFT JOIN category ON category.id = movie.category_id"
+                " ORDER BY movie.id"
+            )
+        )
+        all_ids = array("i")
+        for id, title, description, year, distribution, category in movies:
+            all_ids.append(id)
+            for field, value in (("title", title), ("description", description)):
+                value = (value or "").lower()
+                texts[field][id] = value
+                for word in set(self.word_pattern.findall(value)):
+                    postings[field].setdefault(word, array("i")).append(id)
+            for facet, value in (
+                ("years", year),
+                ("distributions", distribution),
+                ("categories", category),
+            ):
+                if value is not None:
+                    ids[facet].setdefault(value, array("i")).append(id)
+        genres = session.execute(
+            text(
+                "SELECT movie_genre.movie_id, genre.name FROM movie_genre"
+                " JOIN genre ON genre.id = movie_genre.genre_id"
+            )
+        )
+        for movie_id, genre in genres:
+            ids["genres"].setdefault(genre, array("i")).append(movie_id)
+        bitsets = {
+            facet: {value: bitset(members) for value, members in values.items()}
+            for facet, values in ids.items()
+        }
+
+        @functools.lru_cache(maxsize=self.cached_words)
+        def containing(field: str, word: str) -> int:
+            """Bitset of movies with a word of `field` containing `word`"""
+            return bitset(
+                itertools.chain.from_iterable(
+                    members
+                    for indexed, members in postings[field].items()
+                    if word in indexed
+                )
+            )
+
+        self._data = (bitsets, bitset(all_ids), texts, containing)
+
+    @staticmethod
+    def _union(bitsets: t.Iterable[int]) -> int:
+        union = 0
+        for bits in bitsets:
+            union |= bits
+        return union
+
+    def _matching(self, field: str, value: str) -> int:
+        """Bitset of movies whose `field` contains `value` as in SQL LIKE
+
+        `value` is matched literally, as searches escape `%` and `_`. Case is
+        folded over Unicode, whereas SQLite's LIKE only folds ASCII letters,
+        so non-ASCII titles may be counted here yet missed by searches.
+        """
+        _, all_bits, texts, containing = self._data
+        value = value.lower()
+        words = self.word_pattern.findall(value)
+        candidates = all_bits
+        for word in words:
+            candidates &= containing(field, word)
+        if words == [value]:
+            # A run of word characters only occurs within a single word
+            return candidates
+        return bitset(id for id in members(candidates) if value in texts[field][id])
+
+    def count(self, search) -> dict[str, t.Any]:
+        """Facet counts of movies matching search filters.
+
+        Filters are those of POST /api/v2/search, a movie matching `genres`
+        when it has any of them. Counts of each facet ignore the search's
+        own filter on that facet so that sibling values remain selectable.
+
+        Args:
+            search (SearchByPost): Search filters.
+
+        Returns:
+            dict[str, t.Any]: Total matches and counts per facet value.
+        """
+        bitsets, all_bits, _, _ = self._data
+        base = all_bits
+        if search.query:
+            base &= self._matching("title", search.query)
+        if search.description:
+            base &= self._matching("description", search.description)
+        base &= self._union(
+            bits
+            for year, bits in bitsets["years"].items()
+            if search.year_offset is not None and year >= search.year_offset
+        )
+
+        filters = dict.fromkeys(self.facets, all_bits)
+        if search.year:
+            filters["years"] = bitsets["years"].get(search.year, 0)
+        if search.distributions:
+            filters["distributions"] = self._union(
+                bitsets["distributions"].get(distribution, 0)
+                for distribution in search.distributions
+            )
+        if search.category:
+            filters["categories"] = bitsets["categories"].get(search.category, 0)
+        if search.genres:
+            filters["genres"] = self._union(
+                bitsets["genres"].get(genre, 0) for genre in search.genres
+            )
+
+        counts = {}
+        for facet in self.facets:
+            others = base
+            for other, bits in filters.items():
+                if other != facet:
+                    others &= bits
+            counts[facet] = {
+                value: (others & bits).bit_count()
+                for value, bits in sorted(bitsets[facet].items())
+            }
+        total = base
+        for bits in filters.values():
+            total &= bits
+        return dict(total=total.bit_count(), **counts)
+
+
+class SimilarityIndex(CatalogIndex):
+    """Top-k most similar movies of every movie.
+
+    Similarity combines cosine of TF-IDF vectors over descriptions, Jaccard
+    of genre sets and release year proximity. Candidates of a movie are the
+    movies sharing its strongest description terms (with postings capped per
+    term) topped up with movies released around the same year, so building
+    never compares all pairs. Neighbors are kept in flat int arrays.
+    """
+
+    name = "similar"
+    terms_per_movie = 8
+    postings_per_term = 64
+    max_document_frequency = 0.05
+    text_weight = 0.6
+    genre_weight = 0.25
+    year_weight = 0.15
+    stopwords = frozenset(
+        "the and for with his her their they them that this from into when who"
+        " whom what where which while are was were has have had not but all one"
+        " two three after before about over under its out off only own also"
+        " than then there these those being been more most other some such"
+        " tags title word".split()
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._data: tuple[array, array, int] = (array("i"), array("i"), 0)
+
+    @classmethod
+    def tokenize(cls, description: str | None) -> list[str]:
+        description = (description or "").split("...<more>")[0]
+        return [
+            token
+            for token in normalize(description).split(" ")
+            if len(token) > 2 and token not in cls.stopwords
+        ]
+
+    def _vector(
+        self, description: str | None, idf: dict[str, float]
+    ) -> list[tuple[str, float]]:
+        """Strongest TF-IDF terms of a description, L2 normalized"""
+        weights = {
+            term: count * idf[term]
+            for term, count in Counter(self.tokenize(description)).items()
+            if term in idf
+        }
+        top = heapq.nlargest(self.terms_per_movie, weights.items(), key=lambda x: x[1])
+        norm = math.sqrt(sum(weight * weight for _, weight in top)) or 1.0
+        return [(term, weight / norm) for term, weight in top]
+
+    @staticmethod
+    def _descriptions(session) -> t.Iterable[tuple[int, str | None]]:
+        return session.execute(
+            text("SELECT id, description FROM movie ORDER BY id"),
+            execution_options={"yield_per": 1_000},
+        )
+
+    def build(self, session):
+        k = config.similar_movies_per_movie
+        rows = session.execute(text("SELECT id, year FROM movie ORDER BY id")).all()
+        ids = array("i", (id for id, _ in rows))
+        years = array("i", (year for _, year in rows))
+        del rows
+        genres = [0] * len(ids)
+        for movie_id, genre_id in session.execute(
+            text("SELECT movie_id, genre_id FROM movie_genre")
+        ):
+            position = bisect.bisect_left(ids, movie_id)
+            if position < len(ids) and ids[position] == movie_id:
+                genres[position] |= 1 << genre_id
+
+        # Terms found in a single description can't relate movies while
+        # very common ones relate too many of them.
+        document_frequency = Counter()
+        for _, description in self._descriptions(session):
+            document_frequency.update(set(self.tokenize(description)))
+        max_df = max(2, int(len(ids) * self.max_document_frequency))
+        idf = {
+            term: math.log(len(ids) / count)
+            for term, count in document_frequency.items()
+            if 1 < count <= max_df
+        }
+        del document_frequency
+
+        postings: dict[str, tuple[array, array]] = {}
+        for position, (_, description) in enumerate(self._descriptions(session)):
+            for term, weight in self._vector(description, idf):
+                if term not in postings:
+                    postings[term] = (array("i"), array("f"))
+                postings[term][0].append(position)
+                postings[term][1].append(weight)
+        for term, (positions, weights) in postings.items():
+            if len(positions) > self.postings_per_term:
+                top = heapq.nlargest(
+                    self.postings_per_term,
+                    range(len(positions)),
+                    key=weights.__getitem__,
+                )
+                postings[term] = (
+                    array("i", (positions[index] for index in top)),
+                    array("f", (weights[index] for index in top)),
+                )
+
+        released_in = defaultdict(list)
+        for position, year in enumerate(years):
+            if len(released_in[year]) < k * 2:
+                released_in[year].append(position)
+
+        def score(position: int, other: int, text_similarity: float) -> float:
+            shared = (genres[position] & genres[other]).bit_count()
+            union = (genres[position] | genres[other]).bit_count()
+            return (
+                self.text_weight * text_similarity
+                + self.genre_weight * (shared / union if union else 0.0)
+                + self.year_weight / (1 + abs(years[position] - years[other]) / 5)
+            )
+
+        neighbors = array("i")
+        for position, (_, description) in enumerate(self._descriptions(session)):
+            candidates: dict[int, float] = defaultdict(float)
+            for term, weight in self._vector(description, idf):
+                if term in postings:
+                    for other, other_weight in zip(*postings[term]):
+                        candidates[other] += weight * other_weight
+            candidates.pop(position, None)
+            # Only the textually closest candidates get the full score
+            shortlist = dict(
+                heapq.nlargest(k * 3, candidates.items(), key=itemgetter(1))
+            )
+            year = years[position]
+            for delta in (0, 1, -1, 2, -2):
+                if len(shortlist) >= k * 3:
+                    break
+                for other in released_in.get(year + delta, ()):
+                    if other != position:
+                        shortlist.setdefault(other, 0.0)
+            top = heapq.nlargest(
+                k,
+                shortlist.items(),
+                key=lambda candidate: score(position, *candidate),
+            )
+            neighbors.extend(ids[other] for other, _ in top)
+            neighbors.extend([0] * (k - len(top)))
+
+        self._data = (ids, neighbors, k)
+
+    def similar(self, id: int, limit: int = 10) -> list[int] | None:
+        """Ids of movies most similar to a movie
+
+        Args:
+            id (int): Movie id.
+            limit (int, optional): Movies not to exceed. Defaults to 10.
+
+        Returns:
+            list[int] | None: Movie ids or None when movie is not indexed.
+        """
+        ids, neighbors, k = self._data
+        position = bisect.bisect_left(ids, id)
+        if position >= len(ids) or ids[position] != id:
+            return None
+        start = position * k
+        return [other for other in neighbors[start : start + min(k, limit)] if other]
+
+
+class CatalogValidation(CatalogIndex):
+    """Ids of movies whose rows are served without validating them again.
+
+    Every row is validated against `V2SearchResultsItem` once per dataset
+    change, including rows edited in place as caught by a checksum of the
+    catalog. Rows that fail, or that validation would rewrite as in urls
+    being normalized, keep going through full validation when served, as
+    do all rows until the index is first built in the background.
+    """
+
+    name = "validation"
+    checksummed = (
+        # Movies added by hybrid searches are left out as in dataset_fingerprint
+        "SELECT id, title, year, distribution, description, url, cover_photo,"
+        " category_id FROM movie"
+        " WHERE id IN (SELECT movie_id FROM movie_genre) ORDER BY id",
+        "SELECT id, movie_id, genre_id FROM movie_genre ORDER BY id",
+        "SELECT id, name FROM category ORDER BY id",
+        "SELECT id, name FROM genre ORDER BY id",
+    )
+    """Statements reading everything rows are served from"""
+
+    def __init__(self):
+        super().__init__()
+        self._trusted: frozenset[int] = frozenset()
+
+    def fingerprint_of(self, session, dataset):
+        # Rows edited in place leave the dataset summary as it was
+        digest = hashlib.sha1()
+        for statement in self.checksummed:
+            for row in session.execute(text(statement)):
+                digest.update(repr(tuple(row)).encode())
+        return dataset + (digest.hexdigest(),)
+
+    def build(self, session):
+        trusted: set[int] = set()
+        for movies in catalog_chunks(session):
+            for movie in movies:
+                try:
+                    item = V2SearchResultsItem.model_validate(movie)
+                except ValidationError as e:
+                    logger.warning(f"Movie {movie['id']} failed validation - {e}")
+                    continue
+                if item.model_dump(mode="json") == movie:
+                    trusted.add(movie["id"])
+        self._trusted = frozenset(trusted)
+
+    def trusts(self, movies: t.Iterable[dict[str, t.Any]]) -> bool:
+        """Checks whether all movies can be served without validation"""
+        if not config.trust_validated_catalog or self.fingerprint is None:
+            return False
+        trusted = self._trusted
+        return all(movie["id"] in trusted for movie in movies)
+
+
+title_index = TitleIndex()
+"""Prefix index of movie titles"""
+
+facet_index = FacetIndex()
+"""Bitsets of movie ids per facet value"""
+
+similarity_index = SimilarityIndex()
+"""Top-k most similar movies of every movie"""
+
+catalog_validation = CatalogValidation()
+"""Movies validated at ingest"""
+
+catalog_indexes: list[CatalogIndex] = [
+    title_index,
+    facet_index,
+    similarity_index,
+    catalog_validation,
+]
+"""Indexes rebuilt whenever the dataset changes"""
+
+
+def dataset_fingerprint(session: DBSession) -> tuple:
+    """Cheap summary of the catalog that changes with its contents
+
+    Only movies having genres are summarized. Movies added by hybrid
+    searches have none, so catalog growth from searches doesn't rebuild
+    every index. They are indexed along with the next dataset change.
+    """
+    return tuple(
+        session.execute(
+            text(
+                "SELECT (SELECT COUNT(DISTINCT movie_id) FROM movie_genre),"
+                " (SELECT MAX(movie_id) FROM movie_genre),"
+                " (SELECT COUNT(id) FROM movie_genre)"
+            )
+        ).first()
+    )
+
+
+def refresh(*indexes: CatalogIndex, force: bool = False) -> None:
+    """Rebuild indexes whose contents are out of date with the dataset"""
+    with ReaderSession() as session:
+        dataset = dataset_fingerprint(session)
+        for index in indexes or catalog_indexes:
+            fingerprint = index.fingerprint_of(session, dataset)
+            with index._lock:
+                if not force and index.fingerprint == fingerprint:
+                    continue
+                logger.info(f"Building {index.name} index")
+                generation = index.generation
+                # Built aside so that served contents are swapped in one step
+                replacement = copy.copy(index)
+                if force:
+                    replacement.build(session)
+                else:
+                    replacement.update(session, fingerprint)
+                replacement.fingerprint = fingerprint
+                if not index.take_over(replacement, generation):
+                    logger.info(f"Discarded {index.name} index of a replaced dataset")
+
+
+def stage(session: DBSession) -> list[tuple[CatalogIndex, CatalogIndex]]:
+    """Build every index afresh from a database without touching those served
+
+    Args:
+        session (DBSession): Session of the database to build from.
+
+    Returns:
+        list[tuple[CatalogIndex, CatalogIndex]]: Served indexes and their staged replacements.
+    """
+    dataset = dataset_fingerprint(session)
+    staged = []
+    for index in catalog_indexes:
+        replacement = type(index)()
+        logger.info(f"Staging {index.name} index")
+        replacement.build(session)
+        replacement.fingerprint = replacement.fingerprint_of(session, dataset)
+        staged.append((index, replacement))
+    return staged
+
+
+async def refresh_periodically():
+    """Keep indexes in sync with the dataset"""
+    while True:
+        await asyncio.sleep(config.index_refresh_interval_in_seconds)
+        try:
+            await asyncio.to_thread(refresh)
+        except Exception as e:
+            logger.exception(e)
+
+
+_refresher: asyncio.Task | None = None
+
+
+async def start_index_refresher():
+    """Build every index before serving, then keep them in sync"""
+    global _refresher
+    try:
+        await asyncio.to_thread(refresh)
+    except Exception as e:
+        # Indexes left unbuilt are built on first use
+        logger.exception(e)
+    _refresher = asyncio.create_task(refresh_periodically())
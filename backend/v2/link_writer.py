@@ -0,0 +1,131 @@
+"""Write-behind persistence of resolved download links
+
+Resolved links are handed to the client straight away and queued for a
+background thread that saves them in grouped transactions, so requests never
+wait on SQLite's write lock or fsync. Links still queued are served from
+memory to requests arriving before they are saved.
+"""
+
+import queue
+import threading
+import time
+import typing as t
+from backend.config import config, logger
+from backend.database import Session
+from backend.metrics import metrics
+from backend.downloads import save_download_links
+
+Link = tuple[int, t.Literal["normal", "best"], str, str]
+"""Movie id, quality, filename and url"""
+
+
+class LinkWriter:
+    """Bounded queue of download links saved in batches by a background thread"""
+
+    def __init__(self):
+        self._queue: queue.Queue[tuple[Link, float] | None] | None = None
+        self._pending: dict[tuple[int, str], tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._queue = queue.Queue(maxsize=config.link_writer_queue_size)
+                self._thread = threading.Thread(
+                    target=self._work, name="link-writer", daemon=True
+                )
+                self._thread.start()
+
+    def put(
+        self, id: int, quality: t.Literal["normal", "best"], filename: str, url: str
+    ) -> bool:
+        """Queue a resolved link for saving
+
+        Returns:
+            bool: False when the queue is full and the link was dropped.
+        """
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            self._pending[(id, quality)] = (filename, url)
+        try:
+            self._queue.put_nowait(((id, quality, filename, url), time.monotonic()))
+        except queue.Full:
+            # Only the cache entry is lost. The link is resolved again if asked
+            with self._lock:
+                self._pending.pop((id, quality), None)
+            metrics.increment("link_writer.dropped")
+            return False
+        metrics.set("link_writer.queue_size", self._queue.qsize())
+        return True
+
+    def get(self, id: int, quality: str) -> tuple[str, str] | None:
+        """Filename and url of a link queued but not saved yet"""
+        with self._lock:
+            return self._pending.get((id, quality))
+
+    def _take_batch(self) -> tuple[list[tuple[Link, float]], bool]:
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + config.link_writer_max_delay_in_ms / 1000
+        while len(batch) < config.link_writer_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _work(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._take_batch()
+            if batch:
+                self._save(batch)
+            for _ in range(len(batch) + stopping):
+                self._queue.task_done()
+
+    def _save(self, batch: list[tuple[Link, float]]):
+        links = {(link[0], link[1]): link for link, _ in batch}
+        try:
+            with Session() as db_session:
+                save_download_links(db_session, links.values())
+        except Exception as e:
+            # Only the cache entries are lost. Links are resolved again if asked
+            saved = False
+            metrics.increment("link_writer.failed", len(links))
+            logger.warning(f"Failed to save {len(links)} download links - {e}")
+        else:
+            saved = True
+        lag = time.monotonic() - min(queued_at for _, queued_at in batch)
+        with self._lock:
+            for key, link in links.items():
+                if self._pending.get(key) == link[2:]:
+                    del self._pending[key]
+        metrics.increment("link_writer.batches")
+        if saved:
+            metrics.increment("link_writer.saved", len(links))
+        metrics.set("link_writer.last_batch_size", len(links))
+        metrics.set("link_writer.last_lag_ms", round(lag * 1000, 3))
+        metrics.set("link_writer.queue_size", self._queue.qsize())
+
+    def flush(self):
+        """Wait until every queued link is saved"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        """Save queued links and stop the background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+
+link_writer = LinkWriter()
+"""Download links writer of this worker"""
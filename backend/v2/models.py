@@ -1,7 +1,17 @@
 """Pydantic models"""
 
+import functools
 import typing as t
-from pydantic import BaseModel, PositiveInt, HttpUrl, Field, field_validator
+from typing_extensions import TypedDict
+from pydantic import (
+    BaseModel,
+    PositiveInt,
+    HttpUrl,
+    Field,
+    TypeAdapter,
+    create_model,
+    field_validator,
+)
 from backend.config import config
 
 
@@ -71,7 +81,7 @@ class SearchByPost(BaseModel):
         description="Movie genre names.",
     )
     category: t.Optional[t.Literal["Bollywood", "Hollywood"]] = Field(
-        "Hollywood",
+        None,
         description="Movie category name as in Bollywood etc.",
     )
     year: t.Optional[PositiveInt] = Field(
@@ -108,6 +118,16 @@ class SearchByPost(BaseModel):
     )
     offset: t.Optional[int] = Field(0, description="Search results offset")
     year_offset: t.Optional[int] = Field(0, description="Movie release year offset")
+    order_by: t.Optional[t.Literal["popularity"]] = Field(
+        None, description="Order movies by popularity, most viewed first"
+    )
+    fields: t.Optional[list[str]] = Field(
+        None,
+        description="Movie fields to include, e.g. `title` and `cover_photo`. `id` is always included",
+    )
+    description_max_chars: t.Optional[PositiveInt] = Field(
+        None, description="Cut movie descriptions longer than this"
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -121,6 +141,9 @@ class SearchByPost(BaseModel):
                 "limit": 10,
                 "offset": 0,
                 "year_offset": 0,
+                "order_by": None,
+                "fields": None,
+                "description_max_chars": None,
             }
         }
     }
@@ -135,6 +158,49 @@ class SearchByPost(BaseModel):
         return value
 
 
+class SearchByPostStream(SearchByPost):
+    limit: t.Optional[int] = Field(
+        config.search_stream_limit_per_query,
+        description="Total number of movies not to exceed",
+    )
+
+    @field_validator("limit")
+    def validate_limit(value):
+        if value > config.search_stream_limit_per_query:
+            raise ValueError(
+                "Search limit value exceeds total possible limit set"
+                f" per query {config.search_stream_limit_per_query}"
+            )
+        return value
+
+
+class HybridSearch(BaseModel):
+    query: str = Field(description="Movie title name")
+    category: t.Optional[t.Literal["Bollywood", "Hollywood"]] = Field(
+        "Hollywood",
+        description="Movie category name as in Bollywood etc.",
+    )
+    limit: t.Optional[PositiveInt] = Field(
+        20,
+        description="Total number of movies not to exceed",
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {"query": "Love", "category": "Hollywood", "limit": 20}
+        }
+    }
+
+    @field_validator("limit")
+    def validate_limit(value):
+        if value > config.search_limit_per_query:
+            raise ValueError(
+                "Search limit value exceeds total possible limit set"
+                f" per query {config.search_limit_per_query}"
+            )
+        return value
+
+
 class V2SearchResultsItem(BaseModel):
     """Movie search results"""
 
@@ -261,3 +327,95 @@ class V2SearchResults(BaseModel):
             }
         }
     }
+
+
+class HybridSearchResults(V2SearchResults):
+    """Movies found locally followed by those found upstream"""
+
+    upstream: int = Field(description="Movies found upstream and added to catalog")
+
+
+class FacetCounts(BaseModel):
+    """Number of movies per facet value matching search filters"""
+
+    total: int = Field(description="Total movies matching all filters")
+    genres: dict[str, int] = Field(description="Movies per genre name")
+    years: dict[int, int] = Field(description="Movies per release year")
+    distributions: dict[str, int] = Field(description="Movies per distribution")
+    categories: dict[str, int] = Field(description="Movies per category name")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "total": 12,
+                "genres": {"Comedy": 7, "Drama": 5, "Romance": 12},
+                "years": {2011: 9, 2012: 12, 2013: 10},
+                "distributions": {"BluRay": 12, "DVDRip": 2},
+                "categories": {"Bollywood": 1, "Hollywood": 12},
+            }
+        }
+    }
+
+
+class SimilarMovies(BaseModel):
+    """Movies similar to a particular movie"""
+
+    id: int = Field(description="Identity number of the movie compared against")
+    movies: list[V2SearchResultsItem] = Field(
+        description="Similar movies, most similar first"
+    )
+
+
+@functools.cache
+def projected_movie(fields: tuple[str, ...]) -> type[BaseModel]:
+    """`V2SearchResultsItem` having only `fields`"""
+    return create_model(
+        "V2SearchResultsItem",
+        **{
+            field: (V2SearchResultsItem.model_fields[field].annotation, ...)
+            for field in fields
+        },
+    )
+
+
+@functools.cache
+def projected_search_results(fields: tuple[str, ...]) -> type[BaseModel]:
+    """`V2SearchResults` of movies having only `fields`"""
+    return create_model(
+        "V2SearchResults",
+        query=(t.Optional[str], None),
+        movies=(list[projected_movie(fields)], ...),
+    )
+
+
+class TrustedMovie(TypedDict):
+    """`V2SearchResultsItem` of a catalog row already validated at ingest.
+
+    Serializing it skips parsing urls and checking literals again, and
+    leaves out fields missing from projected rows.
+    """
+
+    id: int
+    title: str
+    genres: list[str]
+    category: str
+    year: t.Optional[int]
+    distribution: str
+    description: t.Optional[str]
+    url: str
+    cover_photo: str
+
+
+class TrustedSearchResults(TypedDict):
+    query: t.Optional[str]
+    movies: list[TrustedMovie]
+
+
+class TrustedSimilarMovies(TypedDict):
+    id: int
+    movies: list[TrustedMovie]
+
+
+trusted_movie_adapter = TypeAdapter(TrustedMovie)
+trusted_search_results_adapter = TypeAdapter(TrustedSearchResults)
+trusted_similar_movies_adapter = TypeAdapter(TrustedSimilarMovies)
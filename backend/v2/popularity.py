@@ -0,0 +1,196 @@
+"""Write-behind popularity counters of movies
+
+Views are counted in memory per request and flushed to the `movie_stats`
+table in one transaction every `popularity_flush_interval_in_seconds` and
+on shutdown, so counting never adds a write to the request path.
+"""
+
+import asyncio
+import threading
+import typing as t
+from collections import Counter
+from sqlalchemy import Select, bindparam, func, insert, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Query, Session as DBSession
+import backend.database as database
+from backend.database import Movie, MovieStats
+from backend.config import config, logger
+from backend.metrics import metrics
+from backend.utils import utcnow
+
+SelectOrQuery = t.TypeVar("SelectOrQuery", Select, Query)
+
+kinds = ("movie_views", "metadata_views", "download_link_views")
+"""Views counted separately per movie"""
+
+_increment = (
+    update(MovieStats.__table__)
+    .where(MovieStats.id == bindparam("movie_id"))
+    .values(
+        {
+            **{
+                kind: getattr(MovieStats, kind) + bindparam(f"added_{kind}")
+                for kind in kinds + ("hits",)
+            },
+            "updated_on": bindparam("now"),
+        }
+    )
+)
+
+_tables_ensured: set[Engine] = set()
+
+
+def ensure_table():
+    """Create stats table in databases predating it
+
+    Tables are created at startup and on dataset reloads, so this only runs
+    off the request path, before flushes.
+    """
+    if database.engine not in _tables_ensured:
+        MovieStats.__table__.create(database.engine, checkfirst=True)
+        _tables_ensured.add(database.engine)
+
+
+def by_popularity(statement: SelectOrQuery) -> SelectOrQuery:
+    """Order movies of a select or query by stored hits, most viewed first"""
+    return statement.outerjoin(MovieStats, MovieStats.id == Movie.id).order_by(
+        func.coalesce(MovieStats.hits, 0).desc()
+    )
+
+
+class PopularityCounter:
+    """Per-movie view counts pending a flush"""
+
+    def __init__(self):
+        self._pending: dict[str, Counter[int]] = {kind: Counter() for kind in kinds}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def hit(
+        self,
+        id: int,
+        kind: t.Literal["movie_views", "metadata_views", "download_link_views"],
+    ) -> None:
+        """Count a view of a movie"""
+        with self._lock:
+            self._pending[kind][id] += 1
+
+    def _take(self) -> dict[int, dict[str, int]]:
+        with self._lock:
+            pending, self._pending = self._pending, {kind: Counter() for kind in kinds}
+        views: dict[int, dict[str, int]] = {}
+        for kind, counts in pending.items():
+            for id, count in counts.items():
+                views.setdefault(id, dict.fromkeys(kinds, 0))[kind] = count
+        return views
+
+    def _restore(self, views: dict[int, dict[str, int]]):
+        with self._lock:
+            for id, counts in views.items():
+                for kind, count in counts.items():
+                    self._pending[kind][id] += count
+
+    def flush(self) -> int:
+        """Add pending views to stored counts in a single transaction
+
+        Returns:
+            int: Number of movies updated.
+        """
+        with self._flush_lock:
+            views = self._take()
+            if not views:
+                return 0
+            try:
+                ensure_table()
+                with database.Session() as db_session:
+                    self._save(db_session, views)
+            except Exception:
+                # Views are kept for the next flush
+                self._restore(views)
+                raise
+        metrics.increment("popularity.flushes")
+        metrics.increment("popularity.flushed_movies", len(views))
+        return len(views)
+
+    @staticmethod
+    def _save(db_session: DBSession, views: dict[int, dict[str, int]]):
+        ids = list(views)
+        existing: set[int] = set()
+        for start in range(0, len(ids), 500):
+            existing.update(
+                db_session.scalars(
+                    select(MovieStats.id).where(
+                        MovieStats.id.in_(ids[start : start + 500])
+                    )
+                )
+            )
+        now = utcnow()
+        updates = [
+            dict(
+                movie_id=id,
+                now=now,
+                added_hits=sum(counts.values()),
+                **{f"added_{kind}": count for kind, count in counts.items()},
+            )
+            for id, counts in views.items()
+            if id in existing
+        ]
+        inserts = [
+            dict(id=id, hits=sum(counts.values()), updated_on=now, **counts)
+            for id, counts in views.items()
+            if id not in existing
+        ]
+        if updates:
+            db_session.execute(_increment, updates)
+        if inserts:
+            db_session.execute(insert(MovieStats.__table__), inserts)
+        db_session.commit()
+
+    def flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"Failed to flush popularity counters - {e}")
+
+
+popularity = PopularityCounter()
+"""Popularity counters of this worker"""
+
+
+def popularity_scores(session: DBSession) -> dict[int, float]:
+    """Stored hits of every movie viewed at least once"""
+    try:
+        return dict(session.execute(select(MovieStats.id, MovieStats.hits)).all())
+    except OperationalError:
+        # Stats table is yet to be created
+        session.rollback()
+        return {}
+
+
+def stats_fingerprint(session: DBSession) -> tuple | None:
+    """Summary of stored hits that changes with every flush"""
+    try:
+        return tuple(
+            session.execute(
+                select(func.count(MovieStats.id), func.max(MovieStats.updated_on))
+            ).first()
+        )
+    except OperationalError:
+        session.rollback()
+        return None
+
+
+async def flush_periodically():
+    """Flush popularity counters at intervals"""
+    while True:
+        await asyncio.sleep(config.popularity_flush_interval_in_seconds)
+        await asyncio.to_thread(popularity.flush_quietly)
+
+
+_flusher: asyncio.Task | None = None
+
+
+async def start_popularity_flusher():
+    global _flusher
+    _flusher = asyncio.create_task(flush_periodically())
@@ -0,0 +1,120 @@
+"""Speculative prefetching of download links
+
+Clients viewing a movie's metadata usually ask for its download link
+shortly after. Since the metadata request has already scraped the movie
+page, its files are handed over to a small background pool that resolves
+and caches the download link of every quality before it's asked for.
+"""
+
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import fzmovies_api.models as fz_models
+from backend.config import config, logger
+from backend.database import ReaderSession
+from backend.metrics import metrics
+from backend.v2.link_writer import link_writer
+from backend.downloads import (
+    quality_model_map,
+    quality_file_index,
+    resolve_download_link,
+    is_fresh,
+)
+
+
+class Prefetcher:
+    """Resolves download links in the background within a budget"""
+
+    remembered_prefetches = 10_000
+
+    def __init__(self):
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: set[tuple[int, str]] = set()
+        self._prefetched: OrderedDict[tuple[int, str], float] = OrderedDict()
+        self._window_start = 0.0
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=config.prefetch_workers, thread_name_prefix="prefetch"
+            )
+        return self._executor
+
+    def _take_budget(self) -> bool:
+        now = time.monotonic()
+        if now - self._window_start >= 60:
+            self._window_start, self._window_count = now, 0
+        if self._window_count >= config.prefetch_budget_per_minute:
+            return False
+        self._window_count += 1
+        return True
+
+    def submit(self, id: int, files: fz_models.MovieFiles) -> None:
+        """Schedule download links of a movie's qualities for prefetching
+
+        Args:
+            id (int): Movie id.
+            files (fz_models.MovieFiles): Files listed in the movie page.
+        """
+        if not config.prefetch_download_links:
+            return
+        for quality, index in quality_file_index.items():
+            if len(files.files) <= index:
+                continue
+            key = (id, quality)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                if len(self._pending) >= config.prefetch_queue_size:
+                    metrics.increment("prefetch.skipped_queue_full")
+                    continue
+                if not self._take_budget():
+                    metrics.increment("prefetch.skipped_budget")
+                    continue
+                self._pending.add(key)
+            metrics.increment("prefetch.scheduled")
+            self.executor.submit(self._prefetch, id, quality, files)
+
+    def _prefetch(
+        self, id: int, quality: t.Literal["normal", "best"], files: fz_models.MovieFiles
+    ):
+        key = (id, quality)
+        try:
+            with ReaderSession() as db_session:
+                cached_results = db_session.get(quality_model_map[quality], id)
+                if is_fresh(cached_results) or link_writer.get(id, quality):
+                    metrics.increment("prefetch.already_cached")
+                    return
+            filename, url = resolve_download_link(files, quality)
+            link_writer.put(id, quality, filename, url)
+            metrics.increment("prefetch.completed")
+            with self._lock:
+                self._prefetched[key] = time.time()
+                while len(self._prefetched) > self.remembered_prefetches:
+                    self._prefetched.popitem(last=False)
+        except Exception as e:
+            metrics.increment("prefetch.failed")
+            logger.warning(f"Failed to prefetch {quality} download link of {id} - {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def record_request(self, id: int, quality: str) -> None:
+        """Count a download link request towards prefetch hit ratio"""
+        with self._lock:
+            prefetched = self._prefetched.pop((id, quality), None) is not None
+        if prefetched:
+            metrics.increment("prefetch.hits")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+prefetcher = Prefetcher()
+"""Download links prefetcher of this worker"""
@@ -1,28 +1,50 @@
 """V2 Routes"""
 
+import asyncio
 import typing as t
-from fastapi import APIRouter, HTTPException, status, Query, Path
+from fastapi import APIRouter, HTTPException, status, Query, Path, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
 import backend.v2.models as models
-from backend.database import Movie, NormalDownloadLink, BestDownloadLink
-from backend.database import session
+from backend.database import Movie, Category, Genre, BestDownloadLink
+from backend.database import session, reader_session, ReaderSession, dataset
 import backend.utils as utils
+import backend.export as export
 from backend.config import config, logger
-from sqlalchemy import text
-import fzmovies_api.models as fz_models
-from fzmovies_api import Navigate, DownloadLinks, Download
+from backend.v2.indexes import (
+    title_index,
+    facet_index,
+    similarity_index,
+    catalog_validation,
+    start_index_refresher,
+)
+from sqlalchemy import text, select
+from sqlalchemy.orm import selectinload
 from backend.v1 import models as v1_models
+from backend.metrics import metrics
+from backend.v2.prefetch import prefetcher
+from backend.v2.link_writer import link_writer
+from backend.v2.popularity import popularity, by_popularity, start_popularity_flusher
+from backend.v2.hybrid import local_movies, upstream_movies
+import backend.v2.covers as covers
+import backend.v2.projection as projection
+from backend.deadlines import UpstreamBudget, DeadlineExceeded
+from backend.downloads import (
+    quality_model_map,
+    quality_file,
+    navigate,
+    download_links,
+    final_url,
+    is_fresh,
+    MissingFile,
+    MissingDownloadLink,
+)
+from backend.cache import cache, make_key
 from datetime import timedelta
 from sqlalchemy.exc import OperationalError
 
 router = APIRouter()
 
-total_movies = session.execute(text("SELECT COUNT(id) FROM movie")).first()[0]
-
-quality_model_map = {
-    "normal": NormalDownloadLink,
-    "best": BestDownloadLink,
-}
-
 
 def clear_expired_download_links():
     time = utils.utcnow().replace(tzinfo=None) - timedelta(
@@ -40,6 +62,21 @@ def clear_expired_download_links():
 
 router.add_event_handler("startup", clear_expired_download_links)
 
+router.add_event_handler("startup", start_index_refresher)
+
+router.add_event_handler("startup", start_popularity_flusher)
+
+router.add_event_handler("shutdown", prefetcher.shutdown)
+
+router.add_event_handler("shutdown", link_writer.close)
+
+router.add_event_handler("shutdown", popularity.flush_quietly)
+
+
+def trusted_response(adapter: TypeAdapter, content: t.Any) -> Response:
+    """JSON response of catalog rows serialized without validating them again"""
+    return Response(adapter.dump_json(content), media_type="application/json")
+
 
 @router.get("/search", name="Search movie")
 @utils.router_exception_handler
@@ -53,148 +90,444 @@ async def search_movie(
     ),
     offset: t.Optional[int] = Query(0, description="Search results offset"),
     year_offset: t.Optional[int] = Query(0, description="Movie realease year offset"),
+    order_by: t.Optional[t.Literal["popularity"]] = Query(
+        None, description="Order movies by popularity, most viewed first"
+    ),
 ) -> models.ShallowSearchResults:
     """Search movies from cache and return shallow results"""
-    movies = (
-        session.query(Movie)
-        .filter(Movie.title.like(f"%{q}%"), Movie.year > year_offset)
-        .offset(offset)
-        .limit(limit)
-        .all()
+    query = reader_session.query(Movie).filter(
+        Movie.title.like(f"%{q}%"), Movie.year > year_offset
     )
+    if order_by == "popularity":
+        query = by_popularity(query).order_by(Movie.id)
+    movies = query.offset(offset).limit(limit).all()
     return models.ShallowSearchResults(
         query=q, results=[dict(id=movie.id, title=str(movie)) for movie in movies]
     )
 
 
-@router.post("/search", name="Search movies deeply")
+@router.get("/suggest", name="Suggest movie titles")
 @utils.router_exception_handler
-async def search_movies_by_post(search: models.SearchByPost) -> models.V2SearchResults:
-    """Search movies from cache and return whole movie metadata"""
+async def suggest_movie_titles(
+    q: str = Query(description="Partial movie title"),
+    limit: t.Optional[int] = Query(
+        10,
+        description="Total movie titles not to exceed",
+        gt=0,
+        le=config.suggest_limit_per_query,
+    ),
+) -> models.ShallowSearchResults:
+    """Autocomplete movie titles from in-memory index"""
+    await title_index.ensure_built()
+    return models.ShallowSearchResults(
+        query=q,
+        results=[
+            dict(id=id, title=title) for id, title in title_index.suggest(q, limit)
+        ],
+    )
+
+
+def search_filters(search: models.SearchByPost) -> list:
+    """Movie filters matching deep search fields"""
     filters = [Movie.year >= search.year_offset]
     if search.query:
-        filters.append(Movie.title.like(f"%{search.query}%"))
-    """
+        filters.append(Movie.title.contains(search.query, autoescape=True))
     if search.category:
-        filters.append(
-            Movie.category.name == search.category
-            )
+        filters.append(Movie.category.has(Category.name == search.category))
     if search.genres:
-        filters.append(
-            Movie.genres.name.in_(search.genres)
-            )
-    """
+        filters.append(Movie.genres.any(Genre.name.in_(search.genres)))
     if search.description:
-        filters.append(Movie.description.like(f"%{search.description}%"))
+        filters.append(Movie.description.contains(search.description, autoescape=True))
     if search.distributions:
         filters.append(Movie.distribution.in_(search.distributions))
     if search.year:
         filters.append(Movie.year == search.year)
+    return filters
+
 
-    movies = (
-        session.query(Movie)
-        .filter(*filters)
+@router.post("/search", name="Search movies deeply")
+@utils.router_exception_handler
+async def search_movies_by_post(search: models.SearchByPost) -> models.V2SearchResults:
+    """Search movies from cache and return whole movie metadata
+
+    Only `fields` of movies are included when given.
+    """
+    fields = projection.requested_fields(search.fields, search.description_max_chars)
+    if fields is not None:
+        statement = projection.select_movies(
+            fields, search.description_max_chars
+        ).where(*search_filters(search))
+        if search.order_by == "popularity":
+            statement = by_popularity(statement).order_by(Movie.id)
+        statement = statement.offset(search.offset).limit(search.limit)
+        movies = covers.proxied(
+            projection.movies_of(
+                reader_session,
+                reader_session.execute(statement),
+                fields,
+                search.description_max_chars,
+            )
+        )
+        if catalog_validation.trusts(movies):
+            return trusted_response(
+                models.trusted_search_results_adapter,
+                dict(query=search.query, movies=movies),
+            )
+        return Response(
+            models.projected_search_results(fields)(
+                query=search.query, movies=movies
+            ).model_dump_json(),
+            media_type="application/json",
+        )
+    query = reader_session.query(Movie).filter(*search_filters(search))
+    if search.order_by == "popularity":
+        query = by_popularity(query).order_by(Movie.id)
+    movies = query.offset(search.offset).limit(search.limit).all()
+    movies = covers.proxied([movie.model_dump() for movie in movies])
+    if catalog_validation.trusts(movies):
+        return trusted_response(
+            models.trusted_search_results_adapter,
+            dict(query=search.query, movies=movies),
+        )
+    return models.V2SearchResults(query=search.query, movies=movies)
+
+
+@router.post("/search/stream", name="Search movies deeply and stream results")
+@utils.router_exception_handler
+async def search_movies_by_post_stream(
+    search: models.SearchByPostStream,
+) -> t.Annotated[
+    t.Generator[models.V2SearchResultsItem, None, None], StreamingResponse
+]:
+    """Search movies from cache and stream whole movie metadata as NDJSON
+
+    Only `fields` of movies are included when given.
+    """
+    fields = projection.requested_fields(search.fields, search.description_max_chars)
+    if fields is not None:
+        statement = projection.select_movies(fields, search.description_max_chars)
+    else:
+        statement = select(Movie).options(
+            selectinload(Movie.category), selectinload(Movie.genres)
+        )
+    statement = statement.where(*search_filters(search))
+    if search.order_by == "popularity":
+        statement = by_popularity(statement)
+    statement = (
+        statement.order_by(Movie.id)
         .offset(search.offset)
         .limit(search.limit)
-        .all()
+        .execution_options(yield_per=100)
     )
-    return models.V2SearchResults(
-        query=search.query, movies=[movie.model_dump() for movie in movies]
+
+    def projected_movies(stream_session):
+        rows = stream_session.execute(statement)
+        for partition in rows.partitions():
+            yield from projection.movies_of(
+                stream_session, partition, fields, search.description_max_chars
+            )
+
+    def generate_streaming_response():
+        # Rows are fetched in batches from the cursor and let go once sent
+        with ReaderSession() as stream_session:
+            if fields is not None:
+                movies = projected_movies(stream_session)
+                item_model = models.projected_movie(fields)
+            else:
+                movies = (
+                    movie.model_dump() for movie in stream_session.scalars(statement)
+                )
+                item_model = models.V2SearchResultsItem
+            for movie in movies:
+                (movie,) = covers.proxied((movie,))
+                if catalog_validation.trusts((movie,)):
+                    yield models.trusted_movie_adapter.dump_json(movie) + b"\n"
+                else:
+                    item = item_model(**movie)
+                    yield item.model_dump_json().encode() + b"\n"
+
+    return StreamingResponse(
+        generate_streaming_response(), media_type="application/x-ndjson"
     )
 
 
+@router.post("/search/hybrid", name="Search movies locally then upstream")
+@utils.router_exception_handler
+async def search_movies_hybrid(
+    search: models.HybridSearch, request: Request
+) -> models.HybridSearchResults:
+    """Search movies from cache and upstream for the shortfall.
+
+    Movies found upstream are added to the cache.
+    """
+    metrics.increment("hybrid.searches")
+    # Short-lived session so that movies added by other requests are seen
+    with ReaderSession() as read_session:
+        movies = local_movies(read_session, search.query, search.category, search.limit)
+    found = []
+    exhausted_key = make_key("v2:hybrid:exhausted", search.query, search.category)
+    if len(movies) < search.limit and cache.get(exhausted_key) is not None:
+        # Upstream had nothing more for this search a short while ago
+        metrics.increment("cache.negative_hits")
+    elif len(movies) < search.limit:
+        metrics.increment("hybrid.upstream_searches")
+        budget = UpstreamBudget(
+            "hybrid_search", config.search_deadline_in_seconds, request
+        )
+        try:
+            found, exhausted = await upstream_movies(
+                search.query,
+                search.category,
+                search.limit - len(movies),
+                {movie["id"] for movie in movies},
+                budget,
+            )
+        except DeadlineExceeded as e:
+            # Local movies are still worth returning
+            logger.info(f"Hybrid search served locally only - {e}")
+        else:
+            if exhausted:
+                cache.set(exhausted_key, True, config.cache_search_ttl_in_seconds)
+                metrics.increment("cache.negative_stored")
+    return models.HybridSearchResults(
+        query=search.query,
+        movies=covers.proxied(movies + found),
+        upstream=len(found),
+    )
+
+
+@router.get("/export", name="Export catalog")
+@utils.router_exception_handler
+async def export_catalog(
+    format: t.Literal["ndjson", "csv", "parquet"] = Query(
+        "ndjson", description="Export file format"
+    ),
+    gzip: t.Optional[bool] = Query(False, description="Gzip compress the export"),
+    after_id: t.Optional[int] = Query(
+        0, description="Export movies with ids greater than this - for resuming", ge=0
+    ),
+    until_id: t.Optional[int] = Query(
+        None, description="Export movies with ids up to this", ge=1
+    ),
+) -> t.Annotated[t.Generator[bytes, None, None], StreamingResponse]:
+    """Stream whole movies catalog with category and genres joined"""
+    if not export.is_available(format):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"Exporting {format} is not supported by this server.",
+        )
+    media_type, extension = export.formats[format]
+    filename = f"catalog.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        export.export_catalog(format, gzip, after_id, until_id),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.post("/facets", name="Search facet counts")
+@utils.router_exception_handler
+async def search_facet_counts(search: models.SearchByPost) -> models.FacetCounts:
+    """Count movies per genre, year, distribution and category matching filters"""
+    await facet_index.ensure_built()
+    # Words matched for the first time still gather their postings
+    counts = await asyncio.to_thread(facet_index.count, search)
+    return models.FacetCounts(**counts)
+
+
 @router.get("/movie/{id}")
 @utils.router_exception_handler
 async def get_specific_movie_info(
-    id: int = Path(description="Movie id", ge=1, le=total_movies)
+    id: int = Path(description="Movie id", ge=1),
+    fields: t.Optional[str] = Query(
+        None,
+        description="Comma-separated movie fields to include. `id` is always included",
+    ),
+    description_max_chars: t.Optional[int] = Query(
+        None, description="Cut movie description longer than this", gt=0
+    ),
 ) -> models.V2SearchResultsItem:
     """Get metadata for a particular movie"""
-    movie = session.get(Movie, id)
+    projected = projection.requested_fields(
+        fields.split(",") if fields is not None else None, description_max_chars
+    )
+    if projected is not None:
+        movies = projection.movies_of(
+            reader_session,
+            reader_session.execute(
+                projection.select_movies(projected, description_max_chars).where(
+                    Movie.id == id
+                )
+            ),
+            projected,
+            description_max_chars,
+        )
+        movie = movies[0] if movies else None
+    else:
+        movie = reader_session.get(Movie, id)
+        movie = movie.model_dump() if movie else None
+    if not movie:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"There's no movie with id '{id}.'",
+        )
+    popularity.hit(id, "movie_views")
+    (movie,) = covers.proxied((movie,))
+    if catalog_validation.trusts((movie,)):
+        return trusted_response(models.trusted_movie_adapter, movie)
+    if projected is not None:
+        return Response(
+            models.projected_movie(projected)(**movie).model_dump_json(),
+            media_type="application/json",
+        )
+    return models.V2SearchResultsItem(**movie)
+
+
+@router.get("/movie/{id}/similar", name="Similar movies")
+@utils.router_exception_handler
+async def get_similar_movies(
+    id: int = Path(description="Movie id", ge=1),
+    limit: t.Optional[int] = Query(
+        10,
+        description="Total movies not to exceed",
+        gt=0,
+        le=config.similar_movies_per_movie,
+    ),
+) -> models.SimilarMovies:
+    """Get movies similar to a particular movie from the local catalog"""
+    await similarity_index.ensure_built()
+    similar_ids = similarity_index.similar(id, limit)
+    if similar_ids is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"There's no movie with id '{id}.'",
+        )
+    movies = {
+        movie.id: movie
+        for movie in reader_session.query(Movie).filter(Movie.id.in_(similar_ids))
+    }
+    movies = covers.proxied(
+        [movies[id].model_dump() for id in similar_ids if id in movies]
+    )
+    if catalog_validation.trusts(movies):
+        return trusted_response(
+            models.trusted_similar_movies_adapter, dict(id=id, movies=movies)
+        )
+    return models.SimilarMovies(id=id, movies=movies)
+
+
+@router.get(
+    "/cover/{id}",
+    name="Movie cover photo",
+    response_class=Response,
+    responses={200: {"content": {"image/jpeg": {}}}},
+)
+@utils.router_exception_handler
+async def get_movie_cover(
+    request: Request,
+    id: int = Path(description="Movie id", ge=1),
+    size: t.Literal["small", "medium", "original"] = Query(
+        "medium", description="Cover variant - small and medium are thumbnails"
+    ),
+):
+    """Get cover photo of a movie from the covers cache"""
+    movie = reader_session.get(Movie, id)
     if not movie:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"There's no movie with id '{id}.'",
         )
-    return models.V2SearchResultsItem(**movie.model_dump())
+    if covers.sizes[size] is not None and not covers.resizing_available():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Resizing covers is not supported by this server.",
+        )
+    try:
+        content = await covers.cover(id, movie.cover_photo, size)
+    except (covers.InvalidCover, OSError) as e:
+        logger.warning(f"Failed to load cover of movie {id} - {e}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to fetch cover photo from upstream.",
+        )
+    headers = {
+        "ETag": covers.etag(content),
+        "Cache-Control": f"public, max-age={config.cover_max_age_in_seconds}",
+    }
+    if utils.etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content, media_type=covers.media_type(content), headers=headers)
 
 
 @router.get("/metadata/{id}")
 @utils.router_exception_handler
 async def get_movie_metadata_2(
-    id: int = Path(description="Movie id", ge=1, le=total_movies)
+    request: Request,
+    id: int = Path(description="Movie id", ge=1),
 ) -> v1_models.MovieFiles:
     """Get metadata for a particular movie"""
-    movie = session.get(Movie, id)
+    movie = reader_session.get(Movie, id)
     if not movie:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"There's no movie with id '{id}.'",
         )
-    nav = Navigate(
-        fz_models.MovieInSearch(
-            url=movie.url,
-            title="",
-            year=1,
-            distribution="",
-            about="",
-            cover_photo="https://somelink-here",
-        )
-    )
-    return nav.results
+    popularity.hit(id, "metadata_views")
+    budget = UpstreamBudget("metadata", config.metadata_deadline_in_seconds, request)
+    files = await budget.run(navigate, movie.url)
+    prefetcher.submit(id, files)
+    return files
 
 
 @router.get("/download-link/{id}", name="Download link metadata")
 @utils.router_exception_handler
 async def download_link_by_id(
-    id: int = Path(description="Movie id", ge=1, le=total_movies),
+    request: Request,
+    id: int = Path(description="Movie id", ge=1),
     quality: t.Literal["normal", "best"] = Query(
         "best", description="Movie file quality"
     ),
 ) -> v1_models.DownloadLink:
     """Get link to the desired movie-file"""
-    movie = session.get(Movie, id)
+    movie = reader_session.get(Movie, id)
     if not movie:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"There's no movie with id '{id}.'",
         )
 
+    popularity.hit(id, "download_link_views")
+    prefetcher.record_request(id, quality)
+    metrics.increment("download_link.requests")
+    queued = link_writer.get(id, quality)
+    if queued:
+        metrics.increment("download_link.cache_hits")
+        filename, url = queued
+        return v1_models.DownloadLink(filename=filename, url=url)
     download_link_model: BestDownloadLink = quality_model_map[quality]
-    cached_results: BestDownloadLink = session.get(download_link_model, id)
-    if cached_results and (
-        utils.utcnow().replace(tzinfo=None) - cached_results.updated_on
-    ) < timedelta(hours=config.download_link_cache_duration_in_hours):
-        return v1_models.DownloadLink(**cached_results.model_dump())
-
-    nav = Navigate(
-        fz_models.MovieInSearch(
-            url=movie.url,
-            title="",
-            year=1,
-            distribution="",
-            about="",
-            cover_photo="https://somelink-here",
-        )
+    # Short-lived session so that links saved in the background are seen
+    with ReaderSession() as link_session:
+        cached_results = link_session.get(download_link_model, id)
+        if is_fresh(cached_results):
+            metrics.increment("download_link.cache_hits")
+            return v1_models.DownloadLink(**cached_results.model_dump())
+
+    failure_key = make_key("v2:download-link:failure", dataset.version, id, quality)
+    utils.raise_cached_failure(failure_key)
+    budget = UpstreamBudget(
+        "download_link", config.download_link_deadline_in_seconds, request
     )
-    target_file = nav.results.files[0 if quality == "normal" else 1]
-    download_movie = DownloadLinks(
-        fz_models.FileMetadata(
-            title="some-movie-title",
-            url=target_file.url,
-            size="",
-            hits=0,
-            mediainfo="https://yet-another-link",
-        )
-    ).results
-    filename = download_movie.filename
-    target_link = download_movie.links[0]
-    movie_file = Download(target_link).last_url
-    if cached_results:
-        # Update the url and filename
-        cached_results.url = movie_file
-        cached_results.filename = filename
-    else:
-        # Insert new entry
-        session.add(download_link_model(id=id, filename=filename, url=movie_file))
-    session.commit()
+    files = await budget.run(navigate, movie.url, pending=3)
+    try:
+        filename, target_link = await budget.run(
+            download_links, quality_file(files, quality).url, pending=2
+        )
+    except MissingFile as e:
+        raise utils.cache_failure(failure_key, status.HTTP_404_NOT_FOUND, str(e))
+    except MissingDownloadLink as e:
+        raise utils.cache_failure(failure_key, status.HTTP_502_BAD_GATEWAY, str(e))
+    movie_file = await budget.run(final_url, target_link)
+    link_writer.put(id, quality, filename, movie_file)
     return v1_models.DownloadLink(filename=filename, url=movie_file)
@@ -0,0 +1,345 @@
+"""Warms the download links cache in bulk
+
+Both qualities of the selected movies are resolved by a bounded pool of
+workers whose upstream requests are spaced out to respect rate limits,
+while resolved links are saved in batched transactions.
+
+Usage:
+    python -m backend.warmer --top 200 --by popularity
+    python -m backend.warmer --ids 5 51 92
+"""
+
+import argparse
+import sys
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from sqlalchemy.orm import Session as DBSession
+from backend.config import config, logger
+from backend.database import Session, Movie
+from backend.metrics import metrics
+from backend.utils import utcnow
+from backend.v2.popularity import by_popularity
+from backend.downloads import (
+    quality_model_map,
+    quality_file,
+    navigate,
+    download_links,
+    final_url,
+    save_download_links,
+    MissingFile,
+)
+
+qualities: tuple[t.Literal["normal", "best"], ...] = ("normal", "best")
+
+
+class RateLimiter:
+    """Spaces out calls from any thread to at most `rate` per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        time.sleep(at - now)
+
+
+class WarmProgress:
+    """Progress of warming the cache"""
+
+    def __init__(self, movies: int = 0):
+        self.movies = movies
+        self.done = 0
+        self.links = 0
+        self.saved = 0
+        self.fresh = 0
+        self.missing = 0
+        self.failed = 0
+        self.running = True
+        self.started_on = utcnow()
+        self._start = time.monotonic()
+        self.elapsed = 0.0
+
+    def tick(self):
+        self.elapsed = time.monotonic() - self._start
+
+    def model_dump(self) -> dict[str, t.Any]:
+        self.tick()
+        return dict(
+            running=self.running,
+            movies=self.movies,
+            done=self.done,
+            links=self.links,
+            saved=self.saved,
+            fresh=self.fresh,
+            missing=self.missing,
+            failed=self.failed,
+            started_on=self.started_on,
+            elapsed=round(self.elapsed, 3),
+            movies_per_second=round(self.done / self.elapsed, 3) if self.elapsed else 0,
+            links_per_second=(
+                round(self.links / self.elapsed, 3) if self.elapsed else 0
+            ),
+        )
+
+    def __str__(self):
+        state = self.model_dump()
+        return (
+            f"{state['done']}/{state['movies']} movies, {state['links']} links"
+            f" resolved, {state['saved']} saved, {state['fresh']} fresh,"
+            f" {state['missing']} missing, {state['failed']} failed"
+            f" - {state['movies_per_second']} movies/s"
+        )
+
+
+def select_movies(
+    session: DBSession,
+    ids: t.Sequence[int] | None = None,
+    top: int | None = None,
+    by: t.Literal["year", "popularity"] = "year",
+) -> list[tuple[int, str]]:
+    """Ids and page urls of movies to warm
+
+    Args:
+        session (DBSession): Db session.
+        ids (t.Sequence[int] | None, optional): Particular movies. Defaults to None.
+        top (int | None, optional): Number of movies ranked `by`. Defaults to None.
+        by (t.Literal["year", "popularity"], optional): Ranking of top movies. Defaults to "year".
+
+    Returns:
+        list[tuple[int, str]]: Movie ids and urls.
+    """
+    if ids:
+        urls: dict[int, str] = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            urls.update(
+                session.query(Movie.id, Movie.url).filter(Movie.id.in_(chunk)).all()
+            )
+        return [(id, urls[id]) for id in dict.fromkeys(ids) if id in urls]
+    query = session.query(Movie.id, Movie.url)
+    if by == "popularity":
+        query = by_popularity(query)
+    return [
+        tuple(row)
+        for row in query.order_by(Movie.year.desc(), Movie.id.desc()).limit(top)
+    ]
+
+
+def fresh_links(session: DBSession, ids: t.Sequence[int]) -> set[tuple[int, str]]:
+    """Movie ids and qualities whose cached links have not expired"""
+    cutoff = utcnow().replace(tzinfo=None) - timedelta(
+        hours=config.download_link_cache_duration_in_hours
+    )
+    fresh = set()
+    for quality, model in quality_model_map.items():
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            fresh.update(
+                (id, quality)
+                for (id,) in session.query(model.id).filter(
+                    model.id.in_(chunk), model.updated_on >= cutoff
+                )
+            )
+    return fresh
+
+
+class Warmer:
+    """Resolves and caches download links of many movies
+
+    Args:
+        workers (int | None, optional): Movies resolved concurrently. Defaults to `warm_workers`.
+        rate (float | None, optional): Upstream requests per second. Defaults to `warm_requests_per_second`.
+        batch_size (int | None, optional): Links saved per transaction. Defaults to `warm_batch_size`.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        rate: float | None = None,
+        batch_size: int | None = None,
+    ):
+        self.workers = workers or config.warm_workers
+        self.limiter = RateLimiter(rate or config.warm_requests_per_second)
+        self.batch_size = batch_size or config.warm_batch_size
+        self.progress = WarmProgress()
+        self.cancelled = False
+
+    def _call(self, func: t.Callable, *args) -> t.Any:
+        self.limiter.wait()
+        metrics.increment("warm.upstream_requests")
+        return func(*args)
+
+    def _resolve(
+        self, id: int, url: str, wanted: list[t.Literal["normal", "best"]]
+    ) -> tuple[list[tuple[int, str, str, str]], int]:
+        if self.cancelled:
+            return [], 0
+        files = self._call(navigate, url)
+        links, missing = [], 0
+        for quality in wanted:
+            try:
+                target_file = quality_file(files, quality)
+            except MissingFile:
+                missing += 1
+                continue
+            filename, link = self._call(download_links, target_file.url)
+            links.append((id, quality, filename, self._call(final_url, link)))
+        return links, missing
+
+    def _collect(self, executor, movies, fresh, batch, flush, report):
+        progress = self.progress
+        futures = {}
+        for id, url in movies:
+            wanted = [q for q in qualities if (id, q) not in fresh]
+            if wanted:
+                futures[executor.submit(self._resolve, id, url, wanted)] = id
+            else:
+                progress.done += 1
+        for future in as_completed(futures):
+            try:
+                links, missing = future.result()
+                batch.extend(links)
+                progress.links += len(links)
+                progress.missing += missing
+            except Exception as e:
+                progress.failed += 1
+                logger.warning(f"Failed to warm links of movie {futures[future]} - {e}")
+            progress.done += 1
+            if len(batch) >= self.batch_size:
+                flush()
+            if report:
+                report(progress)
+
+    def run(
+        self,
+        movies: list[tuple[int, str]],
+        report: t.Callable[[WarmProgress], None] | None = None,
+    ) -> WarmProgress:
+        """Resolve and cache links of movies not cached yet
+
+        Args:
+            movies (list[tuple[int, str]]): Movie ids and urls.
+            report (t.Callable[[WarmProgress], None] | None, optional): Called as movies complete. Defaults to None.
+
+        Returns:
+            WarmProgress: Final progress.
+        """
+        progress = self.progress
+        progress.movies = len(movies)
+        batch: list[tuple[int, str, str, str]] = []
+        with Session() as db_session:
+
+            def flush():
+                if batch:
+                    progress.saved += save_download_links(db_session, batch)
+                    metrics.increment("warm.saved", len(batch))
+                    batch.clear()
+
+            try:
+                fresh = fresh_links(db_session, [id for id, _ in movies])
+                progress.fresh = len(fresh)
+                with ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="warmer"
+                ) as executor:
+                    try:
+                        self._collect(executor, movies, fresh, batch, flush, report)
+                    except BaseException:
+                        # Queued movies are skipped while the pool winds down
+                        self.cancelled = True
+                        raise
+            finally:
+                flush()
+                progress.running = False
+                progress.tick()
+        return progress
+
+
+class WarmingInProgress(RuntimeError):
+    """Cache warming was started while another is still running"""
+
+
+warm_job: Warmer | None = None
+"""Latest cache warming started through the admin API"""
+
+
+def _warm(
+    job: Warmer,
+    ids: t.Sequence[int] | None,
+    top: int | None,
+    by: t.Literal["year", "popularity"],
+):
+    try:
+        with Session() as db_session:
+            movies = select_movies(db_session, ids, top, by)
+    except Exception as e:
+        job.progress.running = False
+        logger.exception(e)
+        return
+    job.run(movies)
+
+
+def start_warm_job(
+    ids: t.Sequence[int] | None = None,
+    top: int | None = None,
+    by: t.Literal["year", "popularity"] = "year",
+) -> Warmer:
+    """Warm the cache from a background thread unless already warming
+
+    Movies are selected in that thread as well, keeping the caller free.
+
+    Raises:
+        WarmingInProgress: Latest cache warming is still running.
+    """
+    global warm_job
+    if warm_job is not None and warm_job.progress.running:
+        raise WarmingInProgress("Cache warming is already in progress")
+    warm_job = Warmer()
+    threading.Thread(
+        target=_warm, args=(warm_job, ids, top, by), name="warm-job", daemon=True
+    ).start()
+    return warm_job
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm the download links cache")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--ids", type=int, nargs="+", help="Particular movie ids")
+    target.add_argument("--top", type=int, help="Number of top movies to warm")
+    parser.add_argument(
+        "--by",
+        choices=["year", "popularity"],
+        default="year",
+        help="Ranking of top movies",
+    )
+    parser.add_argument("--workers", type=int, help="Movies resolved concurrently")
+    parser.add_argument("--rate", type=float, help="Upstream requests per second")
+    parser.add_argument("--batch-size", type=int, help="Links saved per transaction")
+    args = parser.parse_args()
+
+    warmer = Warmer(args.workers, args.rate, args.batch_size)
+    with Session() as db_session:
+        movies = select_movies(db_session, args.ids, args.top, args.by)
+    last_report = [0.0]
+
+    def report(progress: WarmProgress):
+        if time.monotonic() - last_report[0] >= 1:
+            last_report[0] = time.monotonic()
+            print(progress, file=sys.stderr)
+
+    try:
+        warmer.run(movies, report)
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr)
+    print(warmer.progress, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
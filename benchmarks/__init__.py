@@ -0,0 +1,4 @@
+"""Performance benchmarks
+
+Run any of them as a module e.g `python -m benchmarks.sqlite_concurrency`
+"""
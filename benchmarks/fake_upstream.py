@@ -0,0 +1,221 @@
+"""Local fake of the fzmovies site serving recorded pages
+
+Run the app with `upstream_base_url` pointing here (see `backend.upstream`)
+so that upstream requests are answered from recordings, with configurable
+latency and error injection, instead of the real site.
+
+Recordings are made once by running in `--record` mode, where requests are
+forwarded to the real site and responses saved under `--recordings`. Pages of
+search results, movies and download links are recorded as the app fetches
+them, so drive the scenarios to record, for example with `make load-test`.
+
+Usage:
+    python -m benchmarks.fake_upstream --record
+    python -m benchmarks.fake_upstream --latency-ms 200 --jitter-ms 50 --error-rate 0.02
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+recordings_path = Path(__file__).parent / "recordings"
+
+recorded_headers = ("content-type", "location", "set-cookie")
+"""Response headers kept in recordings"""
+
+max_recorded_bytes = 1024 * 1024
+"""Bodies such as movie files are truncated to this"""
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Lets redirects be recorded and followed by the client instead"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+opener = urllib.request.build_opener(NoRedirect)
+
+
+def recording_key(method: str, host: str, path: str, body: bytes) -> str:
+    """Name of the recording of a request"""
+    digest = hashlib.sha1(f"{method} {host}{path}".encode() + b"\n" + body)
+    return digest.hexdigest()
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    """Server replaying recorded upstream responses
+
+    Args:
+        address (tuple[str, int]): Host and port to listen on.
+        recordings (Path): Directory of recordings.
+        latency_ms (float, optional): Delay added to every response. Defaults to 0.
+        jitter_ms (float, optional): Random delay added on top. Defaults to 0.
+        error_rate (float, optional): Fraction of requests failed with 503. Defaults to 0.
+        record (bool, optional): Forward requests to the real site and record responses. Defaults to False.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        recordings: Path = recordings_path,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0,
+        record: bool = False,
+    ):
+        super().__init__(address, Handler)
+        self.recordings = Path(recordings)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.record = record
+        self.served = 0
+        self.missing = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def load(self, key: str) -> dict | None:
+        path = self.recordings / f"{key}.json"
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def save(self, key: str, method: str, url: str, recording: dict):
+        self.recordings.mkdir(parents=True, exist_ok=True)
+        (self.recordings / f"{key}.json").write_text(
+            json.dumps(dict(method=method, url=url, **recording), indent=1)
+        )
+
+    def fetch(self, method: str, url: str, headers: dict, body: bytes) -> dict:
+        """Response of the real site as a recording"""
+        request = urllib.request.Request(
+            url, data=body or None, headers=headers, method=method
+        )
+        try:
+            response = opener.open(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            # Redirects and error pages are recorded as they are
+            response = e
+        with response:
+            content = response.read(max_recorded_bytes)
+            return dict(
+                status=response.status,
+                headers=[
+                    (name, value)
+                    for name, value in response.headers.items()
+                    if name.lower() in recorded_headers
+                ],
+                body=base64.b64encode(content).decode(),
+            )
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: FakeUpstream
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status: int, headers: list[tuple[str, str]], body: bytes):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            # Bytes after a HEAD response would be read as the next response
+            self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        scheme = self.headers.get("X-Upstream-Scheme", "https")
+        host = self.headers.get("X-Upstream-Host", "fzmovies.net")
+        key = recording_key(self.command, host, self.path, body)
+        delay = server.latency_ms + random.uniform(0, server.jitter_ms)
+        time.sleep(delay / 1000)
+        if random.random() < server.error_rate:
+            return self._respond(503, [("Content-Type", "text/plain")], b"Injected")
+        recording = server.load(key)
+        if recording is None and server.record:
+            headers = {
+                name: value
+                for name, value in self.headers.items()
+                if name.lower()
+                not in ("host", "content-length", "connection", "accept-encoding")
+                and not name.lower().startswith("x-upstream-")
+            }
+            url = f"{scheme}://{host}{self.path}"
+            recording = server.fetch(self.command, url, headers, body)
+            server.save(key, self.command, url, recording)
+        with server._lock:
+            if recording is None:
+                server.missing += 1
+            else:
+                server.served += 1
+        if recording is None:
+            return self._respond(
+                404,
+                [("Content-Type", "text/plain")],
+                f"No recording of {self.command} {host}{self.path}".encode(),
+            )
+        self._respond(
+            recording["status"],
+            recording["headers"],
+            base64.b64decode(recording["body"]),
+        )
+
+    do_GET = do_POST = do_HEAD = _handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument(
+        "--recordings", type=Path, default=recordings_path, help="Recordings directory"
+    )
+    parser.add_argument("--latency-ms", type=float, default=0, help="Response delay")
+    parser.add_argument(
+        "--jitter-ms", type=float, default=0, help="Random delay added to latency"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="Fraction of requests failing"
+    )
+    parser.add_argument(
+        "--record", action="store_true", help="Record responses of the real site"
+    )
+    args = parser.parse_args()
+
+    server = FakeUpstream(
+        (args.host, args.port),
+        args.recordings,
+        args.latency_ms,
+        args.jitter_ms,
+        args.error_rate,
+        args.record,
+    )
+    print(f"Fake upstream listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Load test of the app against the fake upstream
+
+Starts `benchmarks.fake_upstream` and the app under uvicorn on a throwaway
+copy of the database, with response caching disabled and upstream requests
+redirected to the fake (see `upstream_base_url`). Each scenario is then driven
+at a fixed concurrency and its throughput and latency percentiles reported.
+
+Results are compared with the baseline saved by `--save-baseline`, failing
+when throughput drops or p95 latency rises beyond `--tolerance`. Baselines
+depend on the machine, so save one on the machine comparisons run on. Runs
+also fail when errors exceed those injected, or the baseline's, by more than
+`--max-error-rate`.
+
+Scenarios reaching upstream (`v1_*` and `v2_download_link`) are skipped until
+recordings exist, made once with `--record`.
+
+Usage:
+    python -m benchmarks.load_test --concurrency 16 --duration 10
+    python -m benchmarks.load_test --save-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+import httpx
+from sqlalchemy.engine import make_url
+from backend.config import config
+from benchmarks.fake_upstream import recordings_path
+
+project_path = Path(__file__).parent.parent
+
+baseline_path = Path(__file__).parent / "baselines" / "load_test.json"
+
+SEARCH_TERMS = ["love", "war", "the", "man", "night", "house", "girl", "dead"]
+MOVIE_PAGE_URL = "https://fzmovies.net/movie-Fast%20and%20Furious%207--hmp4.htm"
+DOWNLOAD_MOVIE_IDS = range(1, 21)
+
+Scenario = t.Callable[[httpx.AsyncClient], t.Awaitable[httpx.Response]]
+
+
+async def v2_search(client: httpx.AsyncClient) -> httpx.Response:
+    return await client.get(
+        "/api/v2/search", params=dict(q=random.choice(SEARCH_TERMS), limit=20)
+    )
+
+
+async def v2_movie(client: httpx.AsyncClient) -> httpx.Response:
+    return await client.get(f"/api/v2/movie/{random.randint(1, 1000)}")
+
+
+async def v2_suggest(client: httpx.AsyncClient) -> httpx.Response:
+    return await client.get(
+        "/api/v2/suggest", params=dict(q=random.choice(SEARCH_TERMS)[:3])
+    )
+
+
+async def v2_download_link(client: httpx.AsyncClient) -> httpx.Response:
+    return await client.get(
+        f"/api/v2/download-link/{random.choice(DOWNLOAD_MOVIE_IDS)}",
+        params=dict(quality=random.choice(["normal", "best"])),
+    )
+
+
+async def v1_search(client: httpx.AsyncClient) -> httpx.Response:
+    return await client.post(
+        "/api/v1/search", json=dict(q=random.choice(SEARCH_TERMS[:3]))
+    )
+
+
+async def v1_metadata(client: httpx.AsyncClient) -> httpx.Response:
+    return await client.post(
+        "/api/v1/metadata", json=dict(movie_page_url=MOVIE_PAGE_URL)
+    )
+
+
+scenarios: dict[str, Scenario] = {
+    "v2_search": v2_search,
+    "v2_movie": v2_movie,
+    "v2_suggest": v2_suggest,
+    "v2_download_link": v2_download_link,
+    "v1_search": v1_search,
+    "v1_metadata": v1_metadata,
+}
+
+upstream_scenarios = ("v2_download_link", "v1_search", "v1_metadata")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{process.args} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    sys.exit(f"{url} not up after {timeout}s")
+
+
+def percentile(latencies: list[float], fraction: float) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[
+        round(fraction * 100) - 1
+    ]
+
+
+async def drive(
+    base_url: str, scenario: Scenario, concurrency: int, duration: float
+) -> dict[str, float]:
+    """Run a scenario from `concurrency` clients for `duration` seconds"""
+    latencies: list[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                resp = await scenario(client)
+                failed = resp.status_code >= 500
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=120
+    ) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0.0, 0.0]
+    return dict(
+        requests=len(latencies),
+        rps=round(len(latencies) / elapsed, 1),
+        error_rate=round(errors / len(latencies), 4),
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 1),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 1),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 1),
+    )
+
+
+def regressions(
+    results: dict[str, dict],
+    baseline: dict[str, dict],
+    tolerance: float,
+    max_error_rate: float = 0,
+    injected_error_rate: float = 0,
+) -> list[str]:
+    """Scenarios slower than the baseline beyond tolerance or failing more
+
+    Error rates above those injected, or above the baseline's, by more than
+    `max_error_rate` are regressions even for scenarios without a baseline.
+    """
+    found = []
+    for name, result in results.items():
+        previous = baseline.get(name, {})
+        allowed = max(injected_error_rate, previous.get("error_rate", 0))
+        if result["error_rate"] > allowed + max_error_rate:
+            found.append(
+                f"{name}: errors {result['error_rate']:.2%},"
+                f" allowed {allowed + max_error_rate:.2%}"
+            )
+        if not previous:
+            continue
+        if result["rps"] < previous["rps"] * (1 - tolerance):
+            found.append(f"{name}: {result['rps']} rps, was {previous['rps']}")
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            found.append(
+                f"{name}: p95 {result['p95_ms']}ms, was {previous['p95_ms']}ms"
+            )
+    return found
+
+
+def start_servers(workdir: Path, args) -> list[subprocess.Popen]:
+    """Fake upstream and app processes serving from `workdir`"""
+    upstream_port, app_port = free_port(), free_port()
+    db_path = make_url(config.database_engine).database
+    shutil.copy(project_path / db_path, workdir / "db.sqlite3")
+    (workdir / ".env").write_text(
+        "\n".join(
+            [
+                f"database_engine=sqlite:///{workdir / 'db.sqlite3'}",
+                "cache_backend=none://",
+                f"upstream_base_url=http://127.0.0.1:{upstream_port}",
+                f"cover_cache_directory={workdir / 'covers'}",
+                "prefetch_download_links=false",
+            ]
+        )
+    )
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(
+            filter(None, [str(project_path), os.environ.get("PYTHONPATH")])
+        ),
+    )
+    upstream = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.fake_upstream",
+            "--port",
+            str(upstream_port),
+            "--recordings",
+            str(args.recordings),
+            "--latency-ms",
+            str(args.latency_ms),
+            "--jitter-ms",
+            str(args.jitter_ms),
+            "--error-rate",
+            str(args.error_rate),
+            *(["--record"] if args.record else []),
+        ],
+        cwd=project_path,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    app = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "backend:app",
+            "--port",
+            str(app_port),
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=workdir,
+        env=env,
+    )
+    wait_until_up(f"http://127.0.0.1:{upstream_port}/", upstream)
+    wait_until_up(f"http://127.0.0.1:{app_port}/api/docs", app)
+    args.base_url = f"http://127.0.0.1:{app_port}"
+    return [app, upstream]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--duration", type=float, default=10, help="Seconds per scenario"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="App worker processes")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(scenarios),
+        help="Comma-separated scenarios to run",
+    )
+    parser.add_argument("--recordings", type=Path, default=recordings_path)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Record upstream responses as they are made",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Allowed slowdown from baseline"
+    )
+    parser.add_argument(
+        "--max-error-rate",
+        type=float,
+        default=0.01,
+        help="Allowed error rate on top of injected errors or the baseline's",
+    )
+    parser.add_argument("--baseline", type=Path, default=baseline_path)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Save results as the baseline"
+    )
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(names) - set(scenarios)
+    if unknown:
+        parser.error(f"Unknown scenarios {sorted(unknown)}")
+    if not args.record and not any(Path(args.recordings).glob("*.json")):
+        skipped = [name for name in names if name in upstream_scenarios]
+        if skipped:
+            print(f"No upstream recordings, skipping {', '.join(skipped)}")
+        names = [name for name in names if name not in upstream_scenarios]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        processes = start_servers(Path(tmp), args)
+        try:
+            for name in names:
+                results[name] = asyncio.run(
+                    drive(
+                        args.base_url, scenarios[name], args.concurrency, args.duration
+                    )
+                )
+                print(
+                    f"{name:<16} {results[name]['rps']:>8} rps  "
+                    f"p50 {results[name]['p50_ms']:>8}ms  "
+                    f"p95 {results[name]['p95_ms']:>8}ms  "
+                    f"p99 {results[name]['p99_ms']:>8}ms  "
+                    f"errors {results[name]['error_rate']:.2%}"
+                )
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait(timeout=30)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+    else:
+        print("No baseline to compare with, save one with --save-baseline")
+    found = regressions(
+        results, baseline, args.tolerance, args.max_error_rate, args.error_rate
+    )
+    for regression in found:
+        print(f"Regression - {regression}")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
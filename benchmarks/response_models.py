@@ -0,0 +1,83 @@
+"""Benchmarks per-row cost of serializing v2 search results pages
+
+Compares building `V2SearchResults` and validating and serializing it again
+against its type, as FastAPI does for untrusted rows, with dumping rows
+validated at ingest straight to JSON through a precompiled `TypeAdapter`.
+Whole search requests are then timed through the app with and without
+`trust_validated_catalog`.
+
+Usage:
+    python -m benchmarks.response_models --rows 100
+"""
+
+import argparse
+import timeit
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from backend import app
+from backend.config import config
+from backend.database import ReaderSession, Movie
+from backend.v2 import models
+from backend.v2.indexes import catalog_validation, refresh
+
+search_results_adapter = TypeAdapter(models.V2SearchResults)
+"""Return type of the search route, validated and serialized as by FastAPI"""
+
+
+def validated(movies: list[dict]) -> bytes:
+    content = models.V2SearchResults(query="benchmark", movies=movies)
+    # What FastAPI does with a returned model given the route's return type
+    value = search_results_adapter.validate_python(content.model_dump())
+    return search_results_adapter.dump_json(value)
+
+
+def trusted(movies: list[dict]) -> bytes:
+    return models.trusted_search_results_adapter.dump_json(
+        dict(query="benchmark", movies=movies)
+    )
+
+
+def best_of(run, number: int) -> float:
+    return min(timeit.repeat(run, number=number, repeat=5)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100, help="Movies per page")
+    parser.add_argument("--number", type=int, default=200, help="Pages per run")
+    args = parser.parse_args()
+
+    with ReaderSession() as session:
+        movies = [
+            movie.model_dump()
+            for movie in session.query(Movie).order_by(Movie.id).limit(args.rows)
+        ]
+    assert len(validated(movies)) and len(trusted(movies))
+
+    print(f"{len(movies)} rows per page, best of 5 runs of {args.number} pages")
+    for name, run in (
+        ("validated", lambda: validated(movies)),
+        ("trusted", lambda: trusted(movies)),
+    ):
+        best = best_of(run, args.number)
+        print(
+            f"{name:>10}: {best * 1e3:8.3f} ms/page {best / len(movies) * 1e6:8.2f} µs/row"
+        )
+
+    client = TestClient(app)
+    refresh(catalog_validation)
+    search = dict(query="the", limit=args.rows)
+    print(f"Search requests of {args.rows} movies through the app")
+    for trust in (False, True):
+        config.trust_validated_catalog = trust
+        client.post("/api/v2/search", json=search).raise_for_status()
+        best = best_of(
+            lambda: client.post("/api/v2/search", json=search), args.number // 10 or 1
+        )
+        print(
+            f"{'trusted' if trust else 'validated':>10}: {best * 1e3:8.3f} ms/request"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmarks size and latency of v2 search responses by projection
+
+Compares whole movies against responses limited to the `fields` a list view
+needs and against descriptions cut short with `description_max_chars`,
+through the app itself so that SQL, serialization and transport are counted.
+
+Usage:
+    python -m benchmarks.response_size --limit 100
+"""
+
+import argparse
+import gzip
+import timeit
+from fastapi.testclient import TestClient
+from backend import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--query", default="the", help="Movie title searched")
+    parser.add_argument("--limit", type=int, default=100, help="Movies per page")
+    parser.add_argument("--number", type=int, default=50, help="Requests per run")
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    search = dict(query=args.query, limit=args.limit)
+    cases = {
+        "whole": search,
+        "description_max_chars=120": dict(search, description_max_chars=120),
+        "fields=title,year,cover_photo": dict(
+            search, fields=["title", "year", "cover_photo"]
+        ),
+        "fields=title,genres,category": dict(
+            search, fields=["title", "genres", "category"]
+        ),
+    }
+
+    print(f"{args.limit} movies per page, best of 5 runs of {args.number} requests")
+    baseline = None
+    for name, body in cases.items():
+        resp = client.post("/api/v2/search", json=body)
+        resp.raise_for_status()
+        size, gzipped = len(resp.content), len(gzip.compress(resp.content))
+        best = (
+            min(
+                timeit.repeat(
+                    lambda: client.post("/api/v2/search", json=body),
+                    number=args.number,
+                    repeat=5,
+                )
+            )
+            / args.number
+        )
+        baseline = baseline or (size, best)
+        print(
+            f"{name:>30}: {size:>8} bytes ({size / baseline[0]:6.1%})"
+            f" {gzipped:>7} gzipped {best * 1e3:8.3f} ms ({best / baseline[1]:6.1%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
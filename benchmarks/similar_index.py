@@ -0,0 +1,125 @@
+"""Benchmarks building the similar movies index on a synthetic catalog
+
+Reports build time, peak memory allocated while building and the memory
+held by the finished index.
+
+Usage:
+    python -m benchmarks.similar_index --movies 1000000
+"""
+
+import argparse
+import itertools
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from backend.database import Base
+from backend.v2.indexes import SimilarityIndex
+
+GENRES = 22
+VOCABULARY = 50_000
+WORDS_PER_DESCRIPTION = 30
+
+
+def populate(engine, movies: int, seed: int = 0):
+    rng = random.Random(seed)
+    vocabulary = [f"word{index}" for index in range(VOCABULARY)]
+    # Zipf-like distribution so a few terms are very common
+    cum_weights = list(
+        itertools.accumulate(1 / (rank + 1) for rank in range(VOCABULARY))
+    )
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO genre (id, name) VALUES (:id, :name)"),
+            [dict(id=id, name=f"genre{id}") for id in range(1, GENRES + 1)],
+        )
+        for start in range(1, movies + 1, 10_000):
+            batch = range(start, min(start + 10_000, movies + 1))
+            conn.execute(
+                text(
+                    "INSERT INTO movie (id, title, year, distribution, description,"
+                    " url, cover_photo, category_id)"
+                    " VALUES (:id, :title, :year, 'BluRay', :description, :url,"
+                    " :url, 2)"
+                ),
+                [
+                    dict(
+                        id=id,
+                        title=f"Movie {id}",
+                        year=rng.randint(1950, 2024),
+                        description=" ".join(
+                            rng.choices(
+                                vocabulary,
+                                cum_weights=cum_weights,
+                                k=WORDS_PER_DESCRIPTION,
+                            )
+                        ),
+                        url=f"https://fzmovies.net/movie-{id}--hmp4.htm",
+                    )
+                    for id in batch
+                ],
+            )
+            conn.execute(
+                text(
+                    "INSERT INTO movie_genre (movie_id, genre_id)"
+                    " VALUES (:movie_id, :genre_id)"
+                ),
+                [
+                    dict(movie_id=id, genre_id=genre_id)
+                    for id in batch
+                    for genre_id in rng.sample(range(1, GENRES + 1), rng.randint(1, 3))
+                ],
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--movies", type=int, default=100_000, help="Catalog size")
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Measure peak allocations with tracemalloc (slows down the build)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{Path(tmp_dir) / 'catalog.sqlite3'}")
+        start = time.perf_counter()
+        populate(engine, args.movies)
+        print(f"Populated {args.movies} movies in {time.perf_counter() - start:.1f}s")
+
+        index = SimilarityIndex()
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with Session(engine) as session:
+            index.build(session)
+        build_time = time.perf_counter() - start
+        if args.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        ids, neighbors, k = index._data
+        held = sys.getsizeof(ids) + sys.getsizeof(neighbors)
+        start = time.perf_counter()
+        for id in range(1, min(args.movies, 10_000) + 1):
+            index.similar(id, k)
+        lookup = (time.perf_counter() - start) / min(args.movies, 10_000)
+
+    print(f"Build time: {build_time:.1f}s")
+    if args.trace_memory:
+        print(f"Peak memory allocated while building: {peak / 2**20:.1f} MiB")
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Peak process memory: {max_rss / 2**10:.1f} MiB")
+    print(f"Index size: {held / 2**20:.1f} MiB for top-{k} neighbors")
+    print(f"Lookup: {lookup * 1e6:.2f}µs per movie")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Benchmarks catalog reads against concurrent cache writes across processes
+
+Compares the default SQLite settings with the configured profile
+(see `backend.database.sqlite_pragmas`) on a throwaway copy of the database.
+
+Usage:
+    python -m benchmarks.sqlite_concurrency --workers 8 --duration 10
+"""
+
+import argparse
+import multiprocessing as mp
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from sqlalchemy.engine import make_url
+from backend.config import config
+from backend.database import sqlite_pragmas
+
+CATALOG_QUERY = (
+    "SELECT id, title, year FROM movie WHERE title LIKE ? AND year > ? LIMIT 100"
+)
+CACHE_WRITE = (
+    "INSERT OR REPLACE INTO best_download_link (id, filename, url, updated_on) "
+    "VALUES (?, ?, ?, CURRENT_TIMESTAMP)"
+)
+SEARCH_TERMS = ["%love%", "%war%", "%the%", "%man%", "%a%", "%night%"]
+
+
+def connect(db_path: str, profile: bool, read_only: bool) -> sqlite3.Connection:
+    if read_only and profile:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_path)
+    if profile:
+        for pragma in sqlite_pragmas(read_only):
+            conn.execute(pragma)
+    return conn
+
+
+def reader(db_path: str, profile: bool, duration: float, queue: mp.Queue):
+    conn = connect(db_path, profile, read_only=True)
+    latencies, busy = [], 0
+    deadline = time.perf_counter() + duration
+    index = 0
+    while time.perf_counter() < deadline:
+        term = SEARCH_TERMS[index % len(SEARCH_TERMS)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            conn.execute(CATALOG_QUERY, (term, 1990)).fetchall()
+        except sqlite3.OperationalError:
+            busy += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    queue.put(("read", latencies, busy))
+
+
+def writer(db_path: str, profile: bool, duration: float, queue: mp.Queue):
+    conn = connect(db_path, profile, read_only=False)
+    latencies, busy = [], 0
+    deadline = time.perf_counter() + duration
+    id = 0
+    while time.perf_counter() < deadline:
+        id += 1
+        start = time.perf_counter()
+        try:
+            conn.execute(
+                CACHE_WRITE, (id % 1000 + 1, f"movie-{id}.mp4", f"https://x/{id}")
+            )
+            conn.commit()
+        except sqlite3.OperationalError:
+            busy += 1
+            conn.rollback()
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    queue.put(("write", latencies, busy))
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(db_path: str, profile: bool, workers: int, duration: float) -> dict:
+    queue = mp.Queue()
+    processes = [
+        mp.Process(target=reader, args=(db_path, profile, duration, queue))
+        for _ in range(workers)
+    ]
+    processes.append(
+        mp.Process(target=writer, args=(db_path, profile, duration, queue))
+    )
+    for process in processes:
+        process.start()
+    outcomes = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    reads = [value for kind, lats, _ in outcomes if kind == "read" for value in lats]
+    writes = [value for kind, lats, _ in outcomes if kind == "write" for value in lats]
+    return dict(
+        reads_per_sec=len(reads) / duration,
+        read_p50_ms=statistics.median(reads) * 1000 if reads else 0.0,
+        read_p95_ms=percentile(reads, 95) * 1000,
+        read_busy=sum(busy for kind, _, busy in outcomes if kind == "read"),
+        writes_per_sec=len(writes) / duration,
+        write_p95_ms=percentile(writes, 95) * 1000,
+        write_busy=sum(busy for kind, _, busy in outcomes if kind == "write"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8, help="Reader processes")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per run")
+    args = parser.parse_args()
+
+    source = Path(make_url(config.database_engine).database)
+    for profile in (False, True):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = str(Path(tmp_dir) / source.name)
+            shutil.copyfile(source, db_path)
+            if not profile:
+                with sqlite3.connect(db_path) as conn:
+                    conn.execute("PRAGMA journal_mode = DELETE")
+            stats = run(db_path, profile, args.workers, args.duration)
+        name = "configured" if profile else "default"
+        print(
+            f"{name:>10}: "
+            + ", ".join(f"{key}={value:.2f}" for key, value in stats.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
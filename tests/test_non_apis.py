@@ -1,6 +1,416 @@
+import pytest
+import time
 from tests import client
 
 
 def test_index():
     resp = client.get("/")
     assert resp.is_success
+
+
+def test_sqlite_profile():
+    from sqlalchemy import text
+    from backend.database import engine, reader_engine
+    from backend.config import config
+
+    with engine.connect() as conn:
+        journal_mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+    assert journal_mode.upper() == config.sqlite_journal_mode
+    with reader_engine.connect() as conn:
+        assert conn.execute(text("PRAGMA query_only")).scalar() == int(
+            config.sqlite_read_only_readers
+        )
+
+
+def test_disk_cache_shared_between_instances(tmp_path):
+    from backend.cache import DiskCache
+
+    worker_1 = DiskCache(tmp_path / "cache.sqlite3")
+    worker_2 = DiskCache(tmp_path / "cache.sqlite3")
+    worker_1.set("key", {"movies": [1, 2]}, ttl=60)
+    assert worker_2.get("key") == {"movies": [1, 2]}
+    worker_2.set("expired", "value", ttl=-1)
+    assert worker_1.get("expired") is None
+    worker_1.delete("key")
+    assert worker_2.get("key") is None
+
+
+def test_trace_id_propagation():
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    resp = client.get("/api/openapi.json", headers={"X-Trace-Id": trace_id})
+    assert resp.headers["X-Trace-Id"] == trace_id
+    resp = client.get(
+        "/api/openapi.json",
+        headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+    )
+    assert resp.headers["X-Trace-Id"] == trace_id
+
+
+def test_failed_statement_span():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+    from backend.tracing import Span, Trace, current_span, instrument_engine
+
+    engine = instrument_engine(create_engine("sqlite://"))
+    trace = Trace("4bf92f3577b34da6a3ce929d0e0e4736", sampled=True)
+    token = current_span.set(Span(trace, "request", None, {}))
+    try:
+        with engine.connect() as conn, pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing_table"))
+    finally:
+        current_span.reset(token)
+    (statement_span,) = [span for span in trace.spans if span.name == "db.statement"]
+    assert "missing_table" in statement_span.attributes["error"]
+    assert statement_span.end_time is not None
+
+
+def test_slow_queries(monkeypatch):
+    from backend.config import config
+
+    monkeypatch.setattr(config, "admin_token", None)
+    assert client.get("/api/admin/slow-queries").status_code == 403
+    monkeypatch.setattr(config, "admin_token", "secret")
+    assert client.get("/api/admin/slow-queries").status_code == 401
+    for token in ("secre", "secret!"):
+        resp = client.get("/api/admin/slow-queries", headers={"X-Admin-Token": token})
+        assert resp.status_code == 401
+    client.get("/api/v2/search", params=dict(q="love"))
+    resp = client.get(
+        "/api/admin/slow-queries",
+        params=dict(limit=5),
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert resp.is_success
+    assert 0 < len(resp.json()) <= 5
+
+
+def test_prefetch_submit(monkeypatch):
+    import threading
+    import fzmovies_api.models as fz_models
+    from backend.config import config
+    from backend.metrics import metrics
+    from backend.v2 import prefetch
+
+    monkeypatch.setattr(config, "prefetch_download_links", True)
+    monkeypatch.setattr(config, "prefetch_queue_size", 3)
+    monkeypatch.setattr(config, "prefetch_budget_per_minute", 4)
+    released = threading.Event()
+    resolved = []
+
+    def resolve_download_link(files, quality):
+        # Links stay in flight until released
+        released.wait(10)
+        resolved.append(quality)
+        return f"{quality}.mp4", f"https://fzmovies.net/{quality}.mp4"
+
+    class LinkWriter:
+        saved = {(9002, "normal"): ("normal.mp4", "https://fzmovies.net/normal.mp4")}
+
+        def get(self, id, quality):
+            return self.saved.get((id, quality))
+
+        def put(self, id, quality, filename, url):
+            self.saved[(id, quality)] = (filename, url)
+
+    monkeypatch.setattr(prefetch, "resolve_download_link", resolve_download_link)
+    monkeypatch.setattr(prefetch, "link_writer", LinkWriter())
+    files = fz_models.MovieFiles(
+        files=[
+            fz_models.FileMetadata(
+                title=f"{quality}.mp4",
+                url=f"https://fzmovies.net/download1.php?downloadoptionskey={quality}",
+                size="1",
+                hits=1,
+                mediainfo="https://fzmovies.net/mediainfo.php",
+            )
+            for quality in ("normal", "best")
+        ],
+        recommended=[],
+    )
+    before = {
+        name: metrics.get(f"prefetch.{name}")
+        for name in (
+            "scheduled",
+            "skipped_queue_full",
+            "skipped_budget",
+            "already_cached",
+            "hits",
+        )
+    }
+    prefetcher = prefetch.Prefetcher()
+    prefetcher.submit(9001, files)
+    # Links in flight are not scheduled again
+    prefetcher.submit(9001, files)
+    # Only one of these fits the queue, and it's cached already
+    prefetcher.submit(9002, files)
+    released.set()
+    prefetcher.executor.shutdown(wait=True)
+    prefetcher._executor = None
+    # A single link is left in this minute's budget
+    prefetcher.submit(9003, files)
+    prefetcher.executor.shutdown(wait=True)
+    assert sorted(resolved) == ["best", "normal", "normal"]
+    prefetcher.record_request(9001, "best")
+    prefetcher.record_request(9002, "normal")
+    delta = {
+        name: metrics.get(f"prefetch.{name}") - value for name, value in before.items()
+    }
+    assert delta == dict(
+        scheduled=4, skipped_queue_full=1, skipped_budget=1, already_cached=1, hits=1
+    )
+
+
+def test_upstream_deadline():
+    import asyncio
+    import time
+    from backend.deadlines import UpstreamBudget, DeadlineExceeded
+    from backend.metrics import metrics
+
+    async def scrape():
+        budget = UpstreamBudget("test", 0.05)
+        await budget.run(time.sleep, 0.01, pending=3)
+        await budget.run(time.sleep, 0.1, pending=2)
+
+    cancelled = metrics.get("upstream.steps_cancelled.deadline")
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scrape())
+    assert metrics.get("upstream.steps_cancelled.deadline") == cancelled + 2
+
+
+def test_dataset_reload(monkeypatch, tmp_path):
+    import asyncio
+    import json
+    import shutil
+    import sqlite3
+    from backend.config import config
+    from backend.dataset import announce_dataset, follow_dataset
+
+    monkeypatch.setattr(config, "admin_token", "secret")
+    monkeypatch.setattr(config, "dataset_pointer_path", str(tmp_path / "dataset.json"))
+    headers = {"X-Admin-Token": "secret"}
+    served = client.get("/api/admin/dataset", headers=headers).json()
+    shutil.copy("assets/db.sqlite3", tmp_path / "db.sqlite3")
+    with sqlite3.connect(tmp_path / "db.sqlite3") as conn:
+        conn.execute("DELETE FROM movie WHERE id > 1000")
+    try:
+        resp = client.post(
+            "/api/admin/dataset/reload",
+            json=dict(database_engine=f"sqlite:///{tmp_path / 'db.sqlite3'}"),
+            headers=headers,
+        )
+        assert resp.is_success
+        assert resp.json()["version"] != served["version"]
+        assert client.get("/api/v2/movie/1001").status_code == 404
+        assert client.post("/api/v2/facets", json={}).json()["total"] <= 1000
+        announced = json.loads((tmp_path / "dataset.json").read_text())
+        assert announced["database_engine"] == f"sqlite:///{tmp_path / 'db.sqlite3'}"
+        # As another worker reloading the served dataset would
+        announce_dataset(served["database_engine"])
+        assert asyncio.run(follow_dataset())
+        assert client.get("/api/v2/movie/1001").is_success
+        assert not asyncio.run(follow_dataset())
+    finally:
+        client.post(
+            "/api/admin/dataset/reload",
+            json=dict(database_engine=served["database_engine"]),
+            headers=headers,
+        )
+    assert client.get("/api/v2/movie/1001").is_success
+
+
+def test_warmer_selection():
+    from backend.database import Session
+    from backend.warmer import select_movies, RateLimiter
+
+    with Session() as session:
+        assert [id for id, _ in select_movies(session, ids=[9, 5, 9, 10**9])] == [9, 5]
+        top = select_movies(session, top=5)
+        assert len(top) == 5 and all(url for _, url in top)
+    limiter = RateLimiter(100)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.05
+
+
+def test_warm_job_conflict(monkeypatch):
+    import threading
+    from backend import warmer
+    from backend.config import config
+
+    monkeypatch.setattr(config, "admin_token", "secret")
+    monkeypatch.setattr(warmer, "warm_job", None)
+    released = threading.Event()
+    selected = []
+
+    def run(self, movies):
+        selected.extend(movies)
+        released.wait(10)
+        self.progress.running = False
+
+    monkeypatch.setattr(warmer.Warmer, "run", run)
+    headers = {"X-Admin-Token": "secret"}
+    resp = client.post("/api/admin/warm-cache", json=dict(ids=[5]), headers=headers)
+    assert resp.status_code == 202
+    resp = client.post("/api/admin/warm-cache", json=dict(ids=[5]), headers=headers)
+    assert resp.status_code == 409
+    released.set()
+    while warmer.warm_job.progress.running:
+        time.sleep(0.01)
+    assert [id for id, _ in selected] == [5]
+
+
+def test_link_writer_batches():
+    from backend.database import ReaderSession, NormalDownloadLink
+    from backend.v2.link_writer import LinkWriter
+
+    writer = LinkWriter()
+    for id in (21, 22, 23):
+        assert writer.put(id, "normal", f"{id}.mp4", f"https://example.com/{id}.mp4")
+    assert writer.get(22, "normal") == ("22.mp4", "https://example.com/22.mp4")
+    writer.close()
+    assert writer.get(22, "normal") is None
+    with ReaderSession() as session:
+        assert session.get(NormalDownloadLink, 23).filename == "23.mp4"
+
+
+def test_link_writer_failed_batch_not_counted(monkeypatch):
+    import backend.v2.link_writer as link_writer_module
+    from backend.metrics import metrics
+
+    def save_download_links(db_session, links):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(link_writer_module, "save_download_links", save_download_links)
+    saved, failed = metrics.get("link_writer.saved"), metrics.get("link_writer.failed")
+    writer = link_writer_module.LinkWriter()
+    assert writer.put(24, "normal", "24.mp4", "https://example.com/24.mp4")
+    writer.close()
+    assert writer.get(24, "normal") is None
+    assert metrics.get("link_writer.saved") == saved
+    assert metrics.get("link_writer.failed") == failed + 1
+
+
+def test_forced_profile(monkeypatch, tmp_path):
+    from backend.config import config
+
+    monkeypatch.setattr(config, "admin_token", "secret")
+    monkeypatch.setattr(config, "profiling_directory", str(tmp_path))
+    headers = {"X-Admin-Token": "secret"}
+    client.get("/api/v2/movie/5", headers={"X-Profile": "1", "X-Trace-Id": "0" * 32})
+    client.get("/api/v2/movie/5", headers={"X-Profile": "1", "X-Admin-Token": "secre"})
+    assert not list(tmp_path.iterdir())
+    client.get("/api/v2/movie/5", headers={"X-Profile": "1", **headers})
+    resp = client.get("/api/admin/profiles", headers=headers)
+    assert resp.is_success
+    profile = resp.json()[0]
+    assert profile["route"] == "/api/v2/movie/{id}" and profile["size"] > 0
+    resp = client.get(f"/api/admin/profiles/{profile['name']}", headers=headers)
+    assert resp.is_success and resp.content
+    assert (
+        client.get("/api/admin/profiles/db.sqlite3", headers=headers).status_code == 404
+    )
+
+
+def test_precompressed_static_files(tmp_path):
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from backend.static import IndexPage, PrecompressedStaticFiles, precompress
+
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "assets" / "index-B3xk9a2Q.js").write_text("let movies = [];\n" * 200)
+    (tmp_path / "assets" / "site-manifest.json").write_text("{}")
+    (tmp_path / "my-template.html").write_text("<html></html>")
+    (tmp_path / "index.html").write_text("<html>" + "<p>movies</p>" * 200 + "</html>")
+    assert precompress(tmp_path) >= 2
+    assert precompress(tmp_path) == 0
+    index_page = IndexPage(tmp_path / "index.html")
+    static_app = FastAPI()
+
+    @static_app.get("/index")
+    async def index(request: Request):
+        return index_page.response(request.headers)
+
+    static_app.mount("/", PrecompressedStaticFiles(directory=tmp_path))
+    static_client = TestClient(static_app)
+    resp = static_client.get("/assets/index-B3xk9a2Q.js")
+    assert resp.headers["content-encoding"] == "gzip"
+    assert "immutable" in resp.headers["cache-control"]
+    assert resp.text.startswith("let movies")
+    for name in ("assets/site-manifest.json", "my-template.html"):
+        resp = static_client.get(f"/{name}")
+        assert resp.headers["cache-control"] == "no-cache"
+    for refused in ("gzip;q=0.0", "gzip; q=0.000, br;q=0 ", "*;q=0, identity"):
+        resp = static_client.get(
+            "/assets/index-B3xk9a2Q.js", headers={"Accept-Encoding": refused}
+        )
+        assert "content-encoding" not in resp.headers, refused
+    resp = static_client.get("/index", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in resp.headers and resp.text.startswith("<html>")
+    resp = static_client.get("/index", headers={"If-None-Match": resp.headers["etag"]})
+    assert resp.status_code == 304
+
+
+def test_fake_upstream(tmp_path):
+    import base64
+    import socket
+    import threading
+    import urllib.request
+    from backend.upstream import redirect_upstream, restore_upstream, rewrite
+    from benchmarks.fake_upstream import FakeUpstream, recording_key
+
+    server = FakeUpstream(("127.0.0.1", 0), recordings=tmp_path)
+    url = "https://fzmovies.net/csearch.php?searchname=love"
+    server.save(
+        recording_key("GET", "fzmovies.net", "/csearch.php?searchname=love", b""),
+        "GET",
+        url,
+        dict(
+            status=200,
+            headers=[("Content-Type", "text/html")],
+            body=base64.b64encode(b"<html>love</html>").decode(),
+        ),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        rewritten, headers = rewrite(url, server.url)
+        assert rewritten == f"{server.url}/csearch.php?searchname=love"
+        request = urllib.request.Request(rewritten, headers=headers)
+        with urllib.request.urlopen(request) as resp:
+            assert resp.read() == b"<html>love</html>"
+        # HEAD responses carry no body so the connection stays usable
+        with socket.create_connection(server.server_address[:2]) as sock:
+            for method in ("HEAD", "GET"):
+                sock.sendall(
+                    f"{method} /csearch.php?searchname=love HTTP/1.1\r\n"
+                    "Host: fzmovies.net\r\n\r\n".encode()
+                )
+            received = b""
+            while not received.endswith(b"<html>love</html>"):
+                received += sock.recv(4096)
+        assert received.split(b"\r\n\r\n", 1)[1].startswith(b"HTTP/1.1 200")
+        requests = pytest.importorskip("requests")
+        redirect_upstream(server.url)
+        try:
+            resp = requests.get(url)
+            assert resp.text == "<html>love</html>" and resp.url == url
+            assert requests.get("https://fzmovies.net/other").status_code == 404
+        finally:
+            restore_upstream()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_load_test_regressions():
+    from benchmarks.load_test import regressions
+
+    result = dict(rps=100, p95_ms=50, error_rate=0.05)
+    baseline = dict(v2_search=dict(rps=100, p95_ms=50, error_rate=0.04))
+    assert regressions(dict(v2_search=result), baseline, 0.25, 0.02) == []
+    assert regressions(dict(v2_search=result), {}, 0.25, 0.02, 0.05) == []
+    for found in (
+        regressions(dict(v2_search=result), {}, 0.25, 0.02),
+        regressions(dict(v2_search=result), baseline, 0.25, 0.005),
+    ):
+        assert len(found) == 1 and "errors 5.00%" in found[0]
@@ -1,3 +1,4 @@
+import json
 import pytest
 import fzmovies_api.models as fz_models
 import backend.v1.models as v1_models
@@ -37,6 +38,71 @@ def test_search_with_offset():
     assert len(modelled_without.movies) > len(modelled_with.movies)
 
 
+def test_search_with_deep_offset():
+    query = "wrong turn"
+    first_page = client.post("/api/v1/search", json=dict(q=query)).json()
+    resp = client.post("/api/v1/search", json=dict(q=query, limit=10, offset=45)).json()
+    modelled = fz_models.SearchResults(**resp)
+    assert 0 < len(modelled.movies) <= 15
+    assert str(modelled.movies[0].url) not in {
+        movie["url"] for movie in first_page["movies"]
+    }
+
+
+def test_search_deep_offset_skips_pages(monkeypatch):
+    requests = pytest.importorskip("requests")
+    from backend.cache import cache, make_key
+
+    search = dict(q="the", limit=20, offset=400)
+    cache.delete(make_key("v1:search", v1_models.Search(**search).model_dump()))
+    fetched = []
+    send = requests.Session.send
+
+    def counted_send(self, request, **kwargs):
+        fetched.append(request.url)
+        return send(self, request, **kwargs)
+
+    monkeypatch.setattr(requests.Session, "send", counted_send)
+    resp = client.post("/api/v1/search", json=search)
+    assert resp.is_success
+    # The first page for its links and the page holding offset 400, not 21 pages
+    assert len(fetched) <= 3
+
+
+def test_search_fan_out():
+    resp = client.post(
+        "/api/v1/search", json=dict(q="fan out", limit=20, fan_out=True)
+    ).json()
+    urls = [movie["url"] for movie in resp["movies"]]
+    assert len(urls) == len(set(urls)) == 20
+    resp = client.post(
+        "/api/v1/search/stream", json=dict(q="fan out", limit=20, fan_out=True)
+    )
+    assert resp.is_success
+    streamed = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(streamed) == 3
+
+
+def test_fan_out_keeps_pages_on_deadline():
+    import asyncio
+    from backend.deadlines import DeadlineExceeded
+    from backend.v1.routes import merge_pages
+
+    async def stream(*pages, late=True):
+        for page in pages:
+            yield page
+        if late:
+            raise DeadlineExceeded("Upstream deadline of search exceeded")
+
+    async def merged(*streams):
+        return [item async for item in merge_pages(list(streams))]
+
+    pages = asyncio.run(merged(stream("a", "b"), stream(), stream("c", late=False)))
+    assert sorted(pages) == [(0, "a"), (0, "b"), (2, "c")]
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(merged(stream(), stream(), stream()))
+
+
 def test_search_stream():
     resp = client.post(
         "/api/v1/search/stream",
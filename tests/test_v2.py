@@ -1,3 +1,6 @@
+import bisect
+import gzip
+import json
 import pytest
 from tests import client
 from backend.v1 import models as v1_models
@@ -53,3 +56,371 @@ def test_download_link_by_id():
     )
     assert resp.is_success
     v1_models.DownloadLink(**resp.json())
+
+
+def test_suggest():
+    resp = client.get("/api/v2/suggest", params=dict(q="lov", limit=5))
+    assert resp.is_success
+    modelled_resp = models.ShallowSearchResults(**resp.json())
+    assert 0 < len(modelled_resp.results) <= 5
+    assert all("lov" in movie.title.lower() for movie in modelled_resp.results)
+
+
+def test_suggest_wide_prefixes_precomputed(monkeypatch):
+    from backend.v2.indexes import TitleIndex, refresh
+
+    ranked = TitleIndex()
+    monkeypatch.setattr(TitleIndex, "max_ranked_range", 10**9)
+    refresh(ranked)
+    precomputed = TitleIndex()
+    monkeypatch.setattr(TitleIndex, "max_ranked_range", 8)
+    refresh(precomputed)
+    keys, _, _, _, tops, _, _, _ = precomputed._data
+    assert "the" in tops and not ranked._data[4]
+    for prefix in ("t", "th", "the", "the m", "lov", "zzz"):
+        assert precomputed.suggest(prefix, 10) == ranked.suggest(prefix, 10)
+        if prefix not in tops:
+            lo = bisect.bisect_left(keys, prefix)
+            assert bisect.bisect_left(keys, prefix + "\x7f", lo) - lo <= 8
+
+
+def test_suggest_ranks_by_flushed_hits():
+    from backend.v2.indexes import refresh, title_index
+    from backend.v2.popularity import popularity
+
+    refresh(title_index)
+    suggested = client.get("/api/v2/suggest", params=dict(q="the", limit=20)).json()
+    last = suggested["results"][-1]["id"]
+    for _ in range(100):
+        popularity.hit(last, "movie_views")
+    popularity.flush()
+    refresh(title_index)
+    suggested = client.get("/api/v2/suggest", params=dict(q="the", limit=20)).json()
+    assert suggested["results"][0]["id"] == last
+
+
+def test_take_over_during_build():
+    from backend.v2.indexes import TitleIndex, refresh
+
+    class ReloadedIndex(TitleIndex):
+        def build(self, session):
+            super().build(session)
+            # A dataset reload swaps its index in meanwhile
+            assert index.take_over(staged)
+
+    index, staged = ReloadedIndex(), TitleIndex()
+    staged._data = staged._data[:-1] + (["staged"],)
+    refresh(index, force=True)
+    assert index._data[-1] == ["staged"]
+    assert index.generation == 1
+
+
+def test_facets():
+    resp = client.post(
+        "/api/v2/facets",
+        json={"category": "Hollywood", "year": 2012, "distributions": ["BluRay"]},
+    )
+    assert resp.is_success
+    facets = models.FacetCounts(**resp.json())
+    assert facets.years[2012] >= facets.total
+    assert facets.distributions["BluRay"] == facets.total
+    unfiltered = client.post("/api/v2/facets", json={"query": "the"}).json()
+    for search in (
+        dict(query="the", category="Bollywood", genres=["History"]),
+        dict(query="the", genres=["Horror", "Action"]),
+        dict(query="the m", year_offset=2010),
+        dict(query="%"),
+        dict(description="murder", distributions=["BluRay", "WEB-DL"]),
+    ):
+        found = client.post("/api/v2/search", json=dict(search, limit=100)).json()
+        facets = client.post("/api/v2/facets", json=search).json()
+        assert facets["total"] == len(found["movies"])
+        if search.get("category"):
+            assert facets["categories"] == unfiltered["categories"]
+            assert facets["total"] == facets["categories"][search["category"]]
+        if search.get("genres"):
+            assert facets["total"] < unfiltered["total"]
+
+
+def test_similar_movies():
+    id = 1
+    resp = client.get(f"/api/v2/movie/{id}/similar", params=dict(limit=5))
+    assert resp.is_success
+    similar = models.SimilarMovies(**resp.json())
+    assert 0 < len(similar.movies) <= 5
+    assert id not in [movie.id for movie in similar.movies]
+
+
+def test_search_post_stream():
+    resp = client.post(
+        "/api/v2/search/stream",
+        json={"query": "the", "limit": 150, "offset": 0},
+    )
+    assert resp.is_success
+    lines = resp.text.splitlines()
+    assert 0 < len(lines) <= 150
+    for line in lines:
+        models.V2SearchResultsItem.model_validate_json(line)
+
+
+def test_export_catalog():
+    resp = client.get(
+        "/api/v2/export", params=dict(format="ndjson", after_id=10, until_id=20)
+    )
+    assert resp.is_success
+    ids = [json.loads(line)["id"] for line in resp.text.splitlines()]
+    assert ids == list(range(11, 21))
+    resp = client.get("/api/v2/export", params=dict(format="csv", gzip=True))
+    assert resp.is_success
+    assert gzip.decompress(resp.content).startswith(b"id,title,year")
+
+
+def test_export_genres_indexed():
+    from sqlalchemy import text
+    from backend import database
+
+    database.create_tables()
+    with database.engine.connect() as conn:
+        plan = conn.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT movie_id FROM movie_genre"
+                " WHERE movie_id BETWEEN 1 AND 100"
+            )
+        ).all()
+    assert any("ix_movie_genre_movie_id" in row[-1] for row in plan)
+
+
+def test_trusted_catalog_responses(monkeypatch):
+    from backend.config import config
+    from backend.v2.indexes import catalog_validation, refresh
+
+    refresh(catalog_validation)
+    assert catalog_validation.trusts([dict(id=5)])
+    search = dict(query="love", limit=20)
+    projected = dict(search, fields=["title", "cover_photo"], description_max_chars=50)
+
+    def responses():
+        return [
+            client.get("/api/v2/movie/5"),
+            client.get("/api/v2/movie/5", params=dict(fields="title,url")),
+            client.post("/api/v2/search", json=search),
+            client.post("/api/v2/search", json=projected),
+        ]
+
+    trusted = responses()
+    monkeypatch.setattr(config, "trust_validated_catalog", False)
+    validated = responses()
+    for trusted_resp, validated_resp in zip(trusted, validated):
+        assert trusted_resp.is_success
+        assert trusted_resp.json() == validated_resp.json()
+
+
+def test_catalog_validation_edited_rows():
+    from sqlalchemy import text
+    from backend.database import engine
+    from backend.v2.indexes import catalog_validation, refresh
+
+    refresh(catalog_validation)
+    with engine.begin() as conn:
+        url = conn.execute(text("SELECT url FROM movie WHERE id = 5")).scalar()
+        conn.execute(text("UPDATE movie SET url = 'edited' WHERE id = 5"))
+    try:
+        refresh(catalog_validation)
+        assert not catalog_validation.trusts([dict(id=5)])
+    finally:
+        with engine.begin() as conn:
+            conn.execute(
+                text("UPDATE movie SET url = :url WHERE id = 5"), dict(url=url)
+            )
+    refresh(catalog_validation)
+    assert catalog_validation.trusts([dict(id=5)])
+
+
+def test_download_link_missing_quality_is_cached(monkeypatch):
+    from types import SimpleNamespace
+    from backend.cache import cache, make_key
+    from backend.database import dataset
+    from backend.v2 import routes
+
+    calls = []
+
+    def navigate(url):
+        calls.append(url)
+        return SimpleNamespace(files=[])
+
+    monkeypatch.setattr(routes, "navigate", navigate)
+    cache.delete(make_key("v2:download-link:failure", dataset.version, 9, "best"))
+    for _ in range(2):
+        resp = client.get("/api/v2/download-link/9", params=dict(quality="best"))
+        assert resp.status_code == 404
+    assert len(calls) == 1
+
+
+def test_search_by_popularity():
+    from backend.v2.popularity import popularity
+
+    for _ in range(10):
+        client.get("/api/v2/movie/7")
+    # Beyond hits counted by other tests
+    for _ in range(1_000):
+        popularity.hit(7, "movie_views")
+    popularity.flush()
+    resp = client.post("/api/v2/search", json=dict(order_by="popularity", limit=5))
+    assert resp.is_success
+    assert resp.json()["movies"][0]["id"] == 7
+
+
+def test_hybrid_search():
+    from backend.metrics import metrics
+
+    payload = dict(query="Hybridonly", category="Hollywood", limit=5)
+    resp = client.post("/api/v2/search/hybrid", json=payload)
+    assert resp.is_success
+    first = resp.json()
+    assert len(first["movies"]) == 5 and first["upstream"] == 5
+    upstream_searches = metrics.get("hybrid.upstream_searches")
+    resp = client.post("/api/v2/search/hybrid", json=payload)
+    assert resp.json()["upstream"] == 0 and len(resp.json()["movies"]) == 5
+    assert metrics.get("hybrid.upstream_searches") == upstream_searches
+
+
+def test_hybrid_search_exhausted_upstream():
+    from backend.database import ReaderSession
+    from backend.metrics import metrics
+    from backend.v2.indexes import dataset_fingerprint
+
+    with ReaderSession() as session:
+        fingerprint = dataset_fingerprint(session)
+    payload = dict(query="Hybridexhausted", category="Hollywood", limit=100)
+    assert client.post("/api/v2/search/hybrid", json=payload).is_success
+    upstream_searches = metrics.get("hybrid.upstream_searches")
+    resp = client.post("/api/v2/search/hybrid", json=payload)
+    assert resp.is_success and resp.json()["upstream"] == 0
+    assert metrics.get("hybrid.upstream_searches") == upstream_searches
+    with ReaderSession() as session:
+        assert dataset_fingerprint(session) == fingerprint
+
+
+def test_cover_proxy(monkeypatch, tmp_path):
+    import backend.v2.covers as covers
+    from backend.config import config
+
+    downloads = []
+
+    def download(url):
+        downloads.append(url)
+        return b"\x89PNG\r\n\x1a\n" + b"0" * 64
+
+    monkeypatch.setattr(covers, "download", download)
+    monkeypatch.setattr(covers, "store", covers.CoverStore())
+    monkeypatch.setattr(config, "cover_cache_directory", str(tmp_path))
+    resp = client.get("/api/v2/cover/5", params=dict(size="original"))
+    assert resp.is_success and resp.headers["content-type"] == "image/png"
+    assert "max-age" in resp.headers["cache-control"]
+    resp = client.get(
+        "/api/v2/cover/5",
+        params=dict(size="original"),
+        headers={"If-None-Match": resp.headers["etag"]},
+    )
+    assert resp.status_code == 304
+    assert len(downloads) == 1
+
+    monkeypatch.setattr(config, "cover_proxy_url", "https://movies.example.com/")
+    movie = client.get("/api/v2/movie/5").json()
+    assert movie["cover_photo"].startswith(
+        "https://movies.example.com/api/v2/cover/5?size="
+    )
+
+
+def test_field_projection():
+    whole_resp = client.post("/api/v2/search", json=dict(query="the", limit=20))
+    whole = whole_resp.json()
+    resp = client.post(
+        "/api/v2/search",
+        json=dict(
+            query="the",
+            limit=20,
+            fields=["title", "genres", "description"],
+            description_max_chars=40,
+        ),
+    )
+    assert resp.is_success
+    movies = resp.json()["movies"]
+    assert [movie["id"] for movie in movies] == [
+        movie["id"] for movie in whole["movies"]
+    ]
+    for movie, full in zip(movies, whole["movies"]):
+        assert set(movie) == {"id", "title", "genres", "description"}
+        assert movie["genres"] == full["genres"]
+        assert len(movie["description"] or "") <= 40
+    assert len(resp.content) < len(whole_resp.content)
+    resp = client.post(
+        "/api/v2/search/stream",
+        json=dict(query="the", limit=150, fields=["category"]),
+    )
+    assert all(
+        set(json.loads(line)) == {"id", "category"} for line in resp.text.splitlines()
+    )
+    resp = client.get("/api/v2/movie/1", params=dict(fields="title,year"))
+    assert set(resp.json()) == {"id", "title", "year"}
+    resp = client.get("/api/v2/movie/1", params=dict(fields="title,rating"))
+    assert resp.status_code == 400
+
+
+def test_cover_download_allowed_hosts(monkeypatch):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import backend.v2.covers as covers
+    from backend.config import config
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/redirect"):
+                self.send_response(302)
+                self.send_header("Location", self.path.split("to=", 1)[1])
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.end_headers()
+            self.wfile.write(b"\x89PNG\r\n\x1a\n")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with pytest.raises(covers.InvalidCover):
+            covers.download(f"{base}/cover.png")
+        monkeypatch.setattr(config, "cover_allowed_hosts", "fzmovies.net,127.0.0.1")
+        assert covers.download(f"{base}/cover.png").startswith(b"\x89PNG")
+        assert covers.download(f"{base}/redirect?to={base}/cover.png")
+        with pytest.raises(covers.InvalidCover):
+            covers.download(f"{base}/redirect?to=http://169.254.169.254/latest")
+        assert not covers.allowed("http://fzmovies.net.example.com/a.jpg")
+        assert covers.allowed("https://www.fzmovies.net/imdb_images/a.jpg")
+        assert not covers.allowed("file:///etc/passwd")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cover_thumbnail(monkeypatch, tmp_path):
+    import io
+    import backend.v2.covers as covers
+    from backend.config import config
+
+    Image = pytest.importorskip("PIL.Image")
+    original = io.BytesIO()
+    Image.new("RGB", (800, 1200), "red").save(original, format="PNG")
+    monkeypatch.setattr(covers, "download", lambda url: original.getvalue())
+    monkeypatch.setattr(covers, "store", covers.CoverStore())
+    monkeypatch.setattr(config, "cover_cache_directory", str(tmp_path))
+    resp = client.get("/api/v2/cover/5", params=dict(size="small"))
+    assert resp.is_success and resp.headers["content-type"] == "image/jpeg"
+    thumbnail = Image.open(io.BytesIO(resp.content))
+    assert thumbnail.width == covers.sizes["small"]
+    assert thumbnail.height == covers.sizes["small"] * 3 // 2
+    assert len(list(tmp_path.glob("5-*-small.cover"))) == 1